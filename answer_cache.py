@@ -0,0 +1,157 @@
+"""
+Answer Cache
+Exact and semantic cache of generated answers, keyed by knowledge-base version
+"""
+
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from metrics import metrics
+
+
+class AnswerCache:
+    """
+    In-memory LRU cache of answers to previously asked questions
+    
+    Entries are keyed by the knowledge-base version, so any change to the
+    underlying documents makes old answers unreachable. A lookup first tries
+    the normalized question text and then, given the question embedding, the
+    most similar past question of the same version above a cosine threshold.
+    """
+    
+    def __init__(self, max_entries=1000, similarity_threshold=0.95):
+        """
+        Initialize the cache
+        
+        Args:
+            max_entries: Maximum number of cached answers
+            similarity_threshold: Minimum cosine similarity for a semantic hit
+        """
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def normalize(question):
+        """Normalize a question for exact matching"""
+        question = re.sub(r"\s+", " ", question.strip().lower())
+        return question.rstrip(" ?!.")
+    
+    @staticmethod
+    def _unit(embedding):
+        """Return the embedding as a unit-length float32 vector"""
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+    
+    def get_exact(self, version, question):
+        """
+        Look up an answer by exact (normalized) question text
+        
+        Args:
+            version: Knowledge-base version
+            question: User's question
+            
+        Returns:
+            Cached entry dict with 'answer', 'source_docs' and
+            'found_in_docs', or None
+        """
+        key = (version, self.normalize(question))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            self.exact_hits += 1
+        metrics.increment("cache_lookups", cache="answers", result="exact_hit")
+        return entry
+    
+    def get_similar(self, version, embedding):
+        """
+        Look up an answer by question embedding similarity
+        
+        Call after get_exact() missed; counts a miss when nothing matches.
+        
+        Args:
+            version: Knowledge-base version
+            embedding: Embedding of the user's question
+            
+        Returns:
+            Cached entry dict, or None
+        """
+        query = self._unit(embedding)
+        with self._lock:
+            keys = [
+                key for key, entry in self._entries.items()
+                if key[0] == version and entry['embedding'] is not None
+            ]
+            if keys:
+                matrix = np.stack([self._entries[key]['embedding'] for key in keys])
+                scores = matrix @ query
+                best = int(np.argmax(scores))
+                if scores[best] >= self.similarity_threshold:
+                    self._entries.move_to_end(keys[best])
+                    self.semantic_hits += 1
+                    metrics.increment("cache_lookups", cache="answers", result="semantic_hit")
+                    return self._entries[keys[best]]
+            
+            self.misses += 1
+        metrics.increment("cache_lookups", cache="answers", result="miss")
+        return None
+    
+    def record_miss(self):
+        """Count a miss for a lookup that stopped after get_exact()"""
+        with self._lock:
+            self.misses += 1
+        metrics.increment("cache_lookups", cache="answers", result="miss")
+    
+    def put(self, version, question, embedding, answer, source_docs, found_in_docs):
+        """
+        Cache an answer
+        
+        Args:
+            version: Knowledge-base version the answer was generated against
+            question: User's question
+            embedding: Embedding of the question, or None to cache the
+                answer for exact matches only
+            answer: Generated answer
+            source_docs: Documents the answer was generated from
+            found_in_docs: Whether the answer was grounded in the documents
+        """
+        key = (version, self.normalize(question))
+        with self._lock:
+            self._entries[key] = {
+                'answer': answer,
+                'source_docs': source_docs,
+                'found_in_docs': found_in_docs,
+                'embedding': None if embedding is None else self._unit(embedding)
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def stats(self):
+        """
+        Cache counters
+        
+        Returns:
+            Dict with 'exact_hits', 'semantic_hits', 'misses', 'hit_rate'
+            and 'entries'
+        """
+        hits = self.exact_hits + self.semantic_hits
+        total = hits + self.misses
+        return {
+            'exact_hits': self.exact_hits,
+            'semantic_hits': self.semantic_hits,
+            'misses': self.misses,
+            'hit_rate': hits / total if total else 0.0,
+            'entries': len(self._entries)
+        }
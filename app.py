@@ -5,10 +5,75 @@ Main entry point for the RAG-powered chatbot
 
 import streamlit as st
 import os
+from googleapiclient.errors import HttpError
 from auth_manager import AuthManager
 from google_docs_manager import GoogleDocsManager
-from rag_system import RAGSystem
-from config import CREDENTIALS_FILE, GOOGLE_CREDENTIALS_JSON, TOKEN_FILE
+from knowledge_base_registry import KnowledgeBaseRegistry
+from drive_sync import DriveChangeSync
+from document_structure import render_segments
+from metrics import metrics
+from config import (
+    CREDENTIALS_FILE,
+    GOOGLE_CREDENTIALS_JSON,
+    TOKEN_FILE,
+    METRICS_PORT,
+    METRICS_JSONL_PATH,
+    METRICS_DEBUG_PANEL,
+    DOCUMENT_LIST_RENDER_BATCH
+)
+
+
+@st.cache_resource
+def get_knowledge_base_registry():
+    """
+    Process-wide registry of knowledge bases shared by all sessions and reruns
+    
+    Each user's selection gets its own persisted collection, which is
+    reopened after a restart instead of being re-embedded.
+    """
+    return KnowledgeBaseRegistry()
+
+
+@st.cache_resource
+def start_metrics_exporters():
+    """Start the configured metrics exporters once per process"""
+    if METRICS_JSONL_PATH:
+        metrics.open_jsonl(METRICS_JSONL_PATH)
+    if METRICS_PORT:
+        return metrics.start_http_server(METRICS_PORT)
+    return None
+
+
+def render_debug_panel():
+    """Sidebar panel with per-stage timings and counters for this process"""
+    snapshot = metrics.snapshot()
+    with st.sidebar.expander("🔧 Debug: stage timings and counters"):
+        span_rows = [
+            {
+                'stage': name + (f" {item['labels']}" if item['labels'] else ""),
+                'count': item['count'],
+                'p50 ms': round(item['p50_seconds'] * 1000, 1),
+                'p95 ms': round(item['p95_seconds'] * 1000, 1),
+                'total s': round(item['total_seconds'], 2),
+                'errors': item['errors']
+            }
+            for name, series in sorted(snapshot['spans'].items())
+            for item in series
+        ]
+        counter_rows = [
+            {
+                'counter': name + (f" {item['labels']}" if item['labels'] else ""),
+                'value': item['value']
+            }
+            for name, series in sorted(snapshot['counters'].items())
+            for item in series
+        ]
+        if span_rows:
+            st.dataframe(span_rows, hide_index=True)
+        if counter_rows:
+            st.dataframe(counter_rows, hide_index=True)
+        if not span_rows and not counter_rows:
+            st.caption("Nothing recorded yet")
 
 
 def initialize_session_state():
@@ -21,6 +86,8 @@ def initialize_session_state():
         st.session_state.docs_manager = None
     if 'documents' not in st.session_state:
         st.session_state.documents = []
+    if 'documents_page_token' not in st.session_state:
+        st.session_state.documents_page_token = None
     if 'selected_docs' not in st.session_state:
         st.session_state.selected_docs = []
     if 'rag_system' not in st.session_state:
@@ -29,6 +96,12 @@ def initialize_session_state():
         st.session_state.knowledge_base_created = False
     if 'chat_history' not in st.session_state:
         st.session_state.chat_history = []
+    if 'drive_sync' not in st.session_state:
+        st.session_state.drive_sync = None
+    if 'user_id' not in st.session_state:
+        st.session_state.user_id = None
+    if 'knowledge_base_doc_ids' not in st.session_state:
+        st.session_state.knowledge_base_doc_ids = []
 
 
 def main():
@@ -40,6 +113,7 @@ def main():
     )
     
     initialize_session_state()
+    start_metrics_exporters()
     
     st.title("🤖 RAG-Powered Chatbot with Google Docs Integration")
     st.markdown("---")
@@ -144,7 +218,53 @@ def main():
             if st.button("🔄 Refresh Documents List", type="primary"):
                 with st.spinner("Loading your Google Docs..."):
                     try:
-                        docs = st.session_state.docs_manager.list_documents()
+                        docs_manager = st.session_state.docs_manager
+                        known_docs = {doc['id']: doc for doc in st.session_state.documents}
+                        changes = None
+                        if st.session_state.documents_page_token:
+                            # After the first load, apply the Drive changes feed:
+                            # it also reports trashed and deleted documents
+                            try:
+                                changes, new_token = docs_manager.list_changes(
+                                    st.session_state.documents_page_token
+                                )
+                            except HttpError:
+                                changes = None  # e.g. an expired token; list everything
+                        
+                        if changes is not None:
+                            for change in changes:
+                                if change['removed'] or change['trashed'] or not change['is_document']:
+                                    known_docs.pop(change['id'], None)
+                                else:
+                                    known_docs[change['id']] = {
+                                        'id': change['id'],
+                                        'name': change['name'],
+                                        'modified_time': change['modified_time']
+                                    }
+                            st.session_state.documents_page_token = new_token
+                        else:
+                            # Take the cursor before listing so that nothing
+                            # changed during the listing is missed next time
+                            new_token = docs_manager.get_start_page_token()
+                            known_docs = {}
+                            
+                            # Show names page by page while the rest is still
+                            # loading; replaced by the selectable list below
+                            listing = st.empty()
+                            with listing.container():
+                                progress = st.empty()
+                                page = []
+                                for doc in docs_manager.iter_documents():
+                                    known_docs[doc['id']] = doc
+                                    page.append(doc['name'])
+                                    if len(page) == DOCUMENT_LIST_RENDER_BATCH:
+                                        progress.caption(f"Loaded {len(known_docs)} documents...")
+                                        st.text('\n'.join(page))
+                                        page = []
+                            listing.empty()
+                            st.session_state.documents_page_token = new_token
+                        
+                        docs = sorted(known_docs.values(), key=lambda d: d['modified_time'], reverse=True)
                         st.session_state.documents = docs
                         st.success(f"Found {len(docs)} documents!")
                     except Exception as e:
@@ -175,22 +295,56 @@ def main():
                     else:
                         with st.spinner("Creating knowledge base..."):
                             try:
-                                # Fetch content for selected documents
-                                documents_data = []
-                                for doc in st.session_state.documents:
-                                    if doc['id'] in selected_doc_ids:
-                                        content = st.session_state.docs_manager.get_document_content(doc['id'])
-                                        documents_data.append({
-                                            'id': doc['id'],
-                                            'name': doc['name'],
-                                            'content': content
-                                        })
+                                # Take the changes cursor before fetching so that edits made
+                                # during the build are picked up by the background sync
+                                page_token = st.session_state.docs_manager.get_start_page_token()
                                 
-                                # Initialize RAG system
-                                rag_system = RAGSystem()
-                                rag_system.create_knowledge_base(documents_data)
+                                selected = [doc for doc in st.session_state.documents if doc['id'] in selected_doc_ids]
+                                versions = {doc['id']: doc['modified_time'] for doc in selected}
+                                if not st.session_state.user_id:
+                                    st.session_state.user_id = st.session_state.docs_manager.get_user_id()
+                                rag_system = get_knowledge_base_registry().get(
+                                    st.session_state.user_id, selected_doc_ids
+                                )
+                                
+                                # Reuse the existing knowledge base when the selection is unchanged
+                                if not rag_system.has_knowledge_base(versions):
+                                    # Fetch content for selected documents concurrently and
+                                    # index each one as it arrives
+                                    selected_by_id = {doc['id']: doc for doc in selected}
+                                    documents_data = (
+                                        {
+                                            'id': doc_id,
+                                            'name': selected_by_id[doc_id]['name'],
+                                            # None when the fetch failed; the
+                                            # document's indexed chunks are kept
+                                            'content': render_segments(segments) if segments is not None else None,
+                                            'segments': segments,
+                                            'modified_time': selected_by_id[doc_id]['modified_time']
+                                        }
+                                        for doc_id, segments in st.session_state.docs_manager.iter_documents_segments(
+                                            selected_doc_ids, versions=versions
+                                        )
+                                    )
+                                    
+                                    rag_system.create_knowledge_base(documents_data, incremental=True)
                                 st.session_state.rag_system = rag_system
+                                st.session_state.knowledge_base_doc_ids = selected_doc_ids
                                 st.session_state.knowledge_base_created = True
+                                
+                                # Keep the knowledge base in step with edits and deletions.
+                                # The changes feed is per user, so the cursor lives in the session.
+                                if st.session_state.drive_sync:
+                                    st.session_state.drive_sync.stop()
+                                st.session_state.drive_sync = DriveChangeSync(
+                                    st.session_state.docs_manager,
+                                    rag_system,
+                                    {doc['id']: doc['name'] for doc in selected},
+                                    state_file=None,
+                                    page_token=page_token,
+                                    registry=get_knowledge_base_registry()
+                                )
+                                st.session_state.drive_sync.start()
                                 st.success(f"✅ Knowledge base created with {len(selected_doc_ids)} document(s)!")
                                 st.rerun()
                             except Exception as e:
@@ -216,18 +370,32 @@ def main():
                 
                 if st.session_state.knowledge_base_created:
                     st.info(f"📚 Knowledge base ready with {len(st.session_state.selected_docs)} document(s)")
+                    sync = st.session_state.drive_sync
+                    if sync and sync.last_stats and (sync.last_stats['updated'] or sync.last_stats['removed']
+                                                     or sync.last_stats['failed']):
+                        st.caption(
+                            f"🔁 Last Drive sync: {sync.last_stats['updated']} updated, "
+                            f"{sync.last_stats['removed']} removed, "
+                            f"{sync.last_stats['failed']} could not be fetched (will retry)"
+                        )
             else:
                 st.info("Click 'Refresh Documents List' to load your Google Docs")
             
             # Logout button
             if st.button("🚪 Logout"):
+                if st.session_state.drive_sync:
+                    st.session_state.drive_sync.stop()
+                    st.session_state.drive_sync = None
                 st.session_state.authenticated = False
                 st.session_state.credentials = None
                 st.session_state.docs_manager = None
                 st.session_state.documents = []
+                st.session_state.documents_page_token = None
                 st.session_state.selected_docs = []
                 st.session_state.rag_system = None
                 st.session_state.knowledge_base_created = False
+                st.session_state.knowledge_base_doc_ids = []
+                st.session_state.user_id = None
                 st.session_state.chat_history = []
                 st.rerun()
         
@@ -253,35 +421,51 @@ def main():
                 st.session_state.chat_history.append(("user", user_question))
                 st.chat_message("user").write(user_question)
                 
-                # Get answer from RAG system
-                with st.spinner("Thinking..."):
+                # Get answer from RAG system, streaming tokens as they arrive
+                with st.chat_message("assistant"):
                     try:
-                        answer, source_docs, found_in_docs = st.session_state.rag_system.query(user_question)
+                        # Keep this session's collection from being garbage-collected
+                        st.session_state.rag_system = get_knowledge_base_registry().get(
+                            st.session_state.user_id, st.session_state.knowledge_base_doc_ids
+                        )
+                        
+                        with st.spinner("Searching your documents..."):
+                            source_docs, found_in_docs, answer_stream = (
+                                st.session_state.rag_system.stream_query(user_question)
+                            )
                         
-                        # Format response with fallback handling
+                        # Format response with fallback handling. Fallback answers come
+                        # from the same generation, so there is no second LLM call.
                         if found_in_docs:
-                            response = answer
+                            response = st.write_stream(answer_stream)
                             if source_docs:
-                                response += "\n\n📄 **Sources:**\n"
+                                sources = "\n\n📄 **Sources:**\n"
                                 unique_docs = {}
                                 for doc in source_docs:
                                     doc_name = doc.metadata.get('document_name', 'Unknown')
                                     if doc_name not in unique_docs:
                                         unique_docs[doc_name] = True
                                 for doc_name in unique_docs.keys():
-                                    response += f"- {doc_name}\n"
+                                    sources += f"- {doc_name}\n"
+                                response += sources
+                                st.write(sources)
+                            context_stats = st.session_state.rag_system.last_context_stats
+                            if context_stats:
+                                st.caption(
+                                    f"🧮 Context: {context_stats['tokens']} prompt tokens, "
+                                    f"{context_stats['tokens_saved']} saved by context packing"
+                                )
                         else:
                             # Explicit fallback
                             response = (
                                 "⚠️ **I couldn't find an answer to your question in your selected documents.**\n\n"
                                 "Here's what I know from my general knowledge:\n\n"
                             )
-                            fallback_answer = st.session_state.rag_system.generate_fallback_answer(user_question)
-                            response += fallback_answer
+                            st.write(response)
+                            response += st.write_stream(answer_stream)
                         
                         # Add assistant response to chat
                         st.session_state.chat_history.append(("assistant", response))
-                        st.chat_message("assistant").write(response)
                         
                     except Exception as e:
                         error_msg = str(e)
@@ -298,13 +482,16 @@ def main():
                             error_display = f"❌ **Error:** {error_msg}"
                         
                         st.session_state.chat_history.append(("assistant", error_display))
-                        st.chat_message("assistant").write(error_display)
+                        st.write(error_display)
             
             # Clear chat button
             if st.session_state.chat_history:
                 if st.button("🗑️ Clear Chat History"):
                     st.session_state.chat_history = []
                     st.rerun()
+        
+        if METRICS_DEBUG_PANEL:
+            render_debug_panel()
 
 
 if __name__ == "__main__":
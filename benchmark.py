@@ -0,0 +1,556 @@
+"""
+Benchmark
+Offline build and query benchmark with fake embeddings, LLM and Google APIs
+
+Usage:
+    python benchmark.py --documents 200 --questions 100 --output bench.json
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import chromadb
+import numpy as np
+from chromadb.config import Settings
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from pydantic import PrivateAttr
+
+from document_cache import DocumentContentCache
+from document_structure import render_segments
+from embedding_backends import HashingEmbeddings
+from embedding_cache import CachedEmbeddings
+from google_docs_manager import GoogleDocsManager
+from keyword_index import tokenize
+from rag_system import RAGSystem
+from config import TOP_K_RESULTS, HYBRID_CANDIDATES
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Deterministic bag-of-words embeddings via feature hashing
+    
+    Texts sharing words get similar vectors, so retrieval behaves sensibly
+    without a model or network access.
+    """
+    
+    def __init__(self, dimensions=256, latency=0.0):
+        """
+        Args:
+            dimensions: Vector size
+            latency: Seconds slept per call, to simulate an API round-trip
+        """
+        self.dimensions = dimensions
+        self.latency = latency
+        self.document_calls = 0
+        self.query_calls = 0
+        self.texts_embedded = 0
+        self._lock = threading.Lock()
+    
+    def _embed(self, text):
+        """Hash each token into a signed bucket and normalize"""
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for token in tokenize(text):
+            digest = hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest()
+            value = int.from_bytes(digest, 'little')
+            vector[value % self.dimensions] += 1.0 if value >> 63 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+    
+    def embed_documents(self, texts):
+        with self._lock:
+            self.document_calls += 1
+            self.texts_embedded += len(texts)
+        time.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+    
+    def embed_query(self, text):
+        with self._lock:
+            self.query_calls += 1
+        time.sleep(self.latency)
+        return self._embed(text)
+
+
+class FakeChatModel(BaseChatModel):
+    """Chat model that answers with the start of the prompt's context"""
+    
+    latency: float = 0.0
+    calls: int = 0
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    
+    @property
+    def _llm_type(self):
+        return "fake-benchmark"
+    
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        prompt = messages[-1].content
+        context = prompt.split("Context:", 1)[-1].split()
+        answer = "According to the documents, " + " ".join(context[:40])
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=answer))])
+
+
+class _FakeRequest:
+    """Stands in for a googleapiclient HttpRequest, JSON body included"""
+    
+    def __init__(self, handler):
+        self._handler = handler
+        self.postproc = lambda response, content: json.loads(content)
+    
+    def execute(self):
+        return self.postproc(None, json.dumps(self._handler()).encode('utf-8'))
+
+
+class SyntheticCorpus:
+    """
+    Deterministic corpus of Google Docs API documents
+    
+    Each document has a title, headed sections of paragraphs and a small
+    table, and one ERR-style code per section for exact-term queries.
+    """
+    
+    def __init__(self, documents=50, sections=8, paragraphs=5, words=60, seed=0):
+        """
+        Args:
+            documents: Number of documents
+            sections: Sections per document
+            paragraphs: Paragraphs per section
+            words: Words per paragraph
+            seed: Seed that makes the corpus reproducible
+        """
+        self.documents = documents
+        self.sections = sections
+        self.paragraphs = paragraphs
+        self.words = words
+        self.seed = seed
+        
+        rng = random.Random(seed)
+        syllables = ["ka", "lo", "mi", "ne", "ru", "sa", "te", "vo", "zi", "pa", "do", "fe"]
+        self.vocabulary = sorted({
+            "".join(rng.choice(syllables) for _ in range(rng.randint(2, 4)))
+            for _ in range(3000)
+        })
+    
+    def document_id(self, index):
+        """ID of the index-th document"""
+        return f"doc{index:06d}"
+    
+    @staticmethod
+    def code(index, section):
+        """Error code planted in a section"""
+        return f"ERR-{index:05d}-{section:02d}"
+    
+    def _rng(self, index):
+        """Per-document random source, so documents can be built in any order"""
+        return random.Random(f"{self.seed}:{index}")
+    
+    def _sentence(self, rng, count):
+        """Random sentence of count vocabulary words"""
+        return " ".join(rng.choice(self.vocabulary) for _ in range(count)) + "."
+    
+    def document(self, index):
+        """Build one document in Docs API JSON form"""
+        rng = self._rng(index)
+        content = []
+        position = 1
+        
+        def paragraph(text, style="NORMAL_TEXT"):
+            nonlocal position
+            text += "\n"
+            content.append({
+                'startIndex': position,
+                'endIndex': position + len(text),
+                'paragraph': {
+                    'elements': [{'textRun': {'content': text}}],
+                    'paragraphStyle': {'namedStyleType': style}
+                }
+            })
+            position += len(text)
+        
+        paragraph(f"Synthetic document {index}", "TITLE")
+        for section in range(self.sections):
+            paragraph(f"Section {section} {rng.choice(self.vocabulary)}", "HEADING_1")
+            for number in range(self.paragraphs):
+                text = self._sentence(rng, self.words)
+                if number == 0:
+                    text += f" Error {self.code(index, section)} means {self._sentence(rng, 8)}"
+                paragraph(text)
+        
+        rows = [[rng.choice(self.vocabulary) for _ in range(3)] for _ in range(4)]
+        content.append({
+            'startIndex': position,
+            'endIndex': position + 1,
+            'table': {'tableRows': [
+                {'tableCells': [
+                    {'content': [{'paragraph': {'elements': [{'textRun': {'content': cell}}]}}]}
+                    for cell in row
+                ]}
+                for row in rows
+            ]}
+        })
+        return {'documentId': self.document_id(index), 'body': {'content': content}}
+    
+    def questions(self, count):
+        """
+        Questions over the corpus; every fourth asks about an error code
+        
+        Returns:
+            List of question strings
+        """
+        rng = random.Random(f"{self.seed}:questions")
+        questions = []
+        for number in range(count):
+            index = rng.randrange(self.documents)
+            section = rng.randrange(self.sections)
+            if number % 4 == 0:
+                questions.append(f"What does {self.code(index, section)} mean?")
+            else:
+                # The first paragraph of the section (after title and heading)
+                element = self.document(index)['body']['content'][2 + section * (self.paragraphs + 1)]
+                text = element['paragraph']['elements'][0]['textRun']['content'].split()
+                start = rng.randrange(max(len(text) - 12, 1))
+                questions.append("What is said about " + " ".join(text[start:start + 12]) + "?")
+        return questions
+
+
+class FakeDriveService:
+    """Minimal Drive v3 service over a SyntheticCorpus"""
+    
+    def __init__(self, corpus, modified_time="2024-01-01T00:00:00.000Z"):
+        self.corpus = corpus
+        self.modified_time = modified_time
+        self.calls = 0
+    
+    def files(self):
+        return self
+    
+    def about(self):
+        return self
+    
+    def list(self, pageSize=1000, pageToken=None, **kwargs):
+        def handler():
+            self.calls += 1
+            start = int(pageToken or 0)
+            end = min(start + pageSize, self.corpus.documents)
+            page = {'files': [
+                {
+                    'id': self.corpus.document_id(index),
+                    'name': f"Synthetic document {index}",
+                    'modifiedTime': self.modified_time
+                }
+                for index in range(start, end)
+            ]}
+            if end < self.corpus.documents:
+                page['nextPageToken'] = str(end)
+            return page
+        return _FakeRequest(handler)
+    
+    def get(self, **kwargs):
+        def handler():
+            self.calls += 1
+            return {'user': {'permissionId': 'benchmark-user'}}
+        return _FakeRequest(handler)
+
+
+class FakeDocsService:
+    """Minimal Docs v1 service over a SyntheticCorpus"""
+    
+    def __init__(self, corpus, latency=0.0):
+        self.corpus = corpus
+        self.latency = latency
+        self.calls = 0
+        self.bytes_fetched = 0
+        self._lock = threading.Lock()
+    
+    def documents(self):
+        return self
+    
+    def get(self, documentId):
+        def handler():
+            time.sleep(self.latency)
+            doc = self.corpus.document(int(documentId[3:]))
+            with self._lock:
+                self.calls += 1
+                self.bytes_fetched += len(json.dumps(doc))
+            return doc
+        return _FakeRequest(handler)
+
+
+def _max_rss_mb():
+    """Peak resident set size of this process so far, in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _git_commit():
+    """Current commit hash, so results can be compared across commits"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _percentiles(latencies):
+    """Latency summary in milliseconds"""
+    values = np.asarray(latencies) * 1000.0
+    if not len(values):
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'p50_ms': float(np.percentile(values, 50)),
+        'p95_ms': float(np.percentile(values, 95)),
+        'mean_ms': float(values.mean()),
+        'max_ms': float(values.max())
+    }
+
+
+def run_benchmark(documents=50, sections=8, paragraphs=5, questions=50,
+                  embedding_dimensions=256, embedding_latency=0.0, llm_latency=0.0,
+                  fetch_latency=0.0, trace_memory=False, seed=0,
+                  embedding_backend="fake", vector_store="chroma",
+                  vector_precision="float32", search_dimensions=None):
+    """
+    Build a knowledge base from a synthetic corpus and query it
+    
+    Everything runs offline in a temporary directory: Chroma, the embedding
+    cache and the document cache start empty on every run.
+    
+    Args:
+        documents: Number of synthetic documents
+        sections: Sections per document
+        paragraphs: Paragraphs per section
+        questions: Number of queries to run
+        embedding_dimensions: Size of the fake embedding vectors
+        embedding_latency: Seconds of simulated latency per embedding call
+        llm_latency: Seconds of simulated latency per LLM call
+        fetch_latency: Seconds of simulated latency per Docs API call
+        trace_memory: Also report Python heap peaks via tracemalloc
+            (slows the run down)
+        seed: Corpus seed
+        embedding_backend: "fake" (bag-of-words vectors behind the
+            embedding cache, with simulated latency) or "local" (the
+            HashingEmbeddings backend, uncached)
+        vector_store: "chroma" or "numpy" (see RAGSystem)
+        vector_precision: Search matrix precision of the numpy store
+        search_dimensions: Optional truncated search dimensions of the
+            numpy store
+        
+    Returns:
+        Results dict (see README)
+    """
+    corpus = SyntheticCorpus(documents, sections, paragraphs, seed=seed)
+    drive = FakeDriveService(corpus)
+    docs = FakeDocsService(corpus, latency=fetch_latency)
+    fake_embeddings = FakeEmbeddings(embedding_dimensions, latency=embedding_latency)
+    llm = FakeChatModel(latency=llm_latency)
+    
+    with tempfile.TemporaryDirectory() as workdir:
+        if embedding_backend == "local":
+            embeddings = HashingEmbeddings(dimensions=embedding_dimensions)
+        elif embedding_backend == "fake":
+            embeddings = CachedEmbeddings(
+                fake_embeddings,
+                model_name=f"fake-{embedding_dimensions}",
+                cache_path=os.path.join(workdir, "embeddings.sqlite3")
+            )
+        else:
+            raise ValueError(f"Unknown benchmark embedding backend {embedding_backend!r}")
+        client = chromadb.PersistentClient(
+            path=os.path.join(workdir, "chroma"),
+            settings=Settings(anonymized_telemetry=False)
+        )
+        manager = GoogleDocsManager(
+            None, drive_service=drive, docs_service=docs,
+            content_cache=DocumentContentCache(os.path.join(workdir, "documents.sqlite3"))
+        )
+        store_options = {
+            'vector_store_backend': vector_store,
+            'numpy_store_path': os.path.join(workdir, "numpy"),
+            'vector_precision': vector_precision,
+            'vector_search_dimensions': search_dimensions
+        }
+        rag = RAGSystem("benchmark", embeddings=embeddings, llm=llm, client=client, **store_options)
+        
+        listed = list(manager.iter_documents())
+        versions = {doc['id']: doc['modified_time'] for doc in listed}
+        names = {doc['id']: doc['name'] for doc in listed}
+        
+        def documents_data():
+            for doc_id, segments in manager.iter_documents_segments(list(versions), versions=versions):
+                yield {
+                    'id': doc_id,
+                    'name': names[doc_id],
+                    'content': render_segments(segments),
+                    'segments': segments,
+                    'modified_time': versions[doc_id]
+                }
+        
+        if trace_memory:
+            tracemalloc.start()
+        
+        start = time.perf_counter()
+        rag.create_knowledge_base(documents_data(), incremental=True)
+        build_seconds = time.perf_counter() - start
+        chunks = len(rag.keyword_index)
+        build_traced_peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+        build_rss = _max_rss_mb()
+        
+        # Nothing changed, so this measures the incremental no-op path
+        start = time.perf_counter()
+        rag.create_knowledge_base(documents_data(), incremental=True)
+        resync_seconds = time.perf_counter() - start
+        
+        # Startup cost of a session reopening the persisted knowledge base
+        start = time.perf_counter()
+        RAGSystem("benchmark", embeddings=embeddings, llm=llm, client=client,
+                  **store_options).load_knowledge_base()
+        reopen_seconds = time.perf_counter() - start
+        
+        if trace_memory:
+            tracemalloc.reset_peak()
+        
+        latencies = []
+        question_texts = corpus.questions(questions)
+        for question in question_texts:
+            start = time.perf_counter()
+            rag.query(question)
+            latencies.append(time.perf_counter() - start)
+        query_traced_peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+        if trace_memory:
+            tracemalloc.stop()
+        
+        results = {
+            'benchmark': 'rag_system',
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'commit': _git_commit(),
+            'config': {
+                'documents': documents,
+                'sections': sections,
+                'paragraphs': paragraphs,
+                'questions': questions,
+                'embedding_backend': embedding_backend,
+                'embedding_dimensions': embedding_dimensions,
+                'vector_store': vector_store,
+                'vector_precision': vector_precision,
+                'search_dimensions': search_dimensions,
+                'embedding_latency': embedding_latency,
+                'llm_latency': llm_latency,
+                'fetch_latency': fetch_latency,
+                'seed': seed
+            },
+            'build': {
+                'documents': len(listed),
+                'chunks': chunks,
+                'seconds': build_seconds,
+                'chunks_per_second': chunks / build_seconds if build_seconds else None,
+                'resync_seconds': resync_seconds,
+                'reopen_seconds': reopen_seconds
+            },
+            'query': _percentiles(latencies),
+            'calls': {
+                'embedding_document_calls': fake_embeddings.document_calls,
+                'embedding_query_calls': fake_embeddings.query_calls,
+                'texts_embedded': fake_embeddings.texts_embedded,
+                'llm_calls': llm.calls,
+                'docs_api_calls': docs.calls,
+                'drive_api_calls': drive.calls,
+                'bytes_fetched': docs.bytes_fetched
+            },
+            'caches': {
+                'embeddings': embeddings.stats() if embedding_backend == "fake" else None,
+                'answers': rag.answer_cache.stats(),
+                'documents': manager.content_cache.stats()
+            },
+            'context': rag.context_builder.stats(),
+            'memory': {
+                'max_rss_mb': _max_rss_mb(),
+                'build_max_rss_mb': build_rss,
+                'build_traced_peak_mb': build_traced_peak / (1024 * 1024) if trace_memory else None,
+                'query_traced_peak_mb': query_traced_peak / (1024 * 1024) if trace_memory else None
+            }
+        }
+        
+        # Quantization cost: how much of the exact top-k the store still finds
+        if vector_store == "numpy":
+            query_vectors = embeddings.embed_documents(question_texts)
+            results['vector_store'] = dict(
+                rag.vector_store.stats(),
+                recall_at_k={
+                    k: rag.vector_store.recall(query_vectors, k)
+                    for k in (TOP_K_RESULTS, HYBRID_CANDIDATES)
+                }
+            )
+        return results
+
+
+def main(argv=None):
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="Offline RAG build/query benchmark")
+    parser.add_argument("--documents", type=int, default=50)
+    parser.add_argument("--sections", type=int, default=8)
+    parser.add_argument("--paragraphs", type=int, default=5)
+    parser.add_argument("--questions", type=int, default=50)
+    parser.add_argument("--embedding-backend", choices=["fake", "local"], default="fake",
+                        help="Fake cached embeddings, or the local hashing backend")
+    parser.add_argument("--embedding-dimensions", type=int, default=256)
+    parser.add_argument("--vector-store", choices=["chroma", "numpy"], default="chroma")
+    parser.add_argument("--vector-precision", choices=["float32", "float16", "int8"], default="float32",
+                        help="Search matrix precision of the numpy store")
+    parser.add_argument("--search-dimensions", type=int,
+                        help="Truncate the numpy store's search matrix to this many dimensions")
+    parser.add_argument("--embedding-latency", type=float, default=0.0,
+                        help="Simulated seconds per embedding call")
+    parser.add_argument("--llm-latency", type=float, default=0.0,
+                        help="Simulated seconds per LLM call")
+    parser.add_argument("--fetch-latency", type=float, default=0.0,
+                        help="Simulated seconds per Docs API call")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Report Python heap peaks (slower)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON results to this file")
+    args = parser.parse_args(argv)
+    
+    results = run_benchmark(
+        documents=args.documents,
+        sections=args.sections,
+        paragraphs=args.paragraphs,
+        questions=args.questions,
+        embedding_dimensions=args.embedding_dimensions,
+        embedding_latency=args.embedding_latency,
+        llm_latency=args.llm_latency,
+        fetch_latency=args.fetch_latency,
+        trace_memory=args.trace_memory,
+        seed=args.seed,
+        embedding_backend=args.embedding_backend,
+        vector_store=args.vector_store,
+        vector_precision=args.vector_precision,
+        search_dimensions=args.search_dimensions
+    )
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
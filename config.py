@@ -11,14 +11,99 @@ load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 EMBEDDING_MODEL = "text-embedding-3-small"
 LLM_MODEL = "gpt-3.5-turbo"
+# Embedding backend: "openai" (EMBEDDING_MODEL through the API) or "local"
+# (CPU-only hashed n-gram embeddings computed with NumPy; no network access,
+# quota or rate limits, but lexical rather than semantic similarity)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "openai")
+LOCAL_EMBEDDING_DIMENSIONS = 1024
 
 # RAG settings
 CHUNK_SIZE = 1000
 CHUNK_OVERLAP = 200
+# Token budget per chunk when documents are chunked by structure (headings,
+# paragraphs, table rows); structured chunks do not overlap
+STRUCTURED_CHUNK_TOKENS = 300
 TOP_K_RESULTS = 3
+# Minimum cosine similarity of the best chunk for an answer to count as
+# coming from the documents
+RETRIEVAL_RELEVANCE_THRESHOLD = 0.25
+
+# Hybrid retrieval (BM25 keyword index fused with vector search)
+# Candidates taken from each ranking before reciprocal rank fusion
+HYBRID_CANDIDATES = 20
+HYBRID_RRF_K = 60
+# Queries with an ID/code-like term skip the query embedding when the best
+# keyword hit contains every such term and outscores the runner-up by this factor
+KEYWORD_FAST_PATH_MARGIN = 2.0
+
+# Retrieval mode: "hybrid" puts the top TOP_K_RESULTS fused hits in the
+# prompt; "rerank" fetches RERANK_CANDIDATES, reranks them on CPU, drops
+# overlapping chunks of the same document and packs the best ones into
+# CONTEXT_TOKEN_BUDGET
+RETRIEVAL_MODE = "rerank"
+RERANK_CANDIDATES = 20
+# "lexical", or the path of a locally downloaded cross-encoder model (needs
+# sentence-transformers; loaded from local files only)
+RERANKER_MODEL = "lexical"
+# Weight of the vector relevance in the lexical reranker's score
+RERANK_SEMANTIC_WEIGHT = 0.5
+# Share of the shorter chunk two chunks of one document must have in
+# common to count as duplicates
+RERANK_DEDUP_OVERLAP = 0.5
+# Maximum prompt context tokens; in "rerank" mode it also bounds the chunks
+# selected, so every selected chunk (and listed source) reaches the prompt
+CONTEXT_TOKEN_BUDGET = 2000
+
+# Embedding scheduler (token-packed batches, per-minute rate limits, retries)
+EMBEDDING_TOKENS_PER_MINUTE = 1000000
+EMBEDDING_REQUESTS_PER_MINUTE = 3000
+EMBEDDING_MAX_BATCH_INPUTS = 2048
+EMBEDDING_MAX_BATCH_TOKENS = 300000
+EMBEDDING_MAX_INPUT_TOKENS = 8191
+EMBEDDING_MAX_RETRIES = 6
+# Embedded vectors are written to the embedding cache every this many chunks,
+# so a failed build resumes from the last checkpoint
+EMBEDDING_CHECKPOINT_SIZE = 512
+
+# Async build pipeline (fetch -> split -> embed)
+PIPELINE_QUEUE_SIZE = 16
+PIPELINE_EMBED_BATCH_SIZE = 256
+PIPELINE_EMBED_WORKERS = 4
+
+# Batch question answering (RAGSystem.abatch_query, python -m rag_system answer)
+BATCH_MAX_CONCURRENCY = 8
 
 # Vector store
 VECTOR_STORE_PATH = "./chroma_db"
+DEFAULT_COLLECTION_NAME = "langchain"
+# "chroma", or "numpy" for an in-process float32 matrix searched by brute
+# force (see numpy_vector_store.py); faster and lighter for knowledge bases
+# of a few thousand chunks
+VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE_BACKEND", "chroma")
+# Each collection of the numpy backend is a directory under this path
+NUMPY_VECTOR_STORE_PATH = "./numpy_vector_store"
+# Search matrix of the numpy backend: "float32" scans the vectors as they
+# are; "float16" or "int8" scans a quantized copy 2x / 4x smaller, then
+# rescores the best VECTOR_RESCORE_FACTOR * k rows against the float32
+# vectors, which stay memory-mapped and are paged in only for those rows.
+# int8 is also the faster scan; NumPy converts float16 slowly
+VECTOR_PRECISION = "float32"
+# Leading dimensions kept in the search matrix (Matryoshka truncation, which
+# text-embedding-3 models are trained for), or None for all of them
+VECTOR_SEARCH_DIMENSIONS = None
+VECTOR_RESCORE_FACTOR = 4
+
+# Answer cache (exact + semantic match, keyed by knowledge-base version)
+ANSWER_CACHE_MAX_ENTRIES = 1000
+ANSWER_CACHE_SIMILARITY_THRESHOLD = 0.95
+
+# Per-user / per-selection collections
+KB_COLLECTION_TTL = 24 * 60 * 60  # seconds a collection may sit idle before GC
+KB_GC_INTERVAL = 10 * 60  # minimum seconds between GC sweeps
+
+# Embedding cache (SQLite, keyed by model + chunk text hash, LRU-evicted)
+EMBEDDING_CACHE_PATH = "./embedding_cache.sqlite3"
+EMBEDDING_CACHE_MAX_ENTRIES = 100000
 
 # Google OAuth settings
 SCOPES = ['https://www.googleapis.com/auth/documents.readonly', 
@@ -26,6 +111,31 @@ SCOPES = ['https://www.googleapis.com/auth/documents.readonly',
 CREDENTIALS_FILE = 'credentials.json'
 TOKEN_FILE = 'token.json'
 
+# Google API fetching
+DOCS_FETCH_MAX_WORKERS = 8
+DRIVE_LIST_PAGE_SIZE = 1000
+# Document names shown at a time while the full Drive listing loads
+DOCUMENT_LIST_RENDER_BATCH = 100
+
+# Extracted document text cache (keyed by document ID + modifiedTime)
+DOCUMENT_CACHE_PATH = "./document_cache.sqlite3"
+DOCUMENT_CACHE_MAX_BYTES = 200 * 1024 * 1024
+
+# Drive changes feed (background re-sync of selected documents)
+DRIVE_SYNC_INTERVAL = 60  # seconds
+DRIVE_SYNC_STATE_FILE = 'drive_sync_state.json'
+GOOGLE_API_MAX_RETRIES = 5
+# Longest Retry-After honoured, in seconds
+GOOGLE_API_MAX_RETRY_DELAY = 60
+
+# Metrics and tracing (see metrics.py); exporters are off unless configured
+# Port for a local Prometheus text endpoint at http://127.0.0.1:<port>/metrics
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0")) or None
+# File every finished span is appended to as one JSON line
+METRICS_JSONL_PATH = os.getenv("METRICS_JSONL_PATH")
+# Show per-stage timings and counters in a Streamlit sidebar panel
+METRICS_DEBUG_PANEL = os.getenv("METRICS_DEBUG_PANEL", "").lower() in ("1", "true", "yes")
+
 # For Vercel deployment: credentials can be provided as JSON string in environment variable
 GOOGLE_CREDENTIALS_JSON = os.getenv("GOOGLE_CREDENTIALS_JSON")
 
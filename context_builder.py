@@ -0,0 +1,163 @@
+"""
+Context Builder
+Token-budgeted prompt context built from retrieved chunks
+"""
+
+import threading
+
+import tiktoken
+
+# Shortest suffix/prefix match treated as splitter overlap rather than chance
+MIN_OVERLAP_CHARS = 10
+
+
+class ContextBuilder:
+    """
+    Builds the prompt context from retrieved chunks
+    
+    Chunks of the same document version with consecutive chunk_index are
+    merged into one passage, and the text the splitter repeated between
+    them (CHUNK_OVERLAP, or the heading path of structured chunks) is kept
+    once. Passages are then added best-ranked first while they fit the
+    token budget.
+    """
+    
+    def __init__(self, token_budget, encoding_name="cl100k_base", separator="\n\n"):
+        """
+        Initialize the builder
+        
+        Args:
+            token_budget: Maximum context tokens
+            encoding_name: tiktoken encoding used for counting
+            separator: Text placed between passages
+        """
+        self.token_budget = token_budget
+        self.encoding = tiktoken.get_encoding(encoding_name)
+        self.separator = separator
+        self.queries = 0
+        self.tokens = 0
+        self.tokens_saved = 0
+        self._lock = threading.Lock()
+    
+    def count_tokens(self, text):
+        """Count tokens in a text"""
+        return len(self.encoding.encode(text, disallowed_special=()))
+    
+    @staticmethod
+    def _overlap_length(first, second):
+        """Length of the longest suffix of first that is a prefix of second"""
+        for length in range(min(len(first), len(second)), MIN_OVERLAP_CHARS - 1, -1):
+            if first.endswith(second[:length]):
+                return length
+        return 0
+    
+    def _join(self, passage, doc):
+        """Append the next chunk of a document to a passage, without repeats"""
+        text = doc.page_content
+        section = doc.metadata.get('section')
+        if section and text.startswith(section + '\n') \
+                and passage['section'] == section:
+            # Structured chunks repeat their heading path; the passage has it
+            return passage['text'] + '\n' + text[len(section) + 1:]
+        
+        overlap = self._overlap_length(passage['text'], text)
+        if overlap:
+            return passage['text'] + text[overlap:]
+        return passage['text'] + '\n' + text
+    
+    def _passages(self, docs):
+        """
+        Merge adjacent chunks of the same document into passages
+        
+        Returns:
+            List of passage dicts with 'text', ordered by the rank of their
+            best chunk
+        """
+        ranked = {}
+        for rank, doc in enumerate(docs):
+            meta = doc.metadata
+            key = (meta.get('document_id'), meta.get('content_hash'), meta.get('chunk_index'))
+            if None in key:
+                key = ('', '', rank)  # no position metadata; never merged
+            ranked.setdefault(key, (rank, doc))
+        
+        passages = []
+        previous_key = None
+        for key in sorted(ranked, key=lambda item: (str(item[0]), str(item[1]), item[2])):
+            rank, doc = ranked[key]
+            adjacent = previous_key is not None and key[0] and key[:2] == previous_key[:2] \
+                and key[2] == previous_key[2] + 1
+            if adjacent:
+                passage = passages[-1]
+                passage['text'] = self._join(passage, doc)
+                passage['rank'] = min(passage['rank'], rank)
+                passage['section'] = doc.metadata.get('section')
+            else:
+                passages.append({
+                    'text': doc.page_content,
+                    'rank': rank,
+                    'section': doc.metadata.get('section')
+                })
+            previous_key = key
+        
+        passages.sort(key=lambda passage: passage['rank'])
+        return passages
+    
+    def build(self, docs):
+        """
+        Build the context for one prompt
+        
+        Args:
+            docs: Retrieved LangChain Documents, best first
+            
+        Returns:
+            Tuple of (context, stats) where stats has 'chunks', 'passages',
+            'tokens', 'naive_tokens' (what joining every chunk would cost)
+            and 'tokens_saved'
+        """
+        separator_tokens = self.count_tokens(self.separator)
+        parts = []
+        used = 0
+        for passage in self._passages(docs):
+            tokens = self.count_tokens(passage['text'])
+            cost = tokens + (separator_tokens if parts else 0)
+            if used + cost <= self.token_budget:
+                parts.append(passage['text'])
+                used += cost
+            elif not parts:
+                # Even the best passage is too long; keep its beginning
+                encoded = self.encoding.encode(passage['text'], disallowed_special=())
+                parts.append(self.encoding.decode(encoded[:self.token_budget]))
+                used = self.token_budget
+        
+        context = self.separator.join(parts)
+        naive_tokens = self.count_tokens(self.separator.join(doc.page_content for doc in docs))
+        tokens = self.count_tokens(context)
+        stats = {
+            'chunks': len(docs),
+            'passages': len(parts),
+            'tokens': tokens,
+            'naive_tokens': naive_tokens,
+            'tokens_saved': max(naive_tokens - tokens, 0)
+        }
+        
+        with self._lock:
+            self.queries += 1
+            self.tokens += tokens
+            self.tokens_saved += stats['tokens_saved']
+        return context, stats
+    
+    def stats(self):
+        """
+        Running totals across built contexts
+        
+        Returns:
+            Dict with 'queries', 'tokens', 'tokens_saved' and
+            'avg_tokens_saved'
+        """
+        return {
+            'queries': self.queries,
+            'tokens': self.tokens,
+            'tokens_saved': self.tokens_saved,
+            'avg_tokens_saved': self.tokens_saved / self.queries if self.queries else 0.0
+        }
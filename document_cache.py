@@ -0,0 +1,139 @@
+"""
+Document Cache
+On-disk cache of extracted Google Doc text keyed by document revision
+"""
+
+import sqlite3
+import threading
+import time
+
+
+class DocumentContentCache:
+    """
+    SQLite-backed cache of extracted document text
+    
+    Entries are keyed by document ID and stored with the version they were
+    extracted from (the Drive modifiedTime), so an unchanged document skips
+    both the Docs API call and the text extraction. Total stored text is
+    capped at max_bytes and the least recently used documents are evicted.
+    """
+    
+    def __init__(self, cache_path, max_bytes=200 * 1024 * 1024):
+        """
+        Initialize the cache
+        
+        Args:
+            cache_path: Path of the SQLite database file
+            max_bytes: Maximum total size of cached text in bytes
+        """
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            "document_id TEXT PRIMARY KEY, "
+            "version TEXT NOT NULL, "
+            "content TEXT NOT NULL, "
+            "size INTEGER NOT NULL, "
+            "last_used REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_documents_last_used ON documents (last_used)"
+        )
+        self._conn.commit()
+    
+    def get(self, document_id, version):
+        """
+        Look up a document's text
+        
+        Args:
+            document_id: ID of the Google Doc
+            version: Version the caller expects (e.g. modifiedTime)
+            
+        Returns:
+            Cached text, or None if missing or stale
+        """
+        if not version:
+            self.misses += 1
+            return None
+        
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content FROM documents WHERE document_id = ? AND version = ?",
+                (document_id, version)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            
+            self._conn.execute(
+                "UPDATE documents SET last_used = ? WHERE document_id = ?",
+                (time.time(), document_id)
+            )
+            self._conn.commit()
+        
+        self.hits += 1
+        return row[0]
+    
+    def put(self, document_id, version, content):
+        """
+        Store a document's text, replacing older versions
+        
+        Args:
+            document_id: ID of the Google Doc
+            version: Version the text was extracted from
+            content: Extracted text
+        """
+        if not version:
+            return
+        
+        size = len(content.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO documents (document_id, version, content, size, last_used) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (document_id, version, content, size, time.time())
+            )
+            self._evict()
+            self._conn.commit()
+    
+    def _evict(self):
+        """Drop least recently used documents until under max_bytes (lock held)"""
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM documents").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        
+        stale_ids = []
+        for document_id, size in self._conn.execute(
+            "SELECT document_id, size FROM documents ORDER BY last_used ASC"
+        ):
+            if total <= self.max_bytes:
+                break
+            stale_ids.append((document_id,))
+            total -= size
+        self._conn.executemany("DELETE FROM documents WHERE document_id = ?", stale_ids)
+    
+    def stats(self):
+        """
+        Cache counters
+        
+        Returns:
+            Dict with 'hits', 'misses', 'entries' and 'bytes'
+        """
+        with self._lock:
+            entries, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM documents"
+            ).fetchone()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': entries,
+            'bytes': total
+        }
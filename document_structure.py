@@ -0,0 +1,250 @@
+"""
+Document Structure
+Structure-aware extraction from the Google Docs JSON and section-aware chunking
+"""
+
+import tiktoken
+
+# Paragraph styles that start a new section, mapped to their heading level
+HEADING_LEVELS = {
+    'TITLE': 0,
+    'HEADING_1': 1,
+    'HEADING_2': 2,
+    'HEADING_3': 3,
+    'HEADING_4': 4,
+    'HEADING_5': 5,
+    'HEADING_6': 6
+}
+
+
+def extract_segments(doc):
+    """
+    Extract structural segments from a Google Docs API document
+    
+    Args:
+        doc: Response of documents().get()
+        
+    Returns:
+        List of segment dicts with 'type' ('heading', 'paragraph',
+        'list_item' or 'table_row'), 'text', 'heading_path' (list of
+        enclosing heading texts) and 'start_index'/'end_index' offsets
+        into the document
+    """
+    segments = []
+    heading_stack = []  # (level, text)
+    
+    def paragraph_text(paragraph):
+        return ''.join(
+            elem['textRun'].get('content', '')
+            for elem in paragraph.get('elements', [])
+            if 'textRun' in elem
+        )
+    
+    def element_text(element):
+        """Flatten a paragraph or (nested) table inside a table cell"""
+        if 'paragraph' in element:
+            return paragraph_text(element['paragraph']).strip()
+        if 'table' in element:
+            return ' '.join(
+                element_text(content)
+                for row in element['table'].get('tableRows', [])
+                for cell in row.get('tableCells', [])
+                for content in cell.get('content', [])
+            )
+        return ''
+    
+    def add_paragraph(element):
+        paragraph = element['paragraph']
+        text = paragraph_text(paragraph).strip()
+        if not text:
+            return
+        
+        style = paragraph.get('paragraphStyle', {}).get('namedStyleType', '')
+        if style in HEADING_LEVELS:
+            level = HEADING_LEVELS[style]
+            while heading_stack and heading_stack[-1][0] >= level:
+                heading_stack.pop()
+            heading_stack.append((level, text))
+            segment_type = 'heading'
+        elif 'bullet' in paragraph:
+            nesting = paragraph['bullet'].get('nestingLevel', 0)
+            text = '  ' * nesting + '- ' + text
+            segment_type = 'list_item'
+        else:
+            segment_type = 'paragraph'
+        
+        segments.append({
+            'type': segment_type,
+            'text': text,
+            'heading_path': [heading for _, heading in heading_stack],
+            'start_index': element.get('startIndex', 0),
+            'end_index': element.get('endIndex', 0)
+        })
+    
+    def add_table(element):
+        for row in element['table'].get('tableRows', []):
+            cells = []
+            for cell in row.get('tableCells', []):
+                cell_text = ' '.join(
+                    element_text(content) for content in cell.get('content', [])
+                )
+                cells.append(cell_text.strip())
+            if not any(cells):
+                continue
+            segments.append({
+                'type': 'table_row',
+                'text': ' | '.join(cells),
+                'heading_path': [heading for _, heading in heading_stack],
+                'start_index': row.get('startIndex', element.get('startIndex', 0)),
+                'end_index': row.get('endIndex', element.get('endIndex', 0))
+            })
+    
+    for element in doc.get('body', {}).get('content', []):
+        if 'paragraph' in element:
+            add_paragraph(element)
+        elif 'table' in element:
+            add_table(element)
+    
+    return segments
+
+
+def render_segments(segments):
+    """
+    Render segments back to plain text, one segment per line
+    
+    Args:
+        segments: Segments from extract_segments()
+        
+    Returns:
+        Document text
+    """
+    return '\n'.join(segment['text'] for segment in segments)
+
+
+class SectionChunker:
+    """
+    Packs whole segments into chunks by token count
+    
+    Chunks never straddle a top-level section and never overlap, so
+    there is no duplicated embedding spend. Each chunk is prefixed with
+    its heading path so retrieval keeps the section context. Segments
+    longer than the budget are split on token boundaries.
+    """
+    
+    def __init__(self, max_tokens, encoding_name="cl100k_base"):
+        """
+        Initialize the chunker
+        
+        Args:
+            max_tokens: Token budget per chunk
+            encoding_name: tiktoken encoding used for counting
+        """
+        self.max_tokens = max_tokens
+        self.encoding = tiktoken.get_encoding(encoding_name)
+    
+    def count_tokens(self, text):
+        """Count tokens in a text"""
+        return len(self.encoding.encode(text, disallowed_special=()))
+    
+    def _decodes_cleanly(self, tokens):
+        """Whether tokens decode to whole UTF-8 characters"""
+        try:
+            self.encoding.decode_bytes(tokens).decode('utf-8')
+        except UnicodeDecodeError:
+            return False
+        return True
+    
+    def _clean_cut(self, tokens, start, end):
+        """
+        Move a cut so that tokens[start:end] holds whole characters
+        
+        Byte-level tokens can split a multi-byte character (CJK, emoji,
+        accented letters); cutting between them would leave U+FFFD on both
+        sides. The cut moves back to the nearest clean boundary, or forward
+        if a single character spans more than the budget.
+        """
+        for cut in range(end, start, -1):
+            if cut == len(tokens) or self._decodes_cleanly(tokens[start:cut]):
+                return cut
+        for cut in range(end + 1, len(tokens) + 1):
+            if cut == len(tokens) or self._decodes_cleanly(tokens[start:cut]):
+                return cut
+        return len(tokens)
+    
+    def _split_long_segment(self, segment, budget):
+        """
+        Split one over-long segment into token-bounded pieces
+        
+        Pieces end on character boundaries, and each gets its own
+        start_index/end_index inside the segment's range, offset by the
+        length of the text before it, so pieces of one paragraph are not
+        mistaken for copies of each other.
+        """
+        tokens = self.encoding.encode(segment['text'], disallowed_special=())
+        offset = segment['start_index']
+        start = 0
+        while start < len(tokens):
+            end = self._clean_cut(tokens, start, min(start + budget, len(tokens)))
+            text = self.encoding.decode(tokens[start:end])
+            piece_end = min(offset + len(text), segment['end_index'])
+            yield dict(segment, text=text, start_index=offset, end_index=piece_end)
+            offset = piece_end
+            start = end
+    
+    def chunk(self, segments):
+        """
+        Pack segments into chunks
+        
+        Args:
+            segments: Segments from extract_segments()
+            
+        Yields:
+            Chunk dicts with 'text', 'section' (heading path joined by " > "),
+            'start_index' and 'end_index'
+        """
+        current = []
+        current_tokens = 0
+        current_section = None
+        
+        def emit():
+            section = ' > '.join(current[0]['heading_path'])
+            body = '\n'.join(segment['text'] for segment in current)
+            # Repeat the heading path unless the chunk starts with its heading
+            if section and current[0]['type'] != 'heading':
+                body = section + '\n' + body
+            return {
+                'text': body,
+                'section': section,
+                'start_index': current[0]['start_index'],
+                'end_index': current[-1]['end_index']
+            }
+        
+        for segment in segments:
+            top_section = segment['heading_path'][:1]
+            breadcrumb_tokens = self.count_tokens(' > '.join(segment['heading_path']))
+            budget = max(1, self.max_tokens - breadcrumb_tokens)
+            tokens = self.count_tokens(segment['text'])
+            
+            starts_section = segment['type'] == 'heading' or top_section != current_section
+            if current and (starts_section or current_tokens + tokens > budget):
+                # A chunk holding only headings adds nothing the next chunk's
+                # heading-path prefix does not already carry
+                if not all(item['type'] == 'heading' for item in current):
+                    yield emit()
+                current = []
+                current_tokens = 0
+            current_section = top_section
+            
+            if tokens > budget:
+                for piece in self._split_long_segment(segment, budget):
+                    current = [piece]
+                    yield emit()
+                current = []
+                current_tokens = 0
+                continue
+            
+            current.append(segment)
+            current_tokens += tokens
+        
+        if current:
+            yield emit()
@@ -0,0 +1,197 @@
+"""
+Drive Change Sync
+Keeps the knowledge base in step with edits and deletions in Google Drive
+"""
+
+import json
+import os
+import threading
+
+from config import DRIVE_SYNC_INTERVAL, DRIVE_SYNC_STATE_FILE
+from document_structure import render_segments
+
+
+class DriveChangeSync:
+    """
+    Turns the Drive changes feed into incremental knowledge-base updates
+    
+    A start page token is stored on disk; each poll reads every change since
+    that token and, for the selected documents only, re-embeds edited
+    documents and deletes trashed or removed ones.
+    """
+    
+    def __init__(self, docs_manager, rag_system, selected_docs, state_file=DRIVE_SYNC_STATE_FILE,
+                 page_token=None, registry=None):
+        """
+        Initialize the sync component
+        
+        Args:
+            docs_manager: GoogleDocsManager used for the changes feed and content
+            rag_system: RAGSystem whose vector store is kept in sync
+            selected_docs: Dict mapping selected document ID -> document name
+            state_file: JSON file the start page token is persisted to
+                (None keeps it in memory only)
+            page_token: Optional start page token taken before the knowledge
+                base content was fetched; overrides the persisted one
+            registry: Optional KnowledgeBaseRegistry the RAGSystem came from;
+                its collection is retained while the background thread runs
+                and touched on every poll, so it is never garbage-collected
+                under the sync
+        """
+        self.docs_manager = docs_manager
+        self.rag_system = rag_system
+        self.selected_docs = dict(selected_docs)
+        self.state_file = state_file
+        self.page_token = page_token or self._load_page_token()
+        self.registry = registry
+        self.last_stats = None
+        
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+    
+    def _load_page_token(self):
+        """Read the persisted start page token, if any"""
+        if self.state_file and os.path.exists(self.state_file):
+            try:
+                with open(self.state_file, 'r') as f:
+                    return json.load(f).get('start_page_token')
+            except (OSError, json.JSONDecodeError):
+                return None
+        return None
+    
+    def _save_page_token(self):
+        """Persist the current start page token"""
+        if not self.state_file:
+            return
+        with open(self.state_file, 'w') as f:
+            json.dump({'start_page_token': self.page_token}, f)
+    
+    def set_selected_docs(self, selected_docs):
+        """
+        Replace the set of documents being tracked
+        
+        Args:
+            selected_docs: Dict mapping document ID -> document name
+        """
+        with self._lock:
+            self.selected_docs = dict(selected_docs)
+    
+    def poll(self):
+        """
+        Apply all Drive changes since the stored page token
+        
+        The first call only records the current token, since the knowledge
+        base was just built from fresh content.
+        
+        Documents that could not be fetched keep their indexed chunks and are
+        counted as 'failed'; the page token is then left where it was, so
+        their changes are read again on the next poll.
+        
+        Returns:
+            Dict with 'updated', 'removed' and 'failed' document counts and
+            the number of 'chunks_embedded'
+        """
+        with self._lock:
+            stats = {'updated': 0, 'removed': 0, 'failed': 0, 'chunks_embedded': 0}
+            if self.registry:
+                self.registry.touch(self.rag_system.collection_name)
+            
+            if not self.page_token:
+                self.page_token = self.docs_manager.get_start_page_token()
+                self._save_page_token()
+                self.last_stats = stats
+                return stats
+            
+            changes, new_token = self.docs_manager.list_changes(self.page_token)
+            
+            # Keep only the latest change per selected document
+            latest = {}
+            for change in changes:
+                if change['id'] in self.selected_docs:
+                    latest[change['id']] = change
+            
+            removed_ids = [
+                doc_id for doc_id, change in latest.items()
+                if change['removed'] or change['trashed']
+            ]
+            edited = {
+                doc_id: change for doc_id, change in latest.items()
+                if doc_id not in removed_ids
+            }
+            
+            if removed_ids:
+                stats['removed'] = self.rag_system.delete_documents(removed_ids)
+                for doc_id in removed_ids:
+                    self.selected_docs.pop(doc_id, None)
+            
+            if edited:
+                segments_by_id = dict(self.docs_manager.iter_documents_segments(
+                    list(edited),
+                    versions={doc_id: change['modified_time'] for doc_id, change in edited.items()}
+                ))
+                documents_data = []
+                for doc_id, change in edited.items():
+                    name = change['name'] or self.selected_docs[doc_id]
+                    self.selected_docs[doc_id] = name
+                    segments = segments_by_id.get(doc_id)
+                    if segments is None:
+                        # Not an empty document: keep what is indexed
+                        stats['failed'] += 1
+                        continue
+                    documents_data.append({
+                        'id': doc_id,
+                        'name': name,
+                        'content': render_segments(segments),
+                        'segments': segments,
+                        'modified_time': change['modified_time']
+                    })
+                if documents_data:
+                    upsert_stats = self.rag_system.upsert_documents(documents_data)
+                    stats['updated'] = upsert_stats['added'] + upsert_stats['updated']
+                    stats['removed'] += upsert_stats['removed']
+                    stats['chunks_embedded'] = upsert_stats['chunks_embedded']
+            
+            # Only advance the cursor once every change has been applied;
+            # re-applying the others on the next poll is a no-op since
+            # unchanged chunks are skipped by content hash
+            if not stats['failed']:
+                self.page_token = new_token
+                self._save_page_token()
+            self.last_stats = stats
+            return stats
+    
+    def start(self, interval=DRIVE_SYNC_INTERVAL):
+        """
+        Poll the changes feed on a background daemon thread
+        
+        Args:
+            interval: Seconds between polls
+        """
+        if self._thread and self._thread.is_alive():
+            return
+        
+        self._stop_event.clear()
+        if self.registry:
+            self.registry.retain(self.rag_system.collection_name)
+        
+        def run():
+            while True:
+                try:
+                    self.poll()
+                except Exception as e:
+                    print(f"Drive change sync failed: {e}")
+                if self._stop_event.wait(interval):
+                    break
+        
+        self._thread = threading.Thread(target=run, name="drive-change-sync", daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        """Stop the background polling thread"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+            if self.registry:
+                self.registry.release(self.rag_system.collection_name)
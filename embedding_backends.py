@@ -0,0 +1,219 @@
+"""
+Embedding Backends
+Embedding implementations selectable through EMBEDDING_BACKEND in config.py
+"""
+
+import zlib
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_openai import OpenAIEmbeddings
+
+from config import (
+    OPENAI_API_KEY,
+    EMBEDDING_MODEL,
+    EMBEDDING_CACHE_PATH,
+    EMBEDDING_CACHE_MAX_ENTRIES,
+    EMBEDDING_CHECKPOINT_SIZE,
+    EMBEDDING_TOKENS_PER_MINUTE,
+    EMBEDDING_REQUESTS_PER_MINUTE,
+    EMBEDDING_MAX_BATCH_INPUTS,
+    EMBEDDING_MAX_BATCH_TOKENS,
+    EMBEDDING_MAX_INPUT_TOKENS,
+    EMBEDDING_MAX_RETRIES,
+    LOCAL_EMBEDDING_DIMENSIONS
+)
+from embedding_cache import CachedEmbeddings
+from embedding_scheduler import EmbeddingScheduler
+from keyword_index import tokenize
+from metrics import metrics
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    CPU-only embeddings from hashed word and character n-grams
+    
+    Each text becomes a bag of word unigrams, word bigrams and character
+    trigrams, hashed into a fixed number of signed buckets, log-scaled and
+    L2-normalized. A batch is accumulated into one NumPy matrix, so bulk
+    indexing has no rate limits and a query embeds in well under a
+    millisecond. Similarity is lexical rather than semantic: texts score
+    high when they share words or word pieces.
+    """
+    
+    # Relative weight of each feature type
+    UNIGRAM_WEIGHT = 1.0
+    BIGRAM_WEIGHT = 0.5
+    CHAR_NGRAM_WEIGHT = 0.25
+    
+    def __init__(self, dimensions=1024, char_ngram=3):
+        """
+        Initialize the backend
+        
+        Args:
+            dimensions: Vector size
+            char_ngram: Length of the character n-grams taken from each word
+        """
+        self.dimensions = dimensions
+        self.char_ngram = char_ngram
+    
+    @property
+    def model_name(self):
+        """Identifier of the vector space, for caches and collection names"""
+        return f"local-hashing-{self.dimensions}-c{self.char_ngram}"
+    
+    def _features(self, text):
+        """
+        Weighted features of one text
+        
+        Returns:
+            Tuple of (feature strings, weights)
+        """
+        words = tokenize(text)
+        features = list(words)
+        weights = [self.UNIGRAM_WEIGHT] * len(words)
+        
+        bigrams = [f"{first} {second}" for first, second in zip(words, words[1:])]
+        features.extend(bigrams)
+        weights.extend([self.BIGRAM_WEIGHT] * len(bigrams))
+        
+        size = self.char_ngram
+        for word in words:
+            padded = f"<{word}>"
+            grams = [padded[i:i + size] for i in range(len(padded) - size + 1)]
+            features.extend("#" + gram for gram in grams)
+            weights.extend([self.CHAR_NGRAM_WEIGHT] * len(grams))
+        return features, weights
+    
+    def _embed_batch(self, texts):
+        """Embed texts into an (n, dimensions) float32 matrix"""
+        rows = []
+        hashes = []
+        weights = []
+        for row, text in enumerate(texts):
+            features, feature_weights = self._features(text)
+            rows.extend([row] * len(features))
+            hashes.extend(zlib.crc32(feature.encode('utf-8')) for feature in features)
+            weights.extend(feature_weights)
+        
+        matrix = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        if hashes:
+            hashes = np.asarray(hashes, dtype=np.uint32)
+            columns = (hashes % self.dimensions).astype(np.intp)
+            # The top bit picks the sign, so collisions tend to cancel out
+            signs = np.where(hashes >> 31, 1.0, -1.0).astype(np.float32)
+            np.add.at(matrix, (np.asarray(rows, dtype=np.intp), columns),
+                      signs * np.asarray(weights, dtype=np.float32))
+        
+        matrix = np.sign(matrix) * np.log1p(np.abs(matrix))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+    
+    def embed_documents(self, texts):
+        """
+        Embed a list of texts
+        
+        Args:
+            texts: List of strings
+            
+        Returns:
+            List of embedding vectors in the same order as texts
+        """
+        with metrics.span("local_embedding"):
+            matrix = self._embed_batch(texts)
+        metrics.increment("embedding_inputs", len(texts), backend="local")
+        return matrix.tolist()
+    
+    def embed_query(self, text):
+        """
+        Embed a single query text
+        
+        Args:
+            text: Query string
+            
+        Returns:
+            Embedding vector
+        """
+        return self.embed_documents([text])[0]
+
+
+def create_openai_embeddings():
+    """
+    OpenAI embeddings behind the disk cache and the rate-limit scheduler
+    
+    Raises:
+        ValueError: If OPENAI_API_KEY is not set
+    """
+    if not OPENAI_API_KEY:
+        raise ValueError("OPENAI_API_KEY not found in environment variables")
+    
+    # Disk-backed cache so chunks embedded by earlier builds or other
+    # sessions never go back to the API; misses go through the
+    # scheduler, which owns batching, rate limiting and retries
+    return CachedEmbeddings(
+        EmbeddingScheduler(
+            OpenAIEmbeddings(
+                model=EMBEDDING_MODEL,
+                openai_api_key=OPENAI_API_KEY,
+                chunk_size=EMBEDDING_MAX_BATCH_INPUTS,
+                max_retries=0
+            ),
+            model_name=EMBEDDING_MODEL,
+            tokens_per_minute=EMBEDDING_TOKENS_PER_MINUTE,
+            requests_per_minute=EMBEDDING_REQUESTS_PER_MINUTE,
+            max_batch_inputs=EMBEDDING_MAX_BATCH_INPUTS,
+            max_batch_tokens=EMBEDDING_MAX_BATCH_TOKENS,
+            max_input_tokens=EMBEDDING_MAX_INPUT_TOKENS,
+            max_retries=EMBEDDING_MAX_RETRIES
+        ),
+        model_name=EMBEDDING_MODEL,
+        cache_path=EMBEDDING_CACHE_PATH,
+        max_entries=EMBEDDING_CACHE_MAX_ENTRIES,
+        checkpoint_size=EMBEDDING_CHECKPOINT_SIZE
+    )
+
+
+def create_local_embeddings():
+    """CPU-only hashing embeddings; needs no network access or API key"""
+    return HashingEmbeddings(dimensions=LOCAL_EMBEDDING_DIMENSIONS)
+
+
+# Backend name (EMBEDDING_BACKEND) -> factory returning a LangChain Embeddings
+EMBEDDING_BACKENDS = {
+    'openai': create_openai_embeddings,
+    'local': create_local_embeddings
+}
+
+
+def create_embeddings(backend):
+    """
+    Build the embeddings for a backend name
+    
+    Args:
+        backend: Key of EMBEDDING_BACKENDS
+        
+    Returns:
+        LangChain Embeddings object
+    """
+    try:
+        factory = EMBEDDING_BACKENDS[backend]
+    except KeyError:
+        raise ValueError(
+            f"Unknown embedding backend {backend!r}; expected one of {sorted(EMBEDDING_BACKENDS)}"
+        ) from None
+    return factory()
+
+
+def embedding_namespace(backend):
+    """
+    Identifier of a backend's vector space, used to keep knowledge bases
+    built with different backends in separate collections
+    
+    Returns:
+        "" for the OpenAI backend, so existing collection names are kept
+    """
+    if backend == 'openai':
+        return ""
+    if backend == 'local':
+        return HashingEmbeddings(dimensions=LOCAL_EMBEDDING_DIMENSIONS).model_name
+    return backend
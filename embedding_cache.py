@@ -0,0 +1,229 @@
+"""
+Embedding Cache
+Persistent, content-addressed cache in front of an embeddings backend
+"""
+
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+from array import array
+
+from langchain_core.embeddings import Embeddings
+
+from metrics import metrics
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps a LangChain embeddings object with a SQLite-backed cache
+    
+    Vectors are keyed by (model name, SHA-256 of the text), so rebuilds and
+    sessions that share documents skip the network for chunks that were
+    already embedded. The cache is capped at max_entries and evicts the
+    least recently used vectors first. Query embeddings bypass it: they
+    rarely repeat (repeated questions are served by the answer cache) and
+    would evict chunk vectors while adding a disk write to every query.
+    """
+    
+    def __init__(self, embeddings, model_name, cache_path, max_entries=100000, checkpoint_size=512):
+        """
+        Initialize the cache
+        
+        Args:
+            embeddings: Underlying LangChain embeddings object
+            model_name: Embedding model name, part of the cache key
+            cache_path: Path of the SQLite database file
+            max_entries: Maximum number of vectors kept on disk
+            checkpoint_size: Number of newly embedded vectors written to disk
+                at a time
+        """
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.checkpoint_size = checkpoint_size
+        self.hits = 0
+        self.misses = 0
+        
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, "
+            "vector BLOB NOT NULL, "
+            "last_used REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)"
+        )
+        self._conn.commit()
+    
+    def _key(self, text):
+        """Build the cache key for a text"""
+        digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        return f"{self.model_name}:{digest}"
+    
+    def _lookup(self, keys):
+        """
+        Fetch cached vectors and refresh their LRU timestamp
+        
+        Returns:
+            Dict mapping key -> vector for the keys that were found
+        """
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        with self._lock:
+            # Stay under SQLite's bound-parameter limit
+            for start in range(0, len(unique_keys), 500):
+                batch = unique_keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = array('f', blob).tolist()
+            
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+                self._conn.commit()
+        return found
+    
+    def _store(self, items):
+        """Persist (key, vector) pairs and evict the least recently used overflow"""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [(key, array('f', vector).tobytes(), now) for key, vector in items]
+            )
+            count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            overflow = count - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN ("
+                    "SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                    (overflow,)
+                )
+            self._conn.commit()
+    
+    def _count(self, hits, misses):
+        """Update the hit/miss counters and the exported metrics"""
+        self.hits += hits
+        self.misses += misses
+        if hits:
+            metrics.increment("cache_lookups", hits, cache="embeddings", result="hit")
+        if misses:
+            metrics.increment("cache_lookups", misses, cache="embeddings", result="miss")
+    
+    def embed_documents(self, texts):
+        """
+        Embed a list of texts, calling the backend only for cache misses
+        
+        Args:
+            texts: List of strings
+            
+        Returns:
+            List of embedding vectors in the same order as texts
+        """
+        keys = [self._key(text) for text in texts]
+        cached = self._lookup(keys)
+        
+        # Embed each distinct missing text once
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        
+        hits = sum(1 for key in keys if key in cached)
+        self._count(hits, len(keys) - hits)
+        
+        # Store each checkpoint slice as soon as it is embedded, so a build
+        # that fails part-way resumes from the cache
+        missing_items = list(missing.items())
+        for start in range(0, len(missing_items), self.checkpoint_size):
+            chunk = missing_items[start:start + self.checkpoint_size]
+            vectors = self.embeddings.embed_documents([text for _, text in chunk])
+            new_items = [(key, vector) for (key, _), vector in zip(chunk, vectors)]
+            self._store(new_items)
+            cached.update(new_items)
+        
+        return [cached[key] for key in keys]
+    
+    def embed_query(self, text):
+        """
+        Embed a single query text, without the cache
+        
+        Args:
+            text: Query string
+            
+        Returns:
+            Embedding vector
+        """
+        return self.embeddings.embed_query(text)
+    
+    async def aembed_documents(self, texts):
+        """
+        Asynchronously embed a list of texts, calling the backend only for misses
+        
+        Args:
+            texts: List of strings
+            
+        Returns:
+            List of embedding vectors in the same order as texts
+        """
+        keys = [self._key(text) for text in texts]
+        cached = await asyncio.to_thread(self._lookup, keys)
+        
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        
+        hits = sum(1 for key in keys if key in cached)
+        self._count(hits, len(keys) - hits)
+        
+        missing_items = list(missing.items())
+        for start in range(0, len(missing_items), self.checkpoint_size):
+            chunk = missing_items[start:start + self.checkpoint_size]
+            vectors = await self.embeddings.aembed_documents([text for _, text in chunk])
+            new_items = [(key, vector) for (key, _), vector in zip(chunk, vectors)]
+            await asyncio.to_thread(self._store, new_items)
+            cached.update(new_items)
+        
+        return [cached[key] for key in keys]
+    
+    async def aembed_query(self, text):
+        """
+        Asynchronously embed a single query text, without the cache
+        
+        Args:
+            text: Query string
+            
+        Returns:
+            Embedding vector
+        """
+        return await self.embeddings.aembed_query(text)
+    
+    def stats(self):
+        """
+        Cache counters
+        
+        Returns:
+            Dict with 'hits', 'misses', 'hit_rate' and 'entries'
+        """
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'entries': entries
+        }
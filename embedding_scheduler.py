@@ -0,0 +1,228 @@
+"""
+Embedding Scheduler
+Token-aware batching, rate limiting and retries in front of the embeddings API
+"""
+
+import asyncio
+import random
+import threading
+import time
+
+import openai
+import tiktoken
+from langchain_core.embeddings import Embeddings
+
+from metrics import metrics
+
+
+class TokenBucket:
+    """
+    Token bucket limiting a quantity (tokens or requests) per minute
+    
+    Callers reserve capacity up front and are told how long to wait, which
+    works the same way for blocking and asyncio callers.
+    """
+    
+    def __init__(self, per_minute):
+        """
+        Initialize the bucket
+        
+        Args:
+            per_minute: Sustained capacity per minute (also the burst size)
+        """
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self._available = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def reserve(self, amount):
+        """
+        Reserve capacity, going into debt if necessary
+        
+        Args:
+            amount: Quantity to reserve
+            
+        Returns:
+            Seconds to wait before using the reservation
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._available = min(self.capacity, self._available + (now - self._updated) * self.rate)
+            self._updated = now
+            self._available -= min(amount, self.capacity)
+            return max(0.0, -self._available / self.rate)
+
+
+class EmbeddingScheduler(Embeddings):
+    """
+    Wraps an embeddings backend with batching, throttling and retries
+    
+    Texts are counted with tiktoken and packed into requests that respect
+    the API's per-request input and token limits. Requests are paced by
+    per-minute token and request buckets and retried with jittered
+    exponential backoff on rate-limit and transient errors.
+    """
+    
+    def __init__(self, embeddings, model_name, tokens_per_minute, requests_per_minute,
+                 max_batch_inputs=2048, max_batch_tokens=300000, max_input_tokens=8191,
+                 max_retries=6):
+        """
+        Initialize the scheduler
+        
+        Args:
+            embeddings: Underlying LangChain embeddings object
+            model_name: Embedding model name, used to pick the tokenizer
+            tokens_per_minute: Token rate limit to stay under
+            requests_per_minute: Request rate limit to stay under
+            max_batch_inputs: Maximum texts per request
+            max_batch_tokens: Maximum total tokens per request
+            max_input_tokens: Maximum tokens per text; longer texts are truncated
+            max_retries: Retries per request after the first attempt
+        """
+        self.embeddings = embeddings
+        self.max_batch_inputs = max_batch_inputs
+        self.max_batch_tokens = max_batch_tokens
+        self.max_input_tokens = max_input_tokens
+        self.max_retries = max_retries
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.request_bucket = TokenBucket(requests_per_minute)
+        
+        try:
+            self.encoding = tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            self.encoding = tiktoken.get_encoding("cl100k_base")
+    
+    def _prepare(self, texts):
+        """
+        Truncate over-long texts and pack all texts into request batches
+        
+        Returns:
+            List of (texts, token_count) batches, in input order
+        """
+        batches = []
+        batch = []
+        batch_tokens = 0
+        
+        for text in texts:
+            tokens = self.encoding.encode(text, disallowed_special=())
+            if len(tokens) > self.max_input_tokens:
+                tokens = tokens[:self.max_input_tokens]
+                text = self.encoding.decode(tokens)
+            
+            if batch and (len(batch) >= self.max_batch_inputs
+                          or batch_tokens + len(tokens) > self.max_batch_tokens):
+                batches.append((batch, batch_tokens))
+                batch = []
+                batch_tokens = 0
+            
+            batch.append(text)
+            batch_tokens += len(tokens)
+        
+        if batch:
+            batches.append((batch, batch_tokens))
+        return batches
+    
+    def _reserve(self, token_count):
+        """Reserve rate-limit capacity for one request; returns seconds to wait"""
+        return max(self.token_bucket.reserve(token_count), self.request_bucket.reserve(1))
+    
+    @staticmethod
+    def _is_retryable(error):
+        """Rate limits and transient failures are retried; exhausted quota is not"""
+        if isinstance(error, openai.RateLimitError):
+            return "insufficient_quota" not in str(error)
+        return isinstance(error, (
+            openai.APIConnectionError,
+            openai.APITimeoutError,
+            openai.InternalServerError
+        ))
+    
+    @staticmethod
+    def _count_request(batch, token_count):
+        """Count an embedding API request, its inputs and tokens"""
+        metrics.increment("embedding_api_calls")
+        metrics.increment("embedding_inputs", len(batch))
+        metrics.increment("embedding_tokens", token_count)
+    
+    @staticmethod
+    def _backoff(attempt):
+        """Exponential backoff with full jitter"""
+        return random.uniform(0, min(60, 2 ** attempt))
+    
+    def embed_documents(self, texts):
+        """
+        Embed texts in rate-limited, token-packed batches
+        
+        Args:
+            texts: List of strings
+            
+        Returns:
+            List of embedding vectors in the same order as texts
+        """
+        vectors = []
+        for batch, token_count in self._prepare(texts):
+            for attempt in range(self.max_retries + 1):
+                time.sleep(self._reserve(token_count))
+                self._count_request(batch, token_count)
+                try:
+                    with metrics.span("embedding_request"):
+                        vectors.extend(self.embeddings.embed_documents(batch))
+                    break
+                except Exception as e:
+                    metrics.increment("embedding_api_errors", error=type(e).__name__)
+                    if not self._is_retryable(e) or attempt == self.max_retries:
+                        raise
+                    time.sleep(self._backoff(attempt))
+        return vectors
+    
+    def embed_query(self, text):
+        """
+        Embed a single query text
+        
+        Args:
+            text: Query string
+            
+        Returns:
+            Embedding vector
+        """
+        return self.embed_documents([text])[0]
+    
+    async def aembed_documents(self, texts):
+        """
+        Asynchronously embed texts in rate-limited, token-packed batches
+        
+        Args:
+            texts: List of strings
+            
+        Returns:
+            List of embedding vectors in the same order as texts
+        """
+        vectors = []
+        for batch, token_count in self._prepare(texts):
+            for attempt in range(self.max_retries + 1):
+                await asyncio.sleep(self._reserve(token_count))
+                self._count_request(batch, token_count)
+                start = time.perf_counter()
+                try:
+                    vectors.extend(await self.embeddings.aembed_documents(batch))
+                    metrics.observe("embedding_request", time.perf_counter() - start)
+                    break
+                except Exception as e:
+                    metrics.increment("embedding_api_errors", error=type(e).__name__)
+                    if not self._is_retryable(e) or attempt == self.max_retries:
+                        raise
+                    await asyncio.sleep(self._backoff(attempt))
+        return vectors
+    
+    async def aembed_query(self, text):
+        """
+        Asynchronously embed a single query text
+        
+        Args:
+            text: Query string
+            
+        Returns:
+            Embedding vector
+        """
+        return (await self.aembed_documents([text]))[0]
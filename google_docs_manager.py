@@ -3,104 +3,486 @@ Google Docs Manager
 Handles fetching and listing Google Docs from user's account
 """
 
+import asyncio
+import itertools
+import json
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import httplib2
+from google.auth.exceptions import TransportError
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from auth_manager import AuthManager
+from document_cache import DocumentContentCache
+from document_structure import extract_segments, render_segments
+from metrics import metrics
+from config import (
+    DOCS_FETCH_MAX_WORKERS,
+    DRIVE_LIST_PAGE_SIZE,
+    GOOGLE_API_MAX_RETRIES,
+    GOOGLE_API_MAX_RETRY_DELAY,
+    DOCUMENT_CACHE_PATH,
+    DOCUMENT_CACHE_MAX_BYTES
+)
+
+# Format tag of the segment JSON stored in the content cache
+SEGMENTS_CACHE_FORMAT = "segments-v1"
+
+# HTTP statuses worth retrying: rate limiting and transient server errors
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+# Connection-level failures (timeouts, resets, TLS and token-refresh
+# transport errors), retried like the statuses above
+TRANSPORT_ERRORS = (OSError, httplib2.HttpLib2Error, TransportError)
+
+# Errors after which a single document is reported as not fetched
+FETCH_ERRORS = (HttpError,) + TRANSPORT_ERRORS
 
 
 class GoogleDocsManager:
     """Manages Google Docs operations"""
     
-    def __init__(self, credentials):
+    def __init__(self, credentials, drive_service=None, docs_service=None, content_cache=None):
         """
         Initialize with authenticated credentials
         
         Args:
             credentials: OAuth 2.0 credentials object
+            drive_service: Optional prebuilt Drive v3 service (e.g. a local fake)
+            docs_service: Optional prebuilt Docs v1 service (e.g. a local fake)
+            content_cache: Optional DocumentContentCache; defaults to the
+                on-disk cache configured in config.py
+        """
+        self.credentials = credentials
+        self.content_cache = content_cache or DocumentContentCache(
+            DOCUMENT_CACHE_PATH, max_bytes=DOCUMENT_CACHE_MAX_BYTES
+        )
+        self.service = drive_service or build('drive', 'v3', credentials=credentials)
+        self.docs_service = docs_service or build('docs', 'v1', credentials=credentials)
+        
+        # googleapiclient services are not thread-safe, so worker threads get
+        # their own services unless they were injected
+        self._shared_drive_service = drive_service is not None
+        self._shared_docs_service = docs_service is not None
+        self._thread_local = threading.local()
+    
+    def _get_thread_service(self, api):
+        """
+        Return a Drive or Docs service that is safe to use from the current thread
+        
+        Args:
+            api: 'drive' or 'docs'
+        """
+        shared = self._shared_drive_service if api == 'drive' else self._shared_docs_service
+        if shared or threading.current_thread() is threading.main_thread():
+            return self.service if api == 'drive' else self.docs_service
+        
+        if not hasattr(self._thread_local, api):
+            version = 'v3' if api == 'drive' else 'v1'
+            setattr(self._thread_local, api, build(
+                api, version, credentials=self.credentials, cache_discovery=False
+            ))
+        return getattr(self._thread_local, api)
+    
+    @staticmethod
+    def _execute_with_retry(request, max_retries=GOOGLE_API_MAX_RETRIES):
+        """
+        Execute an API request, backing off on 429, transient 5xx errors
+        and connection failures
+        
+        Args:
+            request: googleapiclient HttpRequest (anything with execute())
+            max_retries: Number of retries after the first attempt
+            
+        Returns:
+            Parsed response
         """
-        self.service = build('drive', 'v3', credentials=credentials)
-        self.docs_service = build('docs', 'v1', credentials=credentials)
+        method = getattr(request, 'methodId', None) or 'unknown'
+        for attempt in range(max_retries + 1):
+            metrics.increment("google_api_calls", method=method)
+            retry_after = None
+            try:
+                return request.execute()
+            except HttpError as error:
+                status = getattr(error.resp, 'status', None)
+                metrics.increment("google_api_errors", method=method, status=status)
+                if status not in RETRYABLE_STATUSES or attempt == max_retries:
+                    raise
+                retry_after = error.resp.get('retry-after') if hasattr(error.resp, 'get') else None
+            except TRANSPORT_ERRORS:
+                metrics.increment("google_api_errors", method=method, status="transport")
+                if attempt == max_retries:
+                    raise
+            
+            # Honour Retry-After when the server sends it, up to a cap so one
+            # response cannot park a worker thread; otherwise use exponential
+            # backoff with full jitter
+            try:
+                delay = min(max(float(retry_after), 0.0), GOOGLE_API_MAX_RETRY_DELAY)
+            except (TypeError, ValueError):
+                delay = random.uniform(0, min(32, 2 ** attempt))
+            time.sleep(delay)
     
-    def list_documents(self):
+    def get_user_id(self):
+        """
+        Get a stable identifier for the signed-in user
+        
+        Returns:
+            The user's Drive permission ID
+        """
+        about = self._execute_with_retry(
+            self._get_thread_service('drive').about().get(fields="user(permissionId)")
+        )
+        return about['user']['permissionId']
+    
+    def list_documents(self, modified_after=None):
         """
         Fetch all Google Docs from user's account
         
+        Args:
+            modified_after: Optional RFC 3339 timestamp; only documents
+                modified after it are returned
+        
         Returns:
             List of dictionaries containing document info (id, name, modified_time)
         """
         try:
-            documents = []
-            
-            # Query for Google Docs files
-            query = "mimeType='application/vnd.google-apps.document' and trashed=false"
-            
-            # Fetch documents
-            results = self.service.files().list(
-                q=query,
-                pageSize=100,
-                fields="files(id, name, modifiedTime)",
-                orderBy="modifiedTime desc"
-            ).execute()
+            return list(self.iter_documents(modified_after=modified_after))
+        
+        except FETCH_ERRORS as error:
+            print(f"An error occurred: {error}")
+            return []
+    
+    def iter_documents(self, modified_after=None, page_size=DRIVE_LIST_PAGE_SIZE):
+        """
+        Lazily page through every Google Doc in the user's Drive
+        
+        Each page is requested only when the previous one has been consumed,
+        so callers can render results as they arrive.
+        
+        Args:
+            modified_after: Optional RFC 3339 timestamp; only documents
+                modified after it are returned
+            page_size: Files per Drive API page (the API maximum is 1000)
             
-            items = results.get('files', [])
+        Yields:
+            Dictionaries containing document info (id, name, modified_time)
+        """
+        # Query for Google Docs files
+        query = "mimeType='application/vnd.google-apps.document' and trashed=false"
+        if modified_after:
+            query += f" and modifiedTime > '{modified_after}'"
+        
+        page_token = None
+        while True:
+            results = self._execute_with_retry(
+                self.service.files().list(
+                    q=query,
+                    pageSize=page_size,
+                    pageToken=page_token,
+                    fields="nextPageToken, files(id, name, modifiedTime)",
+                    orderBy="modifiedTime desc"
+                )
+            )
             
-            for item in items:
-                documents.append({
+            for item in results.get('files', []):
+                yield {
                     'id': item['id'],
                     'name': item['name'],
                     'modified_time': item.get('modifiedTime', '')
+                }
+            
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                break
+    
+    def get_start_page_token(self):
+        """
+        Get the Drive changes cursor for "now"
+        
+        Returns:
+            Start page token string for list_changes()
+        """
+        response = self._execute_with_retry(
+            self._get_thread_service('drive').changes().getStartPageToken()
+        )
+        return response['startPageToken']
+    
+    def list_changes(self, page_token):
+        """
+        Fetch every Drive change recorded since a page token
+        
+        Args:
+            page_token: Token from get_start_page_token() or a previous call
+            
+        Returns:
+            Tuple of (changes, new_start_page_token). Each change is a dict with
+            'id', 'removed', and - when the file still exists - 'name',
+            'trashed', 'is_document' and 'modified_time'
+        """
+        changes = []
+        new_start_page_token = page_token
+        
+        while page_token:
+            results = self._execute_with_retry(
+                self._get_thread_service('drive').changes().list(
+                    pageToken=page_token,
+                    pageSize=DRIVE_LIST_PAGE_SIZE,
+                    includeRemoved=True,
+                    fields=(
+                        "nextPageToken, newStartPageToken, "
+                        "changes(fileId, removed, file(id, name, mimeType, trashed, modifiedTime))"
+                    )
+                )
+            )
+            
+            for change in results.get('changes', []):
+                file = change.get('file') or {}
+                changes.append({
+                    'id': change.get('fileId'),
+                    'removed': change.get('removed', False),
+                    'name': file.get('name', ''),
+                    'trashed': file.get('trashed', False),
+                    'is_document': file.get('mimeType') == 'application/vnd.google-apps.document',
+                    'modified_time': file.get('modifiedTime', '')
                 })
             
-            return documents
+            if 'newStartPageToken' in results:
+                new_start_page_token = results['newStartPageToken']
+            page_token = results.get('nextPageToken')
         
-        except HttpError as error:
-            print(f"An error occurred: {error}")
-            return []
+        return changes, new_start_page_token
     
-    def get_document_content(self, document_id):
+    def get_document_content(self, document_id, version=None):
         """
         Fetch full content of a Google Doc
         
         Args:
             document_id: ID of the Google Doc
+            version: Optional document version (its Drive modifiedTime); when
+                the cached text has the same version the API call is skipped
             
         Returns:
-            Text content of the document
+            Text content of the document, or None if it could not be fetched
         """
         try:
-            doc = self.docs_service.documents().get(documentId=document_id).execute()
-            
-            # Extract text content
-            text_content = []
-            
-            def extract_text(element):
-                """Recursively extract text from document elements"""
-                if 'paragraph' in element:
-                    para = element['paragraph']
-                    if 'elements' in para:
-                        for elem in para['elements']:
-                            if 'textRun' in elem:
-                                text_content.append(elem['textRun'].get('content', ''))
-                elif 'table' in element:
-                    # Handle tables
-                    table = element['table']
-                    if 'tableRows' in table:
-                        for row in table['tableRows']:
-                            if 'tableCells' in row:
-                                for cell in row['tableCells']:
-                                    if 'content' in cell:
-                                        for content_elem in cell['content']:
-                                            extract_text(content_elem)
-            
-            # Process document body
-            if 'body' in doc and 'content' in doc['body']:
-                for element in doc['body']['content']:
-                    extract_text(element)
-            
-            return ''.join(text_content).strip()
-        
-        except HttpError as error:
+            return render_segments(self._get_cached_segments(document_id, version))
+        
+        except FETCH_ERRORS as error:
             print(f"An error occurred while fetching document: {error}")
-            return ""
-
-
+            return None
+    
+    def get_documents_content(self, document_ids, versions=None, max_workers=DOCS_FETCH_MAX_WORKERS):
+        """
+        Fetch the content of several Google Docs concurrently
+        
+        Requests run on a bounded thread pool and each one is retried with
+        backoff on rate limiting (429) and transient server errors.
+        
+        Args:
+            document_ids: Iterable of Google Doc IDs
+            versions: Optional dict mapping document ID to its version
+                (modifiedTime); documents whose cached version matches are
+                served from the content cache
+            max_workers: Maximum number of requests in flight
+            
+        Returns:
+            Dict mapping document ID to its text content (None if it could
+            not be fetched)
+        """
+        return dict(self.iter_documents_content(
+            document_ids, versions=versions, max_workers=max_workers
+        ))
+    
+    def iter_documents_content(self, document_ids, versions=None, max_workers=DOCS_FETCH_MAX_WORKERS):
+        """
+        Fetch Google Docs concurrently, yielding each one's text as it completes
+        
+        Args:
+            document_ids: Iterable of Google Doc IDs
+            versions: Optional dict mapping document ID to its version
+            max_workers: Maximum number of requests in flight
+            
+        Yields:
+            Tuples of (document_id, content), content being None if the
+            document could not be fetched
+        """
+        for document_id, segments in self.iter_documents_segments(
+            document_ids, versions=versions, max_workers=max_workers
+        ):
+            yield document_id, render_segments(segments) if segments is not None else None
+    
+    def iter_documents_segments(self, document_ids, versions=None, max_workers=DOCS_FETCH_MAX_WORKERS):
+        """
+        Fetch Google Docs concurrently, yielding each one's structure as it completes
+        
+        At most max_workers documents are in flight and new requests are
+        only submitted as results are consumed, so a slow consumer keeps
+        memory bounded instead of accumulating every fetched document.
+        
+        Args:
+            document_ids: Iterable of Google Doc IDs
+            versions: Optional dict mapping document ID to its version
+            max_workers: Maximum number of requests in flight
+            
+        Yields:
+            Tuples of (document_id, segments) with segments as returned by
+            document_structure.extract_segments, or None if the document
+            could not be fetched (as opposed to [] for an empty document)
+        """
+        pending_ids = iter(dict.fromkeys(document_ids))
+        versions = versions or {}
+        
+        def fetch(document_id):
+            try:
+                return self._get_cached_segments(document_id, versions.get(document_id))
+            except FETCH_ERRORS as error:
+                print(f"An error occurred while fetching document {document_id}: {error}")
+                return None
+        
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            in_flight = {}
+            for document_id in itertools.islice(pending_ids, max_workers):
+                in_flight[executor.submit(fetch, document_id)] = document_id
+            
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    document_id = in_flight.pop(future)
+                    for next_id in itertools.islice(pending_ids, 1):
+                        in_flight[executor.submit(fetch, next_id)] = next_id
+                    yield document_id, future.result()
+    
+    async def aget_documents_content(self, document_ids, versions=None,
+                                     max_concurrency=DOCS_FETCH_MAX_WORKERS):
+        """
+        Asynchronously fetch the content of several Google Docs
+        
+        Args:
+            document_ids: Iterable of Google Doc IDs
+            versions: Optional dict mapping document ID to its version
+            max_concurrency: Maximum number of requests in flight
+            
+        Returns:
+            Dict mapping document ID to its text content (None if it could
+            not be fetched)
+        """
+        contents = {}
+        async for document_id, content in self.aiter_documents_content(
+            document_ids, versions=versions, max_concurrency=max_concurrency
+        ):
+            contents[document_id] = content
+        return contents
+    
+    async def aiter_documents_content(self, document_ids, versions=None,
+                                      max_concurrency=DOCS_FETCH_MAX_WORKERS):
+        """
+        Asynchronously fetch Google Docs, yielding each one's text as it completes
+        
+        Args:
+            document_ids: Iterable of Google Doc IDs
+            versions: Optional dict mapping document ID to its version
+            max_concurrency: Maximum number of requests in flight
+            
+        Yields:
+            Tuples of (document_id, content), content being None if the
+            document could not be fetched
+        """
+        async for document_id, segments in self.aiter_documents_segments(
+            document_ids, versions=versions, max_concurrency=max_concurrency
+        ):
+            yield document_id, render_segments(segments) if segments is not None else None
+    
+    async def aiter_documents_segments(self, document_ids, versions=None,
+                                       max_concurrency=DOCS_FETCH_MAX_WORKERS):
+        """
+        Asynchronously fetch Google Docs, yielding each one's structure as it completes
+        
+        A fixed pool of max_concurrency worker tasks takes IDs from a queue
+        and runs the blocking googleapiclient calls on worker threads (each
+        with its own Docs service). Results pass through a queue of the same
+        size, so a slow consumer stalls the workers instead of letting every
+        fetched document pile up in memory.
+        
+        Args:
+            document_ids: Iterable of Google Doc IDs
+            versions: Optional dict mapping document ID to its version
+            max_concurrency: Maximum number of requests in flight
+            
+        Yields:
+            Tuples of (document_id, segments), segments being None if the
+            document could not be fetched
+        """
+        versions = versions or {}
+        pending_ids = asyncio.Queue()
+        for document_id in dict.fromkeys(document_ids):
+            pending_ids.put_nowait(document_id)
+        total = pending_ids.qsize()
+        results = asyncio.Queue(maxsize=max(1, max_concurrency))
+        
+        async def worker():
+            while not pending_ids.empty():
+                document_id = pending_ids.get_nowait()
+                try:
+                    segments = await asyncio.to_thread(
+                        self._get_cached_segments, document_id, versions.get(document_id)
+                    )
+                except FETCH_ERRORS as error:
+                    print(f"An error occurred while fetching document {document_id}: {error}")
+                    segments = None
+                except Exception as error:
+                    # Handed to the consumer, which would otherwise wait forever
+                    await results.put(error)
+                    return
+                await results.put((document_id, segments))
+        
+        workers = [asyncio.create_task(worker()) for _ in range(min(max(1, max_concurrency), total))]
+        try:
+            for _ in range(total):
+                result = await results.get()
+                if isinstance(result, Exception):
+                    raise result
+                yield result
+        finally:
+            for task in workers:
+                task.cancel()
+    
+    def _get_cached_segments(self, document_id, version):
+        """
+        Return a document's segments from the content cache, fetching them on a miss
+        
+        Args:
+            document_id: ID of the Google Doc
+            version: Expected document version, or None to always fetch
+            
+        Returns:
+            List of segments from document_structure.extract_segments
+        """
+        # Segments are cached as JSON under a versioned key so entries
+        # written in another format are never misread
+        cache_version = f"{version}|{SEGMENTS_CACHE_FORMAT}" if version else None
+        cached = self.content_cache.get(document_id, cache_version)
+        if cached is not None:
+            metrics.increment("cache_lookups", cache="documents", result="hit")
+            return json.loads(cached)
+        metrics.increment("cache_lookups", cache="documents", result="miss")
+        
+        request = self._get_thread_service('docs').documents().get(documentId=document_id)
+        parse = request.postproc
+        
+        def measure(response, content):
+            # Size of the response body as received, before it is parsed
+            metrics.increment("bytes_fetched", len(content), api="docs")
+            return parse(response, content)
+        
+        request.postproc = measure
+        with metrics.span("fetch_document"):
+            doc = self._execute_with_retry(request)
+        
+        with metrics.span("extract_segments"):
+            segments = extract_segments(doc)
+        self.content_cache.put(document_id, cache_version, json.dumps(segments))
+        return segments
@@ -0,0 +1,151 @@
+"""
+Keyword Index
+Local BM25 inverted index over knowledge-base chunks
+"""
+
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+
+# Words, numbers and identifier-like tokens such as ERR-404, v1.2 or user_id
+TOKEN_PATTERN = re.compile(r"\w+(?:[-.]\w+)*")
+
+
+def tokenize(text):
+    """
+    Split text into lowercase index terms
+    
+    Identifier-like tokens are kept whole and also indexed by their parts,
+    so "ERR-404" matches both "err-404" and "404".
+    """
+    terms = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        terms.append(token)
+        if '-' in token or '.' in token:
+            terms.extend(part for part in re.split(r"[-.]", token) if part)
+    return terms
+
+
+def is_exact_term(term):
+    """Whether a term looks like an ID or code rather than a plain word"""
+    return any(ch.isdigit() for ch in term) or any(ch in term for ch in "-._")
+
+
+class BM25Index:
+    """
+    In-memory BM25 index kept in step with a vector store collection
+    
+    Chunks are added and removed by the same IDs used in the vector store,
+    so the two stay consistent across incremental updates.
+    """
+    
+    def __init__(self, k1=1.5, b=0.75):
+        """
+        Initialize an empty index
+        
+        Args:
+            k1: Term-frequency saturation parameter
+            b: Document-length normalization parameter
+        """
+        self.k1 = k1
+        self.b = b
+        self._postings = defaultdict(dict)  # term -> {chunk_id: term frequency}
+        self._lengths = {}
+        self._chunks = {}  # chunk_id -> (text, metadata)
+        self._total_length = 0
+        self._lock = threading.RLock()
+    
+    def __len__(self):
+        return len(self._chunks)
+    
+    def add(self, ids, texts, metadatas):
+        """
+        Index chunks, replacing any with the same IDs
+        
+        Args:
+            ids: Chunk IDs
+            texts: Chunk texts
+            metadatas: Chunk metadata dicts
+        """
+        with self._lock:
+            self.remove([chunk_id for chunk_id in ids if chunk_id in self._chunks])
+            for chunk_id, text, metadata in zip(ids, texts, metadatas):
+                terms = Counter(tokenize(text))
+                for term, frequency in terms.items():
+                    self._postings[term][chunk_id] = frequency
+                length = sum(terms.values())
+                self._lengths[chunk_id] = length
+                self._total_length += length
+                self._chunks[chunk_id] = (text, metadata or {})
+    
+    def remove(self, ids):
+        """
+        Remove chunks from the index
+        
+        Args:
+            ids: Chunk IDs
+        """
+        with self._lock:
+            for chunk_id in ids:
+                if chunk_id not in self._chunks:
+                    continue
+                text, _ = self._chunks.pop(chunk_id)
+                for term in set(tokenize(text)):
+                    postings = self._postings.get(term)
+                    if postings is not None:
+                        postings.pop(chunk_id, None)
+                        if not postings:
+                            del self._postings[term]
+                self._total_length -= self._lengths.pop(chunk_id)
+    
+    def clear(self):
+        """Remove every chunk"""
+        with self._lock:
+            self._postings.clear()
+            self._lengths.clear()
+            self._chunks.clear()
+            self._total_length = 0
+    
+    def get(self, chunk_id):
+        """
+        Look up an indexed chunk
+        
+        Returns:
+            Tuple of (text, metadata), or None if the chunk is not indexed
+            (e.g. it was removed after a search returned it)
+        """
+        return self._chunks.get(chunk_id)
+    
+    def contains_terms(self, chunk_id, terms):
+        """Whether a chunk contains every one of the given terms"""
+        return all(chunk_id in self._postings.get(term, {}) for term in terms)
+    
+    def search(self, query, k):
+        """
+        Rank chunks against a query with BM25
+        
+        Args:
+            query: Query text
+            k: Number of results
+            
+        Returns:
+            List of (chunk_id, score) tuples, best first
+        """
+        with self._lock:
+            count = len(self._chunks)
+            if not count:
+                return []
+            average_length = self._total_length / count
+            
+            scores = defaultdict(float)
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for chunk_id, frequency in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._lengths[chunk_id] / average_length)
+                    scores[chunk_id] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+            
+            return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
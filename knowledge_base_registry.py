@@ -0,0 +1,189 @@
+"""
+Knowledge Base Registry
+Per-user, per-selection knowledge bases served from one process
+"""
+
+import hashlib
+import os
+import shutil
+import threading
+import time
+
+from rag_system import RAGSystem
+from embedding_backends import embedding_namespace
+from config import KB_COLLECTION_TTL, KB_GC_INTERVAL, EMBEDDING_BACKEND
+
+
+class KnowledgeBaseRegistry:
+    """
+    Hands out isolated RAGSystem instances keyed by user and document selection
+    
+    Every knowledge base lives in its own Chroma collection, so concurrent
+    builds for different users never touch each other's index. All instances
+    share one set of OpenAI clients, one Chroma client and the persistent
+    embedding cache, which acts as the shared chunk-embedding pool: a chunk
+    embedded for one collection is free for every other collection. Idle
+    collections are garbage-collected after KB_COLLECTION_TTL seconds,
+    except those a long-lived user such as a Drive sync has retained.
+    """
+    
+    def __init__(self, ttl=KB_COLLECTION_TTL, gc_interval=KB_GC_INTERVAL):
+        """
+        Initialize the registry
+        
+        Args:
+            ttl: Seconds a collection may stay unused before it is deleted
+            gc_interval: Minimum seconds between garbage-collection sweeps
+        """
+        self.ttl = ttl
+        self.gc_interval = gc_interval
+        self._base = RAGSystem()
+        self._systems = {}
+        self._last_used = {}
+        self._creation_locks = {}
+        self._holders = {}
+        self._lock = threading.Lock()
+        self._last_gc = 0.0
+    
+    @staticmethod
+    def collection_name(user_id, document_ids):
+        """
+        Build the collection name for a user's document selection
+        
+        Args:
+            user_id: Stable identifier of the signed-in user
+            document_ids: Iterable of selected Google Doc IDs
+            
+        Returns:
+            Chroma-safe collection name; backends other than OpenAI get
+            their own collections, since their vectors are not comparable
+        """
+        key = "\n".join([user_id] + sorted(set(document_ids)))
+        namespace = embedding_namespace(EMBEDDING_BACKEND)
+        if namespace:
+            key = namespace + "\n" + key
+        return "kb_" + hashlib.sha256(key.encode('utf-8')).hexdigest()[:40]
+    
+    def get(self, user_id, document_ids):
+        """
+        Get the knowledge base for a user's document selection
+        
+        The persisted collection is reopened if it exists. Concurrent calls
+        for the same selection wait for each other and share one instance.
+        
+        Args:
+            user_id: Stable identifier of the signed-in user
+            document_ids: Iterable of selected Google Doc IDs
+            
+        Returns:
+            RAGSystem bound to the selection's collection
+        """
+        name = self.collection_name(user_id, document_ids)
+        
+        with self._lock:
+            creation_lock = self._creation_locks.setdefault(name, threading.Lock())
+        
+        with creation_lock:
+            rag_system = self._systems.get(name)
+            if rag_system is None:
+                rag_system = RAGSystem(collection_name=name, shared_with=self._base)
+                rag_system.load_knowledge_base()
+                self._systems[name] = rag_system
+            self.touch(name)
+        
+        self.maybe_collect_garbage()
+        return rag_system
+    
+    def touch(self, name):
+        """
+        Mark a collection as in use, in memory and in its persisted metadata
+        
+        Args:
+            name: Collection name
+        """
+        now = time.time()
+        with self._lock:
+            previous = self._last_used.get(name, 0.0)
+            self._last_used[name] = now
+        
+        # Persist at most once a minute so GC also works after a restart
+        if now - previous > 60:
+            collection = self._base.client.get_or_create_collection(name)
+            collection.modify(metadata={'last_used': now})
+    
+    def retain(self, name):
+        """
+        Keep a collection from being garbage-collected until release()
+        
+        Args:
+            name: Collection name
+        """
+        with self._lock:
+            self._holders[name] = self._holders.get(name, 0) + 1
+    
+    def release(self, name):
+        """
+        Undo one retain() of a collection
+        
+        Args:
+            name: Collection name
+        """
+        with self._lock:
+            count = self._holders.get(name, 0) - 1
+            if count > 0:
+                self._holders[name] = count
+            else:
+                self._holders.pop(name, None)
+    
+    def maybe_collect_garbage(self):
+        """Run collect_garbage() if gc_interval has passed since the last sweep"""
+        with self._lock:
+            if time.time() - self._last_gc < self.gc_interval:
+                return
+            self._last_gc = time.time()
+        self.collect_garbage()
+    
+    def collect_garbage(self):
+        """
+        Delete collections that have been idle for longer than the TTL and
+        are not retained
+        
+        Returns:
+            List of deleted collection names
+        """
+        client = self._base.client
+        cutoff = time.time() - self.ttl
+        deleted = []
+        
+        for collection in client.list_collections():
+            # Newer Chroma versions return names, older ones Collection objects
+            name = getattr(collection, 'name', collection)
+            if not name.startswith("kb_"):
+                continue
+            
+            with self._lock:
+                creation_lock = self._creation_locks.setdefault(name, threading.Lock())
+            
+            with creation_lock:
+                with self._lock:
+                    retained = name in self._holders
+                if retained:
+                    continue
+                last_used = self._last_used.get(name)
+                if last_used is None:
+                    metadata = client.get_collection(name).metadata or {}
+                    last_used = metadata.get('last_used', 0.0)
+                if last_used >= cutoff:
+                    continue
+                
+                # The Chroma collection also carries the last_used metadata
+                # of knowledge bases kept in the numpy store
+                client.delete_collection(name)
+                if self._base.vector_store_backend == "numpy":
+                    shutil.rmtree(os.path.join(self._base.numpy_store_path, name), ignore_errors=True)
+                with self._lock:
+                    self._systems.pop(name, None)
+                    self._last_used.pop(name, None)
+                deleted.append(name)
+        
+        return deleted
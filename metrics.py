@@ -0,0 +1,265 @@
+"""
+Metrics
+Lightweight tracing spans, counters and exporters for the RAG hot paths
+"""
+
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Metric names are exported with this prefix
+METRIC_PREFIX = "rag_"
+
+
+def _label_key(labels):
+    """Hashable, ordered form of a labels dict"""
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(label_key, extra=()):
+    """Render labels in Prometheus text format"""
+    pairs = list(label_key) + list(extra)
+    if not pairs:
+        return ""
+    rendered = (
+        '{}="{}"'.format(
+            key, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        )
+        for key, value in pairs
+    )
+    return "{" + ",".join(rendered) + "}"
+
+
+class Metrics:
+    """
+    In-process registry of spans and counters
+    
+    A span times one stage (fetch, split, embed, retrieve, generate, ...) and
+    nests under the span that is open on the same thread. Counters track
+    tokens, API calls, cache hits and bytes fetched.
+    """
+    
+    def __init__(self, window=1000):
+        """
+        Initialize an empty registry
+        
+        Args:
+            window: Number of recent durations kept per span for quantiles
+        """
+        self.window = window
+        self._counters = {}
+        self._spans = {}
+        self._jsonl = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+    
+    def increment(self, name, value=1, **labels):
+        """
+        Add to a counter
+        
+        Args:
+            name: Counter name, e.g. "embedding_tokens"
+            value: Amount to add
+            labels: Optional labels, e.g. api="docs"
+        """
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+    
+    @contextmanager
+    def span(self, name, **labels):
+        """
+        Time a stage
+        
+        Usage:
+            with metrics.span("retrieve"):
+                ...
+        
+        Args:
+            name: Stage name
+            labels: Optional labels
+        """
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        parent = stack[-1] if stack else None
+        stack.append(name)
+        start = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            stack.pop()
+            self._record(name, labels, duration, parent, error)
+    
+    def observe(self, name, duration, **labels):
+        """
+        Record a stage timed by the caller
+        
+        For stages that span generator yields or awaits, where a span
+        context would nest under unrelated work on the same thread.
+        
+        Args:
+            name: Stage name
+            duration: Seconds
+            labels: Optional labels
+        """
+        self._record(name, labels, duration, None, None)
+    
+    def _record(self, name, labels, duration, parent, error):
+        """Aggregate a finished span and write it to the JSONL log"""
+        key = (name, _label_key(labels))
+        with self._lock:
+            stats = self._spans.get(key)
+            if stats is None:
+                stats = self._spans[key] = {
+                    'count': 0, 'sum': 0.0, 'max': 0.0, 'errors': 0,
+                    'recent': deque(maxlen=self.window)
+                }
+            stats['count'] += 1
+            stats['sum'] += duration
+            stats['max'] = max(stats['max'], duration)
+            stats['recent'].append(duration)
+            if error:
+                stats['errors'] += 1
+            
+            if self._jsonl is not None:
+                self._jsonl.write(json.dumps({
+                    'ts': time.time(),
+                    'span': name,
+                    'parent': parent,
+                    'seconds': duration,
+                    'labels': labels,
+                    'error': error,
+                    'thread': threading.current_thread().name
+                }, default=str) + "\n")
+                self._jsonl.flush()
+    
+    def open_jsonl(self, path):
+        """
+        Append every finished span to a JSONL file
+        
+        Args:
+            path: File path, or None to stop logging
+        """
+        with self._lock:
+            if self._jsonl is not None:
+                self._jsonl.close()
+            self._jsonl = open(path, 'a', encoding='utf-8') if path else None
+    
+    @staticmethod
+    def _quantile(values, q):
+        """Quantile of a small sample by nearest rank"""
+        ordered = sorted(values)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+    
+    def snapshot(self):
+        """
+        Current values of every span and counter
+        
+        Returns:
+            Dict with 'spans' (name -> list of {'labels', 'count',
+            'total_seconds', 'mean_seconds', 'p50_seconds', 'p95_seconds',
+            'max_seconds', 'errors'}) and 'counters' (name -> list of
+            {'labels', 'value'})
+        """
+        with self._lock:
+            spans = {}
+            for (name, label_key), stats in self._spans.items():
+                spans.setdefault(name, []).append({
+                    'labels': dict(label_key),
+                    'count': stats['count'],
+                    'total_seconds': stats['sum'],
+                    'mean_seconds': stats['sum'] / stats['count'],
+                    'p50_seconds': self._quantile(stats['recent'], 0.5),
+                    'p95_seconds': self._quantile(stats['recent'], 0.95),
+                    'max_seconds': stats['max'],
+                    'errors': stats['errors']
+                })
+            counters = {}
+            for (name, label_key), value in self._counters.items():
+                counters.setdefault(name, []).append({'labels': dict(label_key), 'value': value})
+        return {'spans': spans, 'counters': counters}
+    
+    def render_prometheus(self):
+        """
+        Render the registry in the Prometheus text exposition format
+        
+        Spans become summaries (<name>_seconds with p50/p95 quantiles over
+        the recent window) and counters become <name>_total.
+        
+        Returns:
+            Exposition text
+        """
+        snapshot = self.snapshot()
+        lines = []
+        
+        for name, series in sorted(snapshot['spans'].items()):
+            metric = f"{METRIC_PREFIX}{name}_seconds"
+            lines.append(f"# TYPE {metric} summary")
+            for item in series:
+                label_key = _label_key(item['labels'])
+                for quantile in ('0.5', '0.95'):
+                    value = item['p50_seconds'] if quantile == '0.5' else item['p95_seconds']
+                    lines.append(f"{metric}{_format_labels(label_key, [('quantile', quantile)])} {value}")
+                lines.append(f"{metric}_sum{_format_labels(label_key)} {item['total_seconds']}")
+                lines.append(f"{metric}_count{_format_labels(label_key)} {item['count']}")
+        
+        for name, series in sorted(snapshot['counters'].items()):
+            metric = f"{METRIC_PREFIX}{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            for item in series:
+                lines.append(f"{metric}{_format_labels(_label_key(item['labels']))} {item['value']}")
+        
+        return "\n".join(lines) + "\n"
+    
+    def start_http_server(self, port, host="127.0.0.1"):
+        """
+        Serve the Prometheus text format at http://host:port/metrics
+        
+        Runs on a daemon thread.
+        
+        Args:
+            port: TCP port
+            host: Interface to bind; local-only by default
+            
+        Returns:
+            The running ThreadingHTTPServer
+        """
+        registry = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self, *args):
+                pass
+        
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+    
+    def reset(self):
+        """Drop all recorded spans and counters"""
+        with self._lock:
+            self._counters.clear()
+            self._spans.clear()
+
+
+# Process-wide registry used by every module
+metrics = Metrics()
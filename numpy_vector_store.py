@@ -0,0 +1,575 @@
+"""
+NumPy Vector Store
+In-process vector index for small knowledge bases, as an alternative to Chroma
+"""
+
+import json
+import os
+import shutil
+import threading
+import uuid
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+from metrics import metrics
+
+VECTORS_FILE = "vectors.npy"
+CODES_FILE = "codes.npy"
+SCALES_FILE = "scales.npy"
+CHUNKS_FILE = "chunks.json"
+
+# Storage dtype of the search matrix for each precision
+PRECISIONS = {'float32': np.float32, 'float16': np.float16, 'int8': np.int8}
+
+# Rows converted to float32 at a time while scanning a quantized matrix,
+# which bounds the temporary memory of a search
+SCAN_BLOCK_ROWS = 4096
+
+
+def _normalize(matrix):
+    """L2-normalize the rows of a 2-D float32 array"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix[None, :]
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def _quantize(vectors, precision, dimensions):
+    """
+    Encode unit vectors for the search matrix
+    
+    Args:
+        vectors: (n, d) float32 unit vectors
+        precision: Key of PRECISIONS
+        dimensions: Leading dimensions to keep (Matryoshka truncation)
+        
+    Returns:
+        Tuple of (codes, scales); scales is the per-row int8 step, or None
+    """
+    truncated = vectors[:, :dimensions]
+    if dimensions < vectors.shape[1]:
+        truncated = _normalize(truncated)
+    if precision != 'int8':
+        return truncated.astype(PRECISIONS[precision]), None
+    
+    # Symmetric per-row scaling, so each row uses the full int8 range
+    scales = np.maximum(np.abs(truncated).max(axis=1), 1e-12) / 127.0
+    codes = np.rint(truncated / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def _top_k(scores, k):
+    """Column indices and values of the k largest scores per row, best first"""
+    k = min(k, scores.shape[1])
+    if k < scores.shape[1]:
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        top = np.tile(np.arange(scores.shape[1]), (len(scores), 1))
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind='stable')
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+
+def _matches(metadata, where):
+    """Evaluate the subset of Chroma's where filter RAGSystem uses"""
+    for key, condition in where.items():
+        value = (metadata or {}).get(key)
+        if isinstance(condition, dict):
+            for operator, operand in condition.items():
+                if operator == "$in":
+                    if value not in operand:
+                        return False
+                elif operator == "$eq":
+                    if value != operand:
+                        return False
+                else:
+                    raise ValueError(f"Unsupported where operator {operator!r}")
+        elif value != condition:
+            return False
+    return True
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    Brute-force vector store over one contiguous float32 matrix
+    
+    Rows are unit-length embeddings, so a query is one matrix-vector
+    product followed by a partial sort. Chunk IDs, texts and metadata live
+    in parallel lists. The store is persisted as vectors.npy plus
+    chunks.json and reopened with a memory-mapped, read-only matrix, so
+    opening is cheap and the vectors are shared through the OS page cache;
+    the first write copies them into memory.
+    
+    With a float16 or int8 precision, or truncated search dimensions, the
+    scan runs over a smaller quantized copy (codes.npy, plus scales.npy for
+    int8) instead. Only the best rescore_factor * k candidates are then
+    rescored against the full-precision vectors, so the full matrix is
+    paged in just for those rows and returned similarities stay exact.
+    
+    Writes stay in memory until persist() is called.
+    
+    It implements the part of the langchain Chroma wrapper RAGSystem
+    uses: add_texts, upsert, get, delete, delete_collection,
+    similarity_search_by_vector_with_relevance_scores and as_retriever.
+    """
+    
+    def __init__(self, embedding_function, path=None, precision="float32",
+                 search_dimensions=None, rescore_factor=4):
+        """
+        Open a store, loading it from path if it was persisted there
+        
+        Args:
+            embedding_function: LangChain Embeddings used for texts and queries
+            path: Directory holding the store's files, or None for a
+                memory-only store
+            precision: Search matrix precision: "float32", "float16" or "int8"
+            search_dimensions: Optional number of leading dimensions kept in
+                the search matrix
+            rescore_factor: Candidates rescored at full precision, as a
+                multiple of k, when the search matrix is quantized
+        """
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown vector precision {precision!r}; expected one of {sorted(PRECISIONS)}")
+        self.embedding_function = embedding_function
+        self.path = path
+        self.precision = precision
+        self.search_dimensions = search_dimensions
+        self.rescore_factor = rescore_factor
+        self._vectors = None
+        self._codes = None
+        self._scales = None
+        self._size = 0
+        self._ids = []
+        self._documents = []
+        self._metadatas = []
+        self._rows = {}
+        self._dirty = False
+        self._lock = threading.RLock()
+        
+        if path and os.path.exists(os.path.join(path, VECTORS_FILE)):
+            self._load()
+    
+    @property
+    def embeddings(self):
+        """The embeddings used for texts and queries"""
+        return self.embedding_function
+    
+    @property
+    def quantized(self):
+        """True if searches scan a reduced copy and rescore the best rows"""
+        return self.precision != "float32" or self.search_dimensions is not None
+    
+    def __len__(self):
+        return self._size
+    
+    def _code_dimensions(self, dimensions):
+        """Width of the search matrix for vectors of the given width"""
+        return min(self.search_dimensions or dimensions, dimensions)
+    
+    def _load(self):
+        """Memory-map the persisted matrices and read the chunk records"""
+        with open(os.path.join(self.path, CHUNKS_FILE), encoding='utf-8') as f:
+            chunks = json.load(f)
+        self._ids = [chunk['id'] for chunk in chunks]
+        self._documents = [chunk['document'] for chunk in chunks]
+        self._metadatas = [chunk['metadata'] for chunk in chunks]
+        self._rows = {chunk_id: row for row, chunk_id in enumerate(self._ids)}
+        self._vectors = np.load(os.path.join(self.path, VECTORS_FILE), mmap_mode='r')
+        self._size = len(self._ids)
+        
+        if self.quantized and self._size:
+            self._codes, self._scales = self._load_codes()
+            if self._codes is None:
+                # Written with other settings (or none); encode once and
+                # save on the next persist()
+                self._codes, self._scales = _quantize(
+                    np.asarray(self._vectors[:self._size]), self.precision,
+                    self._code_dimensions(self._vectors.shape[1])
+                )
+                self._dirty = True
+    
+    def _load_codes(self):
+        """Memory-map the persisted search matrix if it matches the settings"""
+        codes_path = os.path.join(self.path, CODES_FILE)
+        scales_path = os.path.join(self.path, SCALES_FILE)
+        if not os.path.exists(codes_path):
+            return None, None
+        
+        codes = np.load(codes_path, mmap_mode='r')
+        expected = (self._size, self._code_dimensions(self._vectors.shape[1]))
+        if codes.dtype != PRECISIONS[self.precision] or codes.shape != expected:
+            return None, None
+        if self.precision != 'int8':
+            return codes, None
+        if not os.path.exists(scales_path):
+            return None, None
+        scales = np.load(scales_path, mmap_mode='r')
+        return (codes, scales) if scales.shape == (self._size,) else (None, None)
+    
+    def persist(self):
+        """Write the store to its directory if it changed since the last write"""
+        with self._lock:
+            if not self._dirty or not self.path:
+                return
+            
+            with metrics.span("persist_vector_store"):
+                os.makedirs(self.path, exist_ok=True)
+                files = {
+                    VECTORS_FILE: self._vectors[:self._size] if self._vectors is not None
+                    else np.zeros((0, 0), dtype=np.float32)
+                }
+                if self.quantized and self._codes is not None:
+                    files[CODES_FILE] = self._codes[:self._size]
+                    if self._scales is not None:
+                        files[SCALES_FILE] = self._scales[:self._size]
+                chunks = [
+                    {'id': chunk_id, 'document': document, 'metadata': metadata}
+                    for chunk_id, document, metadata
+                    in zip(self._ids, self._documents, self._metadatas)
+                ]
+                
+                # Write next to the target and rename, so readers never see a
+                # half-written file
+                for name, array in files.items():
+                    target = os.path.join(self.path, name)
+                    with open(target + ".tmp", 'wb') as f:
+                        np.save(f, np.ascontiguousarray(array))
+                    os.replace(target + ".tmp", target)
+                chunks_path = os.path.join(self.path, CHUNKS_FILE)
+                with open(chunks_path + ".tmp", 'w', encoding='utf-8') as f:
+                    json.dump(chunks, f)
+                os.replace(chunks_path + ".tmp", chunks_path)
+                
+                # A search matrix from other settings would be stale now
+                for name in (CODES_FILE, SCALES_FILE):
+                    if name not in files and os.path.exists(os.path.join(self.path, name)):
+                        os.remove(os.path.join(self.path, name))
+            
+            # Serve reads from the page cache again instead of the private copies
+            self._vectors = np.load(os.path.join(self.path, VECTORS_FILE), mmap_mode='r')
+            if CODES_FILE in files:
+                self._codes = np.load(os.path.join(self.path, CODES_FILE), mmap_mode='r')
+            if SCALES_FILE in files:
+                self._scales = np.load(os.path.join(self.path, SCALES_FILE), mmap_mode='r')
+            self._dirty = False
+    
+    @staticmethod
+    def _grow(array, rows, shape, dtype, size):
+        """Writable copy of array's first size rows with room for rows rows"""
+        capacity = 0 if array is None else array.shape[0]
+        if array is not None and array.flags.writeable and array.shape[1:] == shape \
+                and capacity >= rows:
+            return array
+        
+        # Grow geometrically so streaming batches in is amortized O(n)
+        grown = np.zeros((max(rows, 2 * capacity, 64),) + shape, dtype=dtype)
+        if size:
+            grown[:size] = array[:size]
+        return grown
+    
+    def _reserve(self, dimensions, rows):
+        """Make the matrices writable with room for at least rows rows"""
+        if self._vectors is not None and self._size and self._vectors.shape[1] != dimensions:
+            raise ValueError(
+                f"Embedding dimension {dimensions} does not match the store's "
+                f"{self._vectors.shape[1]}"
+            )
+        
+        self._vectors = self._grow(self._vectors, rows, (dimensions,), np.float32, self._size)
+        if self.quantized:
+            self._codes = self._grow(
+                self._codes, rows, (self._code_dimensions(dimensions),),
+                PRECISIONS[self.precision], self._size
+            )
+            if self.precision == 'int8':
+                self._scales = self._grow(self._scales, rows, (), np.float32, self._size)
+    
+    def upsert(self, ids, embeddings, metadatas=None, documents=None):
+        """
+        Insert or replace pre-embedded chunks
+        
+        Args:
+            ids: Chunk IDs
+            embeddings: One vector per ID
+            metadatas: Optional metadata dict per ID
+            documents: Optional text per ID
+        """
+        ids = list(ids)
+        if not ids:
+            return
+        vectors = _normalize(embeddings)
+        metadatas = list(metadatas) if metadatas is not None else [{}] * len(ids)
+        documents = list(documents) if documents is not None else [""] * len(ids)
+        codes, scales = _quantize(vectors, self.precision, self._code_dimensions(vectors.shape[1])) \
+            if self.quantized else (None, None)
+        
+        with self._lock:
+            self._reserve(vectors.shape[1], self._size + len(ids))
+            for i, (chunk_id, metadata, document) in enumerate(zip(ids, metadatas, documents)):
+                row = self._rows.get(chunk_id)
+                if row is None:
+                    row = self._size
+                    self._size += 1
+                    self._rows[chunk_id] = row
+                    self._ids.append(chunk_id)
+                    self._documents.append(document)
+                    self._metadatas.append(dict(metadata or {}))
+                else:
+                    self._documents[row] = document
+                    self._metadatas[row] = dict(metadata or {})
+                self._vectors[row] = vectors[i]
+                if codes is not None:
+                    self._codes[row] = codes[i]
+                if scales is not None:
+                    self._scales[row] = scales[i]
+            self._dirty = True
+    
+    def add_texts(self, texts, metadatas=None, *, ids=None, **kwargs):
+        """
+        Embed texts and add them to the store
+        
+        Args:
+            texts: Iterable of chunk texts
+            metadatas: Optional metadata dict per text
+            ids: Optional chunk IDs; random ones are generated otherwise
+            
+        Returns:
+            List of chunk IDs
+        """
+        texts = list(texts)
+        ids = list(ids) if ids is not None else [str(uuid.uuid4()) for _ in texts]
+        if texts:
+            self.upsert(ids, self.embedding_function.embed_documents(texts), metadatas, texts)
+        return ids
+    
+    def delete(self, ids=None, **kwargs):
+        """
+        Delete chunks by ID; unknown IDs are ignored
+        
+        The last row is moved into each freed slot, so the matrices stay
+        contiguous without a full copy.
+        """
+        with self._lock:
+            rows = [self._rows[chunk_id] for chunk_id in ids or () if chunk_id in self._rows]
+            if not rows:
+                return
+            self._reserve(self._vectors.shape[1], self._size)
+            matrices = [array for array in (self._vectors, self._codes, self._scales) if array is not None]
+            # Free the highest rows first so a moved row is never a deleted one
+            for row in sorted(rows, reverse=True):
+                last = self._size - 1
+                del self._rows[self._ids[row]]
+                if row != last:
+                    for array in matrices:
+                        array[row] = array[last]
+                    self._ids[row] = self._ids[last]
+                    self._documents[row] = self._documents[last]
+                    self._metadatas[row] = self._metadatas[last]
+                    self._rows[self._ids[row]] = row
+                self._ids.pop()
+                self._documents.pop()
+                self._metadatas.pop()
+                self._size -= 1
+            self._dirty = True
+    
+    def delete_collection(self):
+        """Drop every chunk and remove the persisted files"""
+        with self._lock:
+            self._vectors = None
+            self._codes = None
+            self._scales = None
+            self._size = 0
+            self._ids = []
+            self._documents = []
+            self._metadatas = []
+            self._rows = {}
+            self._dirty = False
+            if self.path:
+                shutil.rmtree(self.path, ignore_errors=True)
+    
+    def get(self, ids=None, where=None, include=("metadatas", "documents"), **kwargs):
+        """
+        Look up stored chunks, in the shape Chroma's get() returns
+        
+        Args:
+            ids: Optional chunk IDs to fetch
+            where: Optional metadata filter ({"key": value} or
+                {"key": {"$in": [...]}} / {"key": {"$eq": value}})
+            include: Any of "documents", "metadatas", "embeddings"
+            
+        Returns:
+            Dict with 'ids' plus a list for each included field (None for
+            the others)
+        """
+        with self._lock:
+            if ids is not None:
+                rows = [self._rows[chunk_id] for chunk_id in ids if chunk_id in self._rows]
+            else:
+                rows = range(self._size)
+            if where:
+                rows = [row for row in rows if _matches(self._metadatas[row], where)]
+            rows = list(rows)
+            
+            result = {'ids': [self._ids[row] for row in rows],
+                      'documents': None, 'metadatas': None, 'embeddings': None}
+            if "documents" in include:
+                result['documents'] = [self._documents[row] for row in rows]
+            if "metadatas" in include:
+                result['metadatas'] = [dict(self._metadatas[row]) for row in rows]
+            if "embeddings" in include:
+                result['embeddings'] = np.array(self._vectors[rows]) if rows \
+                    else np.zeros((0, 0), dtype=np.float32)
+            return result
+    
+    def _scan(self, queries, exact):
+        """Similarity of every query to every stored row"""
+        if exact or not self.quantized:
+            return queries @ self._vectors[:self._size].T
+        
+        dimensions = self._codes.shape[1]
+        if dimensions < queries.shape[1]:
+            queries = _normalize(queries[:, :dimensions])
+        scores = np.empty((len(queries), self._size), dtype=np.float32)
+        for start in range(0, self._size, SCAN_BLOCK_ROWS):
+            end = min(start + SCAN_BLOCK_ROWS, self._size)
+            scores[:, start:end] = queries @ np.asarray(self._codes[start:end], dtype=np.float32).T
+        if self._scales is not None:
+            scores *= self._scales[:self._size]
+        return scores
+    
+    def search_matrix(self, queries, k, exact=False):
+        """
+        Top-k search for a batch of query vectors in one matrix product
+        
+        Args:
+            queries: Array-like of shape (n, dimensions), or one vector
+            k: Results per query
+            exact: Scan the full-precision vectors even if the store is
+                quantized
+                
+        Returns:
+            Tuple of (rows, similarities), each of shape (n, min(k, size)),
+            best first; rows index the store's current ordering and
+            similarities are full-precision cosines
+        """
+        queries = _normalize(queries)
+        with self._lock:
+            if not self._size:
+                empty = np.zeros((len(queries), 0))
+                return empty.astype(np.intp), empty.astype(np.float32)
+            
+            with metrics.span("vector_search", backend="numpy", precision=self.precision):
+                scores = self._scan(queries, exact)
+                if exact or not self.quantized:
+                    return _top_k(scores, k)
+                
+                # Rescore only the shortlisted rows against the full vectors
+                candidates, _ = _top_k(scores, k * self.rescore_factor)
+                full = np.asarray(self._vectors[candidates.ravel()]).reshape(
+                    candidates.shape + (self._vectors.shape[1],)
+                )
+                rescored = np.einsum('nd,ncd->nc', queries, full)
+                order, similarities = _top_k(rescored, k)
+                return np.take_along_axis(candidates, order, axis=1), similarities
+    
+    def recall(self, queries, k):
+        """
+        Share of the exact top-k the quantized search returns
+        
+        Args:
+            queries: Query vectors to measure with
+            k: Results per query
+            
+        Returns:
+            Mean recall@k in [0, 1]; 1.0 when the store is not quantized
+        """
+        queries = _normalize(queries)
+        with self._lock:
+            if not self._size or not len(queries):
+                return 1.0
+            exact, _ = self.search_matrix(queries, k, exact=True)
+            approximate, _ = self.search_matrix(queries, k)
+        hits = [len(set(a.tolist()) & set(e.tolist())) for a, e in zip(approximate, exact)]
+        return float(np.mean(hits)) / exact.shape[1]
+    
+    def stats(self):
+        """
+        Size of the stored matrices
+        
+        Returns:
+            Dict with 'rows', 'dimensions', 'precision', 'search_dimensions',
+            'search_bytes' (scanned per query) and 'full_bytes' (float32
+            vectors, read only for rescoring when quantized)
+        """
+        with self._lock:
+            dimensions = self._vectors.shape[1] if self._vectors is not None else 0
+            full_bytes = self._size * dimensions * 4
+            if not self.quantized or self._codes is None:
+                search_dimensions, search_bytes = dimensions, full_bytes
+            else:
+                search_dimensions = self._codes.shape[1]
+                search_bytes = self._size * search_dimensions * self._codes.itemsize
+                if self._scales is not None:
+                    search_bytes += self._size * 4
+            return {
+                'rows': self._size,
+                'dimensions': dimensions,
+                'precision': self.precision,
+                'search_dimensions': search_dimensions,
+                'search_bytes': search_bytes,
+                'full_bytes': full_bytes
+            }
+    
+    def _documents_for(self, rows, similarities):
+        """Pair Documents with Chroma-style squared L2 distances"""
+        with self._lock:
+            return [
+                (Document(page_content=self._documents[row], metadata=dict(self._metadatas[row]), id=self._ids[row]),
+                 # Squared L2 distance between unit vectors, as Chroma reports it
+                 float(2.0 - 2.0 * similarity))
+                for row, similarity in zip(rows.tolist(), similarities.tolist())
+            ]
+    
+    def similarity_search_by_vectors(self, embeddings, k=4):
+        """
+        Batched similarity_search_by_vector_with_relevance_scores
+        
+        Args:
+            embeddings: Query vectors
+            k: Results per query
+            
+        Returns:
+            One list of (Document, distance) tuples per query
+        """
+        rows, similarities = self.search_matrix(embeddings, k)
+        return [self._documents_for(row, sim) for row, sim in zip(rows, similarities)]
+    
+    def similarity_search_by_vector_with_relevance_scores(self, embedding, k=4, **kwargs):
+        """
+        Nearest chunks to a vector
+        
+        Returns:
+            List of (Document, distance) tuples, where distance is the
+            squared L2 distance between unit vectors (2 - 2 * cosine), as
+            with Chroma
+        """
+        return self.similarity_search_by_vectors([embedding], k)[0]
+    
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        """Nearest chunks to a vector"""
+        return [doc for doc, _ in self.similarity_search_by_vector_with_relevance_scores(embedding, k)]
+    
+    def similarity_search(self, query, k=4, **kwargs):
+        """Nearest chunks to a query text"""
+        return self.similarity_search_by_vector(self.embedding_function.embed_query(query), k)
+    
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, *, ids=None, path=None, **kwargs):
+        """Build a store from texts"""
+        store = cls(embedding, path=path, **kwargs)
+        store.add_texts(texts, metadatas, ids=ids)
+        store.persist()
+        return store
@@ -3,45 +3,181 @@ RAG System
 Implements Retrieval-Augmented Generation pipeline
 """
 
+import argparse
+import asyncio
+import hashlib
+import itertools
+import json
 import os
+import sys
+import threading
+import time
 import chromadb
+import numpy as np
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import Chroma
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
+from langchain_openai import ChatOpenAI
+from langchain_core.documents import Document
 from langchain_core.prompts import PromptTemplate
-from langchain_core.runnables import RunnablePassthrough
 from langchain_core.output_parsers import StrOutputParser
 
 from config import (
     OPENAI_API_KEY, 
-    EMBEDDING_MODEL, 
+    EMBEDDING_BACKEND, 
     LLM_MODEL, 
     CHUNK_SIZE, 
     CHUNK_OVERLAP,
+    STRUCTURED_CHUNK_TOKENS,
     TOP_K_RESULTS,
-    VECTOR_STORE_PATH
+    VECTOR_STORE_PATH,
+    VECTOR_STORE_BACKEND,
+    NUMPY_VECTOR_STORE_PATH,
+    VECTOR_PRECISION,
+    VECTOR_SEARCH_DIMENSIONS,
+    VECTOR_RESCORE_FACTOR,
+    DEFAULT_COLLECTION_NAME,
+    ANSWER_CACHE_MAX_ENTRIES,
+    ANSWER_CACHE_SIMILARITY_THRESHOLD,
+    RETRIEVAL_RELEVANCE_THRESHOLD,
+    HYBRID_CANDIDATES,
+    HYBRID_RRF_K,
+    KEYWORD_FAST_PATH_MARGIN,
+    RETRIEVAL_MODE,
+    RERANK_CANDIDATES,
+    RERANKER_MODEL,
+    RERANK_SEMANTIC_WEIGHT,
+    RERANK_DEDUP_OVERLAP,
+    CONTEXT_TOKEN_BUDGET,
+    PIPELINE_QUEUE_SIZE,
+    PIPELINE_EMBED_BATCH_SIZE,
+    PIPELINE_EMBED_WORKERS,
+    DOCS_FETCH_MAX_WORKERS,
+    BATCH_MAX_CONCURRENCY
 )
+from embedding_backends import create_embeddings
+from embedding_cache import CachedEmbeddings
+from numpy_vector_store import NumpyVectorStore
+from answer_cache import AnswerCache
+from document_structure import SectionChunker, render_segments
+from keyword_index import BM25Index, is_exact_term, tokenize
+from reranker import RerankStage, create_reranker
+from context_builder import ContextBuilder
+from metrics import metrics
+
+# Prefix the model emits when the context does not contain the answer and it
+# falls back to general knowledge within the same generation
+GENERAL_KNOWLEDGE_MARKER = "[GENERAL]"
 
 
 class RAGSystem:
     """RAG system for document retrieval and answer generation"""
     
-    def __init__(self):
-        """Initialize RAG system with vector store and LLM"""
-        if not OPENAI_API_KEY:
-            raise ValueError("OPENAI_API_KEY not found in environment variables")
+    def __init__(self, collection_name=DEFAULT_COLLECTION_NAME, shared_with=None,
+                 embeddings=None, llm=None, client=None, vector_store_backend=None,
+                 numpy_store_path=None, vector_precision=None, vector_search_dimensions=None):
+        """
+        Initialize RAG system with vector store and LLM
+        
+        Args:
+            collection_name: Chroma collection holding this knowledge base
+            shared_with: Optional RAGSystem whose embeddings, LLM, text
+                splitter and Chroma client are reused instead of creating new ones
+            embeddings: Optional LangChain Embeddings used instead of the
+                EMBEDDING_BACKEND configured in config.py (e.g. a fake)
+            llm: Optional LangChain chat model used instead of ChatOpenAI
+            client: Optional Chroma client used instead of the persistent
+                client at VECTOR_STORE_PATH
+            vector_store_backend: "chroma" or "numpy"; defaults to
+                VECTOR_STORE_BACKEND
+            numpy_store_path: Optional directory used instead of
+                NUMPY_VECTOR_STORE_PATH for the numpy backend's collections
+            vector_precision: Optional numpy search precision used instead
+                of VECTOR_PRECISION
+            vector_search_dimensions: Optional numpy search dimensions used
+                instead of VECTOR_SEARCH_DIMENSIONS
+        """
+        self.collection_name = collection_name
+        self.vector_store_backend = vector_store_backend or VECTOR_STORE_BACKEND
+        if self.vector_store_backend not in ("chroma", "numpy"):
+            raise ValueError(f"Unknown vector store backend {self.vector_store_backend!r}")
+        self.numpy_store_path = numpy_store_path or NUMPY_VECTOR_STORE_PATH
+        self.vector_precision = vector_precision or VECTOR_PRECISION
+        self.vector_search_dimensions = vector_search_dimensions or VECTOR_SEARCH_DIMENSIONS
+        self.vector_store = None
+        self.qa_chain = None
+        self.version = None
+        
+        # BM25 over the same chunks as the collection; per knowledge base,
+        # so never shared
+        self.keyword_index = BM25Index()
+        
+        # One instance can be shared by several Streamlit sessions, so
+        # knowledge base mutations are serialized
+        self._lock = threading.RLock()
+        
+        # Per-thread, so each Streamlit session sees its own last query
+        self._query_local = threading.local()
+        
+        if shared_with is not None:
+            self.embeddings = shared_with.embeddings
+            self.llm = shared_with.llm
+            self.text_splitter = shared_with.text_splitter
+            self.section_chunker = shared_with.section_chunker
+            self.client = shared_with.client
+            self.answer_cache = shared_with.answer_cache
+            self.rerank_stage = shared_with.rerank_stage
+            self.context_builder = shared_with.context_builder
+            return
+        
+        self.embeddings = embeddings
+        self.llm = llm
+        if embeddings is None or llm is None:
+            self._init_models()
+        
+        self.text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=CHUNK_SIZE,
+            chunk_overlap=CHUNK_OVERLAP,
+            length_function=len
+        )
+        
+        # Used instead of the character splitter when a document comes with
+        # structural segments (see document_structure.py)
+        self.section_chunker = SectionChunker(max_tokens=STRUCTURED_CHUNK_TOKENS)
+        
+        # A single client serves every collection in the persist directory
+        self.client = client or chromadb.PersistentClient(path=VECTOR_STORE_PATH)
+        
+        # Keyed by knowledge-base version, which is derived from document IDs
+        # and content hashes, so users with the same documents share answers
+        self.answer_cache = AnswerCache(
+            max_entries=ANSWER_CACHE_MAX_ENTRIES,
+            similarity_threshold=ANSWER_CACHE_SIMILARITY_THRESHOLD
+        )
+        
+        # Runs on CPU without network access; used when RETRIEVAL_MODE is "rerank"
+        self.rerank_stage = RerankStage(
+            create_reranker(RERANKER_MODEL, semantic_weight=RERANK_SEMANTIC_WEIGHT),
+            token_budget=CONTEXT_TOKEN_BUDGET,
+            dedup_overlap=RERANK_DEDUP_OVERLAP
+        )
         
+        # Merges adjacent chunks and keeps the prompt within CONTEXT_TOKEN_BUDGET
+        self.context_builder = ContextBuilder(token_budget=CONTEXT_TOKEN_BUDGET)
+    
+    def _init_models(self):
+        """Create the embeddings backend and/or LLM that were not injected"""
         try:
-            self.embeddings = OpenAIEmbeddings(
-                model=EMBEDDING_MODEL,
-                openai_api_key=OPENAI_API_KEY
-            )
+            if self.embeddings is None:
+                self.embeddings = create_embeddings(EMBEDDING_BACKEND)
             
-            self.llm = ChatOpenAI(
-                model=LLM_MODEL,
-                temperature=0.7,
-                openai_api_key=OPENAI_API_KEY
-            )
+            if self.llm is None:
+                if not OPENAI_API_KEY:
+                    raise ValueError("OPENAI_API_KEY not found in environment variables")
+                self.llm = ChatOpenAI(
+                    model=LLM_MODEL,
+                    temperature=0.7,
+                    openai_api_key=OPENAI_API_KEY
+                )
         except Exception as e:
             error_msg = str(e)
             if "quota" in error_msg.lower() or "429" in error_msg or "insufficient_quota" in error_msg.lower():
@@ -50,73 +186,476 @@ class RAGSystem:
                     "https://platform.openai.com/account/billing"
                 ) from e
             raise
+    
+    @staticmethod
+    def content_hash(content):
+        """
+        Stable hash of a document's text, used to detect edits between builds
         
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=CHUNK_SIZE,
-            chunk_overlap=CHUNK_OVERLAP,
-            length_function=len
-        )
+        Args:
+            content: Document text
+            
+        Returns:
+            Hex digest string
+        """
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+    
+    def _iter_document_chunks(self, doc):
+        """
+        Split one document into chunks with metadata and stable chunk IDs
         
-        self.vector_store = None
-        self.retriever = None
-        self.qa_chain = None
+        Args:
+            doc: Dict with 'id', 'name', and 'content' keys, an optional
+                'modified_time' version and optional 'segments' from
+                document_structure.extract_segments
+            
+        Yields:
+            Tuples of (text, metadata, chunk_id)
+        """
+        doc_id = doc['id']
+        content_hash = self.content_hash(doc['content'])
+        
+        with metrics.span("split"):
+            if doc.get('segments'):
+                # Pack whole sections/paragraphs/table rows by token count
+                chunks = list(self.section_chunker.chunk(doc['segments']))
+            else:
+                # Split document into chunks using create_documents
+                chunks = [
+                    {'text': chunk.page_content}
+                    for chunk in self.text_splitter.create_documents([doc['content']])
+                ]
+        
+        for i, chunk in enumerate(chunks):
+            metadata = {
+                'document_id': doc_id,
+                'document_name': doc['name'],
+                'chunk_index': i,
+                'content_hash': content_hash,
+                'document_version': doc.get('modified_time', '')
+            }
+            for key in ('section', 'start_index', 'end_index'):
+                if key in chunk:
+                    metadata[key] = chunk[key]
+            yield chunk['text'], metadata, f"{doc_id}:{content_hash[:16]}:{i}"
     
-    def create_knowledge_base(self, documents_data):
+    def _split_document(self, doc):
         """
-        Create vector store from selected documents
+        Split one document into chunk texts, metadata and stable chunk IDs
         
         Args:
-            documents_data: List of dicts with 'id', 'name', and 'content' keys
+            doc: Dict with 'id', 'name', and 'content' keys and an optional
+                'modified_time' version
+            
+        Returns:
+            Tuple of (texts, metadatas, ids)
         """
-        # Combine all document texts
-        all_texts = []
+        texts = []
         metadatas = []
+        ids = []
+        for text, metadata, chunk_id in self._iter_document_chunks(doc):
+            texts.append(text)
+            metadatas.append(metadata)
+            ids.append(chunk_id)
+        return texts, metadatas, ids
+    
+    def _index_chunks(self, chunks):
+        """
+        Embed and store chunks in fixed-size batches as they are produced
+        
+        Only one batch is held in memory at a time, and every batch is
+        searchable as soon as it is written.
         
-        for doc in documents_data:
-            doc_id = doc['id']
-            doc_name = doc['name']
-            content = doc['content']
+        Args:
+            chunks: Iterable of (text, metadata, chunk_id) tuples
             
-            if not content.strip():
-                continue
+        Returns:
+            Number of chunks indexed
+        """
+        count = 0
+        while True:
+            batch = list(itertools.islice(chunks, PIPELINE_EMBED_BATCH_SIZE))
+            if not batch:
+                return count
+            texts, metadatas, ids = zip(*batch)
+            with metrics.span("index_batch"):
+                self.vector_store.add_texts(
+                    texts=list(texts),
+                    metadatas=list(metadatas),
+                    ids=list(ids)
+                )
+                self.keyword_index.add(ids, texts, metadatas)
+            metrics.increment("chunks_indexed", len(batch))
+            count += len(batch)
+    
+    def create_knowledge_base(self, documents_data, incremental=False):
+        """
+        Create vector store from selected documents
+        
+        Args:
+            documents_data: Iterable (e.g. a generator) of dicts with 'id',
+                'name', and 'content' keys and an optional 'modified_time'
+                version; documents are consumed one at a time
+            incremental: If True, update the persisted vector store in place
+                (see sync_knowledge_base) instead of rebuilding it from scratch
+        """
+        with self._lock, metrics.span("build_knowledge_base", incremental=incremental):
+            if incremental:
+                self.sync_knowledge_base(documents_data)
+                self._build_chain()
+            else:
+                self._rebuild_knowledge_base(documents_data)
+    
+    def _rebuild_knowledge_base(self, documents_data):
+        """Embed every selected document into a fresh vector store"""
+        chunks = (
+            chunk
+            for doc in documents_data if doc['content'] and doc['content'].strip()
+            for chunk in self._iter_document_chunks(doc)
+        )
+        
+        # Make sure there is something to index before dropping the old store
+        first_chunk = next(chunks, None)
+        if first_chunk is None:
+            raise ValueError("No text content found in selected documents")
+        
+        # Clear only this knowledge base's collection; other collections in
+        # the same persist directory belong to other users or selections
+        self._open_vector_store()
+        self.vector_store.delete_collection()
+        self.vector_store = None
+        
+        # Create new vector store and stream chunks into it
+        self._open_vector_store()
+        self._index_chunks(itertools.chain([first_chunk], chunks))
+        
+        self._build_chain()
+    
+    def _open_vector_store(self):
+        """
+        Open the persisted vector store if it is not open yet
+        
+        The keyword index is rebuilt from the stored chunk texts, so it is
+        always in step with the collection without a file of its own.
+        """
+        if self.vector_store is None:
+            if self.vector_store_backend == "numpy":
+                self.vector_store = NumpyVectorStore(
+                    self.embeddings,
+                    path=os.path.join(self.numpy_store_path, self.collection_name),
+                    precision=self.vector_precision,
+                    search_dimensions=self.vector_search_dimensions,
+                    rescore_factor=VECTOR_RESCORE_FACTOR
+                )
+            else:
+                self.vector_store = Chroma(
+                    client=self.client,
+                    collection_name=self.collection_name,
+                    embedding_function=self.embeddings
+                )
+            stored = self.vector_store.get(include=["documents", "metadatas"])
+            self.keyword_index.clear()
+            self.keyword_index.add(stored['ids'], stored['documents'], stored['metadatas'])
+    
+    def load_knowledge_base(self):
+        """
+        Reopen the knowledge base persisted by an earlier process
+        
+        Returns:
+            True if a non-empty knowledge base was loaded
+            
+        Raises:
+            ValueError: If the chunks predate content hashes (the legacy
+                single collection), so the store cannot be versioned
+        """
+        with self._lock:
+            self._open_vector_store()
+            stored = self._stored_documents()
+            if not stored:
+                return False
+            if any(None in entry['hashes'] for entry in stored.values()):
+                raise ValueError(
+                    f"Collection {self.collection_name!r} was built by an older version "
+                    "without content hashes; rebuild it from the app"
+                )
+            self._build_chain()
+            return True
+    
+    def has_knowledge_base(self, document_versions):
+        """
+        Check whether the current knowledge base already covers a selection
+        
+        Args:
+            document_versions: Dict mapping selected document ID to its
+                version (modifiedTime)
+            
+        Returns:
+            True if exactly these documents, at these versions, are indexed
+        """
+        if not self.qa_chain or not document_versions or not all(document_versions.values()):
+            return False
+        
+        with self._lock:
+            stored = self._stored_documents()
+        return stored.keys() == document_versions.keys() and all(
+            entry['versions'] == {document_versions[doc_id]}
+            for doc_id, entry in stored.items()
+        )
+    
+    def _stored_documents(self, document_ids=None):
+        """
+        Index the chunks already in the vector store by document
+        
+        Args:
+            document_ids: Optional iterable restricting the lookup to these documents
             
-            # Split document into chunks using create_documents
-            chunks = self.text_splitter.create_documents([content])
+        Returns:
+            Dict mapping document_id -> {'hashes': set, 'versions': set,
+            'ids': list of chunk IDs}
+        """
+        get_kwargs = {"include": ["metadatas"]}
+        if document_ids is not None:
+            get_kwargs["where"] = {"document_id": {"$in": list(document_ids)}}
+        
+        existing = {}
+        stored = self.vector_store.get(**get_kwargs)
+        for chunk_id, metadata in zip(stored['ids'], stored['metadatas']):
+            metadata = metadata or {}
+            doc_id = metadata.get('document_id')
+            entry = existing.setdefault(doc_id, {'hashes': set(), 'versions': set(), 'ids': []})
+            entry['hashes'].add(metadata.get('content_hash'))
+            entry['versions'].add(metadata.get('document_version', ''))
+            entry['ids'].append(chunk_id)
+        return existing
+    
+    def _is_unchanged(self, doc, entry):
+        """
+        Check whether a stored document already matches the given content
+        
+        A new version with identical text counts as changed so the version
+        gets recorded; its vectors come straight from the embedding cache.
+        
+        Args:
+            doc: Dict with 'id', 'name', 'content' and optional 'modified_time'
+            entry: The document's _stored_documents() entry, or None
+        """
+        return bool(entry) and entry['hashes'] == {self.content_hash(doc['content'])} \
+            and entry['versions'] == {doc.get('modified_time', '')}
+    
+    def _apply_document_changes(self, documents_data, existing, stats):
+        """
+        Embed new or edited documents and delete the chunks they replace
+        
+        A document's old chunks are deleted only once all of its new chunks
+        are written, so it stays searchable while it is re-embedded. If
+        indexing fails, documents that were only partly written are rolled
+        back to their old chunks and the version is refreshed before the
+        error propagates.
+        
+        Args:
+            documents_data: Iterable of dicts with 'id', 'name', and 'content' keys
+            existing: Result of _stored_documents() covering these documents
+            stats: Stats dict updated in place
+        """
+        # (old chunk IDs, new chunk IDs) per changed document; the IDs carry
+        # the content hash, so they only coincide when the text is unchanged
+        replacements = []
+        
+        def changed_chunks():
+            for doc in documents_data:
+                entry = existing.get(doc['id'])
+                
+                if self._is_unchanged(doc, entry):
+                    stats['unchanged'] += 1
+                    continue
+                
+                if entry:
+                    stats['updated'] += 1
+                else:
+                    stats['added'] += 1
+                
+                new_ids = []
+                replacements.append((entry['ids'] if entry else [], new_ids))
+                for chunk in self._iter_document_chunks(doc):
+                    new_ids.append(chunk[2])
+                    yield chunk
+        
+        try:
+            stats['chunks_embedded'] += self._index_chunks(changed_chunks())
+        except Exception:
+            self._settle_replacements(replacements, failed=True)
+            raise
+        self._settle_replacements(replacements)
+    
+    def _settle_replacements(self, replacements, failed=False):
+        """
+        Delete the chunks that re-embedded documents no longer need
+        
+        Args:
+            replacements: List of (old chunk IDs, new chunk IDs) per document
+            failed: True if indexing stopped part-way; documents whose new
+                chunks were not all written then lose those instead of
+                their old ones, and the version is refreshed
+        """
+        def delete_unless_kept(ids, keep_ids):
+            keep_ids = set(keep_ids)
+            stale_ids = [chunk_id for chunk_id in ids if chunk_id not in keep_ids]
+            if stale_ids:
+                self._delete_chunks(stale_ids)
+        
+        with self._lock:
+            for old_ids, new_ids in replacements:
+                if not failed:
+                    delete_unless_kept(old_ids, new_ids)
+                    continue
+                written = set(self.vector_store.get(ids=new_ids, include=[])['ids']) if new_ids else set()
+                if new_ids and written == set(new_ids):
+                    delete_unless_kept(old_ids, new_ids)
+                else:
+                    delete_unless_kept(written, old_ids)
+            if failed:
+                self._refresh_version()
+    
+    def sync_knowledge_base(self, documents_data):
+        """
+        Incrementally sync the persisted vector store with the selected documents
+        
+        Chunks are keyed by document ID plus a hash of the document content.
+        New or edited documents are (re-)embedded, documents that are no longer
+        selected are deleted, and unchanged documents are left alone, so
+        editing one document out of fifty costs one document's embeddings.
+        
+        Args:
+            documents_data: Iterable of dicts with 'id', 'name', and 'content'
+                keys; documents are consumed one at a time. A 'content' of
+                None marks a document that could not be fetched
             
-            for i, chunk in enumerate(chunks):
-                all_texts.append(chunk.page_content)
-                metadatas.append({
-                    'document_id': doc_id,
-                    'document_name': doc_name,
-                    'chunk_index': i
-                })
+        Returns:
+            Dict with counts of 'added', 'updated', 'removed', 'unchanged'
+            and 'failed' (could not be fetched; their chunks are kept)
+            documents and the number of 'chunks_embedded'
+        """
+        with self._lock:
+            return self._sync_knowledge_base(documents_data)
+    
+    def _sync_knowledge_base(self, documents_data):
+        """Sync implementation; caller holds the lock"""
+        self._open_vector_store()
         
-        if not all_texts:
+        existing = self._stored_documents()
+        stats = {'added': 0, 'updated': 0, 'removed': 0, 'unchanged': 0, 'failed': 0,
+                 'chunks_embedded': 0}
+        selected_ids = set()
+        failed_ids = set()
+        
+        def non_empty_documents():
+            for doc in documents_data:
+                if doc['content'] is None:
+                    # Could not be fetched; whatever is indexed for it stays
+                    failed_ids.add(doc['id'])
+                elif doc['content'].strip():
+                    selected_ids.add(doc['id'])
+                    yield doc
+        
+        self._apply_document_changes(non_empty_documents(), existing, stats)
+        stats['failed'] = len(failed_ids)
+        if not selected_ids and not failed_ids & existing.keys():
+            if failed_ids:
+                raise ValueError(f"Could not fetch the {len(failed_ids)} selected document(s)")
             raise ValueError("No text content found in selected documents")
         
-        # Create or get vector store
-        if os.path.exists(VECTOR_STORE_PATH):
-            # Clear existing store
-            import shutil
-            shutil.rmtree(VECTOR_STORE_PATH)
-        
-        # Create new vector store
-        self.vector_store = Chroma.from_texts(
-            texts=all_texts,
-            metadatas=metadatas,
-            embedding=self.embeddings,
-            persist_directory=VECTOR_STORE_PATH
+        # Drop documents that were deselected (or emptied)
+        stats['removed'] = self.delete_documents(
+            [doc_id for doc_id in existing if doc_id not in selected_ids | failed_ids]
         )
+        return stats
+    
+    def upsert_documents(self, documents_data):
+        """
+        Add or re-embed individual documents without touching the rest
+        
+        Documents whose content hash is unchanged are skipped. Empty
+        documents are removed from the store; documents whose content is
+        None (the fetch failed) are left as they are.
+        
+        Args:
+            documents_data: List of dicts with 'id', 'name', and 'content' keys
+            
+        Returns:
+            Dict with counts of 'added', 'updated', 'removed', 'unchanged'
+            and 'failed' documents and the number of 'chunks_embedded'
+        """
+        with self._lock:
+            self._open_vector_store()
+            
+            stats = {'added': 0, 'updated': 0, 'removed': 0, 'unchanged': 0, 'failed': 0,
+                     'chunks_embedded': 0}
+            fetched = [doc for doc in documents_data if doc['content'] is not None]
+            stats['failed'] = len(documents_data) - len(fetched)
+            non_empty = [doc for doc in fetched if doc['content'].strip()]
+            stats['removed'] = self.delete_documents(
+                [doc['id'] for doc in fetched if not doc['content'].strip()]
+            )
+            
+            if non_empty:
+                existing = self._stored_documents([doc['id'] for doc in non_empty])
+                self._apply_document_changes(non_empty, existing, stats)
+            self._refresh_version()
+            return stats
+    
+    def delete_documents(self, document_ids):
+        """
+        Remove every chunk of the given documents from the vector store
+        
+        Args:
+            document_ids: Iterable of Google Doc IDs
+            
+        Returns:
+            Number of documents that had chunks removed
+        """
+        document_ids = list(document_ids)
+        if not document_ids:
+            return 0
+        
+        with self._lock:
+            self._open_vector_store()
+            existing = self._stored_documents(document_ids)
+            stale_ids = [chunk_id for entry in existing.values() for chunk_id in entry['ids']]
+            if stale_ids:
+                self._delete_chunks(stale_ids)
+            self._refresh_version()
+            return len(existing)
+    
+    def _refresh_version(self):
+        """
+        Recompute the knowledge-base version from the stored documents
+        
+        The version changes whenever any document is added, removed or
+        edited, which invalidates cached answers. Every knowledge-base
+        change ends here, so the numpy store writes its files here too;
+        Chroma persists each write as it happens.
+        """
+        if self.vector_store_backend == "numpy":
+            self.vector_store.persist()
         
-        # Create retriever
-        self.retriever = self.vector_store.as_retriever(
-            search_kwargs={"k": TOP_K_RESULTS}
+        stored = self._stored_documents()
+        key = "\n".join(
+            f"{doc_id}:{','.join(sorted(entry['hashes']))}"
+            for doc_id, entry in sorted(stored.items())
         )
+        self.version = hashlib.sha256(key.encode('utf-8')).hexdigest()
+    
+    def _build_chain(self):
+        """Create the QA chain over the current vector store"""
+        self._refresh_version()
         
-        # Create QA chain with LangChain 1.0+ API
+        # Create QA chain with LangChain 1.0+ API. Grounded-or-fallback is
+        # decided in this one generation: the model flags answers that are
+        # not in the context instead of us asking it a second time.
         prompt_template = """Use the following pieces of context to answer the question at the end.
-        If you don't know the answer, just say that you don't know from the provided context.
         Use only the information from the context provided.
+        If the context does not contain the answer, start your reply with """ + GENERAL_KNOWLEDGE_MARKER + """
+        and then answer the question from your general knowledge.
         
         Context: {context}
         
@@ -129,27 +668,340 @@ class RAGSystem:
             input_variables=["context", "question"]
         )
         
-        # Create the chain using the new LangChain 1.0+ pattern
-        def format_docs(docs):
-            return "\n\n".join(doc.page_content for doc in docs)
-        
-        # Store formatted docs function for later use
-        self.format_docs = format_docs
-        
+        # The chain takes already-retrieved context so that query() can
+        # retrieve once and reuse the same documents for the prompt and
+        # the returned sources
         self.qa_chain = (
-            {
-                "context": self.retriever | format_docs,
-                "question": RunnablePassthrough()
-            }
-            | prompt
+            prompt
+            | self.llm
+            | StrOutputParser()
+        )
+        
+        # Used directly when retrieval finds nothing relevant
+        self.general_chain = (
+            PromptTemplate(template="{question}", input_variables=["question"])
             | self.llm
             | StrOutputParser()
         )
     
+    @staticmethod
+    def _chunk_id(metadata):
+        """Rebuild a chunk's ID from its metadata (see _iter_document_chunks)"""
+        return f"{metadata['document_id']}:{metadata['content_hash'][:16]}:{metadata['chunk_index']}"
+    
+    def _keyword_document(self, chunk_id):
+        """
+        Build a Document for a chunk from the keyword index
+        
+        Returns:
+            The Document, or None if the chunk has been removed since it was
+            found; queries do not hold the lock a background sync writes under
+        """
+        chunk = self.keyword_index.get(chunk_id)
+        if chunk is None:
+            return None
+        text, metadata = chunk
+        return Document(page_content=text, metadata=dict(metadata))
+    
+    def _similarities(self, chunk_ids, embedding):
+        """
+        Cosine similarity between a question embedding and stored chunks
+        
+        Returns:
+            Dict mapping chunk ID to similarity
+        """
+        stored = self.vector_store.get(ids=list(chunk_ids), include=["embeddings"])
+        if not len(stored['ids']):
+            return {chunk_id: 0.0 for chunk_id in chunk_ids}
+        
+        matrix = np.asarray(stored['embeddings'], dtype=np.float32)
+        matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        query = np.asarray(embedding, dtype=np.float32)
+        query /= max(float(np.linalg.norm(query)), 1e-12)
+        similarities = dict(zip(stored['ids'], (matrix @ query).tolist()))
+        return {chunk_id: similarities.get(chunk_id, 0.0) for chunk_id in chunk_ids}
+    
+    def retrieve_with_scores(self, question, embedding=None, k=TOP_K_RESULTS):
+        """
+        Retrieve the most relevant chunks for a question with relevance scores
+        
+        Vector and BM25 rankings are fused with reciprocal rank fusion, so
+        exact terms such as IDs and error codes are found even when their
+        embedding neighbours are not.
+        
+        Args:
+            question: User's question
+            embedding: Optional precomputed question embedding
+            k: Number of chunks to return
+            
+        Returns:
+            List of (Document, relevance) tuples, where relevance is the
+            cosine similarity between the question and the chunk
+        """
+        if embedding is None:
+            with metrics.span("embed_query"):
+                embedding = self.embeddings.embed_query(question)
+        
+        with metrics.span("retrieve"):
+            return self._hybrid_search(question, embedding, k)
+    
+    def _hybrid_search(self, question, embedding, k, vector_results=None):
+        """
+        Fuse vector and BM25 rankings; see retrieve_with_scores
+        
+        vector_results, when given, are the question's precomputed
+        (Document, distance) vector hits (see retrieve_context_batch).
+        """
+        candidates = max(HYBRID_CANDIDATES, k)
+        if vector_results is None:
+            vector_results = self.vector_store.similarity_search_by_vector_with_relevance_scores(
+                embedding, k=candidates
+            )
+        keyword_results = self.keyword_index.search(question, candidates)
+        
+        documents = {}
+        relevance = {}
+        fused = {}
+        for rank, (doc, distance) in enumerate(vector_results):
+            chunk_id = self._chunk_id(doc.metadata)
+            documents[chunk_id] = doc
+            # Chroma returns squared L2 distances; for unit-length embeddings
+            # cosine similarity is 1 - d / 2
+            relevance[chunk_id] = 1.0 - distance / 2.0
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (HYBRID_RRF_K + rank + 1)
+        for rank, (chunk_id, _) in enumerate(keyword_results):
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (HYBRID_RRF_K + rank + 1)
+        
+        top_ids = sorted(fused, key=fused.get, reverse=True)[:k]
+        
+        # Keyword-only hits have no distance yet; score them against the
+        # stored vectors so the relevance threshold means the same thing
+        keyword_only = [chunk_id for chunk_id in top_ids if chunk_id not in relevance]
+        if keyword_only:
+            relevance.update(self._similarities(keyword_only, embedding))
+        
+        for chunk_id in keyword_only:
+            documents[chunk_id] = self._keyword_document(chunk_id)
+        return [
+            (documents[chunk_id], relevance[chunk_id])
+            for chunk_id in top_ids if documents[chunk_id] is not None
+        ]
+    
+    def keyword_fast_path(self, question):
+        """
+        Answer retrieval from the keyword index alone when the match is clear
+        
+        Applies only to questions with an ID/code-like term (digits, dashes,
+        dots or underscores). The best BM25 hit must contain every such term
+        and outscore the runner-up by KEYWORD_FAST_PATH_MARGIN; the question
+        is then never embedded.
+        
+        Args:
+            question: User's question
+            
+        Returns:
+            List of (Document, relevance) tuples, or None when vector search
+            is needed
+        """
+        exact_terms = [term for term in set(tokenize(question)) if is_exact_term(term)]
+        if not exact_terms:
+            return None
+        
+        with metrics.span("keyword_fast_path"):
+            results = self.keyword_index.search(question, 2)
+        if not results:
+            return None
+        
+        best_id, best_score = results[0]
+        runner_up = results[1][1] if len(results) > 1 else 0.0
+        if best_score < KEYWORD_FAST_PATH_MARGIN * runner_up \
+                or not self.keyword_index.contains_terms(best_id, exact_terms):
+            return None
+        
+        document = self._keyword_document(best_id)
+        if document is None:
+            return None
+        
+        # Every exact term matched, so the chunk counts as relevant
+        metrics.increment("keyword_fast_path_hits")
+        return [(document, 1.0)]
+    
+    def retrieve_context(self, question, embedding=None):
+        """
+        Retrieve the chunks that go into the prompt, per RETRIEVAL_MODE
+        
+        In "rerank" mode a wider candidate set is reranked on CPU,
+        deduplicated and packed into CONTEXT_TOKEN_BUDGET; otherwise the
+        top TOP_K_RESULTS hybrid hits are used as they are.
+        
+        Args:
+            question: User's question
+            embedding: Optional precomputed question embedding
+            
+        Returns:
+            List of (Document, relevance) tuples
+        """
+        if RETRIEVAL_MODE == "rerank":
+            candidates = self.retrieve_with_scores(question, embedding, k=RERANK_CANDIDATES)
+            with metrics.span("rerank"):
+                return self.rerank_stage.select(question, candidates)
+        return self.retrieve_with_scores(question, embedding)
+    
+    def _vector_search_batch(self, embeddings, k):
+        """
+        Vector search for many questions in one call to the store
+        
+        Returns:
+            One list of (Document, distance) tuples per embedding, with
+            squared L2 distances as Chroma reports them
+        """
+        if self.vector_store_backend == "numpy":
+            return self.vector_store.similarity_search_by_vectors(embeddings, k)
+        
+        # The Chroma wrapper queries one vector at a time; its collection
+        # takes a batch
+        results = self.vector_store._collection.query(
+            query_embeddings=[list(embedding) for embedding in embeddings],
+            n_results=k,
+            include=["documents", "metadatas", "distances"]
+        )
+        return [
+            [
+                (Document(page_content=text, metadata=metadata or {}), distance)
+                for text, metadata, distance in zip(texts, metadatas, distances)
+            ]
+            for texts, metadatas, distances in zip(
+                results['documents'], results['metadatas'], results['distances']
+            )
+        ]
+    
+    def retrieve_context_batch(self, questions, embeddings):
+        """
+        retrieve_context for many questions, with one vector search for all
+        
+        Args:
+            questions: List of questions
+            embeddings: Their embeddings, in the same order
+            
+        Returns:
+            One list of (Document, relevance) tuples per question
+        """
+        k = RERANK_CANDIDATES if RETRIEVAL_MODE == "rerank" else TOP_K_RESULTS
+        with metrics.span("retrieve_batch"):
+            vector_results = self._vector_search_batch(embeddings, max(HYBRID_CANDIDATES, k))
+        
+        scored = []
+        for question, embedding, hits in zip(questions, embeddings, vector_results):
+            with metrics.span("retrieve"):
+                candidates = self._hybrid_search(question, embedding, k, hits)
+            if RETRIEVAL_MODE == "rerank":
+                with metrics.span("rerank"):
+                    candidates = self.rerank_stage.select(question, candidates)
+            scored.append(candidates)
+        return scored
+    
+    def retrieve(self, question, embedding=None):
+        """
+        Retrieve the most relevant chunks for a question
+        
+        Args:
+            question: User's question
+            embedding: Optional precomputed question embedding
+            
+        Returns:
+            List of LangChain Document objects
+        """
+        return [doc for doc, _ in self.retrieve_context(question, embedding)]
+    
+    def _plan_generation(self, question, scored_docs):
+        """
+        Pick the chain that will answer the question from scored documents
+        
+        When no chunk clears RETRIEVAL_RELEVANCE_THRESHOLD the question goes
+        straight to the general-knowledge chain, without context tokens.
+        Otherwise the context is built by the ContextBuilder and its stats are
+        available from last_context_stats.
+        
+        Returns:
+            Tuple of (source_documents, relevant, chain, chain_inputs)
+        """
+        source_docs = [doc for doc, _ in scored_docs]
+        relevant = any(score >= RETRIEVAL_RELEVANCE_THRESHOLD for _, score in scored_docs)
+        
+        if relevant:
+            with metrics.span("build_context"):
+                context, self._query_local.context_stats = self.context_builder.build(source_docs)
+            metrics.increment("prompt_context_tokens", self._query_local.context_stats['tokens'])
+            metrics.increment("prompt_context_tokens_saved", self._query_local.context_stats['tokens_saved'])
+            return source_docs, True, self.qa_chain, {
+                "context": context,
+                "question": question
+            }
+        self._query_local.context_stats = None
+        return source_docs, False, self.general_chain, {"question": question}
+    
+    @property
+    def last_context_stats(self):
+        """
+        Context packing stats of the calling thread's last generated answer
+        
+        Returns:
+            Dict from ContextBuilder.build() with 'tokens' and
+            'tokens_saved', or None if the last answer used no context
+            or came from the answer cache
+        """
+        return getattr(self._query_local, 'context_stats', None)
+    
+    @staticmethod
+    def _split_marker(answer):
+        """
+        Separate the general-knowledge marker from an answer
+        
+        Returns:
+            Tuple of (answer without marker, marker_found)
+        """
+        stripped = answer.lstrip()
+        if stripped.startswith(GENERAL_KNOWLEDGE_MARKER):
+            return stripped[len(GENERAL_KNOWLEDGE_MARKER):].lstrip(), True
+        return answer, False
+    
+    def _lookup_or_retrieve(self, question):
+        """
+        Check the answer cache for this knowledge-base version, then retrieve
+        
+        Order: exact cache match, keyword fast path (no embedding), semantic
+        cache match, hybrid retrieval.
+        
+        Args:
+            question: User's question
+            
+        Returns:
+            Tuple of (cached entry or None, question embedding or None,
+            scored documents or None). Documents are returned on a miss.
+        """
+        entry = self.answer_cache.get_exact(self.version, question)
+        if entry is not None:
+            return entry, None, None
+        
+        scored_docs = self.keyword_fast_path(question)
+        if scored_docs is not None:
+            self.answer_cache.record_miss()
+            return None, None, scored_docs
+        
+        with metrics.span("embed_query"):
+            embedding = self.embeddings.embed_query(question)
+        entry = self.answer_cache.get_similar(self.version, embedding)
+        if entry is not None:
+            return entry, embedding, None
+        return None, embedding, self.retrieve_context(question, embedding)
+    
     def query(self, question):
         """
         Query the RAG system
         
+        Answers that are not found in the documents come back already
+        answered from general knowledge, in the same LLM call.
+        
         Args:
             question: User's question
             
@@ -159,50 +1011,533 @@ class RAGSystem:
         if not self.qa_chain:
             raise ValueError("Knowledge base not initialized. Please add documents first.")
         
-        # Get relevant documents - use vector store directly for compatibility
-        # In LangChain 1.0+, retrievers use invoke(), but we'll query vector store directly
-        try:
-            # Try to get documents from retriever using invoke (LangChain 1.0+)
-            source_docs = self.retriever.invoke(question)
-        except (AttributeError, TypeError, Exception):
-            # Fallback: query vector store directly (most reliable)
-            try:
-                source_docs = self.vector_store.similarity_search(question, k=TOP_K_RESULTS)
-            except Exception:
-                # Last resort: try old API
-                source_docs = getattr(self.retriever, 'get_relevant_documents', lambda x: [])(question)
-        
-        # Query the chain
-        answer = self.qa_chain.invoke(question)
-        
-        # Check if answer was found in documents
-        # If no source documents or answer indicates uncertainty, mark as not found
-        found_in_docs = len(source_docs) > 0 and not any(
-            phrase in answer.lower() for phrase in [
-                "i don't know",
-                "i do not know",
-                "not provided",
-                "cannot determine",
-                "not found"
-            ]
-        )
+        with metrics.span("query"):
+            self._query_local.context_stats = None
+            cached, embedding, scored_docs = self._lookup_or_retrieve(question)
+            if cached is not None:
+                return cached['answer'], cached['source_docs'], cached['found_in_docs']
+            
+            # Retrieve once; the same documents feed the prompt and the sources
+            source_docs, relevant, chain, inputs = self._plan_generation(question, scored_docs)
+            
+            metrics.increment("llm_calls", chain="grounded" if relevant else "general")
+            with metrics.span("generate"):
+                answer, marker_found = self._split_marker(chain.invoke(inputs))
+        found_in_docs = relevant and not marker_found
+        self.answer_cache.put(self.version, question, embedding, answer, source_docs, found_in_docs)
         
         return answer, source_docs, found_in_docs
     
-    def generate_fallback_answer(self, question):
+    def stream_query(self, question):
+        """
+        Query the RAG system, streaming the answer as it is generated
+        
+        Retrieval happens up front so the sources are available before the
+        first token arrives. Whether the answer is grounded is settled from
+        the retrieval scores and the first generated tokens.
+        
+        Args:
+            question: User's question
+            
+        Returns:
+            Tuple of (source_documents, found_in_docs, answer_stream) where
+            answer_stream is a generator of answer text chunks
+        """
+        if not self.qa_chain:
+            raise ValueError("Knowledge base not initialized. Please add documents first.")
+        
+        with metrics.span("prepare_query"):
+            self._query_local.context_stats = None
+            cached, embedding, scored_docs = self._lookup_or_retrieve(question)
+            if cached is not None:
+                return cached['source_docs'], cached['found_in_docs'], iter([cached['answer']])
+            
+            source_docs, relevant, chain, inputs = self._plan_generation(question, scored_docs)
+        
+        metrics.increment("llm_calls", chain="grounded" if relevant else "general")
+        started = time.perf_counter()
+        stream = chain.stream(inputs)
+        version = self.version
+        
+        # Read just far enough to see whether the model flagged a fallback
+        head = ""
+        found_in_docs = relevant
+        if relevant:
+            for chunk in stream:
+                head += chunk
+                stripped = head.lstrip()
+                if len(stripped) >= len(GENERAL_KNOWLEDGE_MARKER) or not GENERAL_KNOWLEDGE_MARKER.startswith(stripped):
+                    break
+            head, marker_found = self._split_marker(head)
+            found_in_docs = not marker_found
+        
+        def answer_stream():
+            chunks = [head]
+            if head:
+                yield head
+            for chunk in stream:
+                chunks.append(chunk)
+                yield chunk
+            # Observed rather than spanned: the generator is consumed
+            # interleaved with the caller's own work
+            metrics.observe("generate", time.perf_counter() - started)
+            
+            # Cache only answers that were streamed to completion
+            self.answer_cache.put(
+                version, question, embedding, "".join(chunks), source_docs, found_in_docs
+            )
+        
+        return source_docs, found_in_docs, answer_stream()
+    
+    async def acreate_knowledge_base(self, documents, docs_manager=None):
         """
-        Generate answer using general knowledge when not found in documents
+        Asynchronously build or incrementally sync the knowledge base
+        
+        Fetching, splitting and embedding run as a pipeline of stages joined
+        by bounded queues, so documents are embedded while others are still
+        downloading and several embedding requests are in flight at once.
+        Like sync_knowledge_base, unchanged documents are skipped,
+        deselected documents are deleted, and an edited document keeps its
+        old chunks until all of its new ones are written.
+        
+        Args:
+            documents: List of dicts with 'id' and 'name' keys, plus 'content'
+                (or 'modified_time' when docs_manager fetches the content)
+            docs_manager: Optional GoogleDocsManager used to fetch content
+                for documents that have no 'content' key
+            
+        Returns:
+            Dict with counts of 'added', 'updated', 'removed', 'unchanged'
+            and 'failed' (could not be fetched; their chunks are kept)
+            documents and the number of 'chunks_embedded'
+        """
+        def load_existing():
+            with self._lock:
+                self._open_vector_store()
+                return self._stored_documents()
+        
+        existing = await asyncio.to_thread(load_existing)
+        stats = {'added': 0, 'updated': 0, 'removed': 0, 'unchanged': 0, 'failed': 0,
+                 'chunks_embedded': 0}
+        
+        selected_ids = {doc['id'] for doc in documents}
+        deselected = [doc_id for doc_id in existing if doc_id not in selected_ids]
+        stats['removed'] = await asyncio.to_thread(self.delete_documents, deselected)
+        
+        doc_queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        batch_queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        # (old chunk IDs, new chunk IDs) per changed document, settled once
+        # every batch has been written
+        replacements = []
+        writes = []
+        
+        async def fetch_stage():
+            """Producer: push documents (with content) as they become available"""
+            to_fetch = {}
+            for doc in documents:
+                if 'content' in doc:
+                    await doc_queue.put(doc)
+                else:
+                    to_fetch[doc['id']] = doc
+            
+            if to_fetch:
+                versions = {doc_id: doc.get('modified_time') for doc_id, doc in to_fetch.items()}
+                async for doc_id, segments in docs_manager.aiter_documents_segments(
+                    list(to_fetch), versions=versions, max_concurrency=DOCS_FETCH_MAX_WORKERS
+                ):
+                    content = render_segments(segments) if segments is not None else None
+                    await doc_queue.put(dict(to_fetch[doc_id], content=content, segments=segments))
+            await doc_queue.put(None)
+        
+        async def split_stage():
+            """Skip unchanged documents and cut the rest into embedding batches"""
+            batch = ([], [], [])
+            while True:
+                doc = await doc_queue.get()
+                if doc is None:
+                    break
+                
+                entry = existing.get(doc['id'])
+                if doc['content'] is None:
+                    # Could not be fetched; keep its indexed chunks
+                    stats['failed'] += 1
+                    continue
+                if not doc['content'].strip():
+                    if entry:
+                        await asyncio.to_thread(self._delete_chunks, entry['ids'])
+                        stats['removed'] += 1
+                    continue
+                if self._is_unchanged(doc, entry):
+                    stats['unchanged'] += 1
+                    continue
+                
+                if entry:
+                    stats['updated'] += 1
+                else:
+                    stats['added'] += 1
+                
+                texts, metadatas, ids = await asyncio.to_thread(self._split_document, doc)
+                replacements.append((entry['ids'] if entry else [], ids))
+                for item in zip(texts, metadatas, ids):
+                    for part, value in zip(batch, item):
+                        part.append(value)
+                    if len(batch[0]) >= PIPELINE_EMBED_BATCH_SIZE:
+                        await batch_queue.put(batch)
+                        batch = ([], [], [])
+            
+            if batch[0]:
+                await batch_queue.put(batch)
+            for _ in range(PIPELINE_EMBED_WORKERS):
+                await batch_queue.put(None)
+        
+        async def embed_stage():
+            """Consumer: embed batches and write them to the vector store"""
+            while True:
+                batch = await batch_queue.get()
+                if batch is None:
+                    break
+                texts, metadatas, ids = batch
+                embeddings = await self.embeddings.aembed_documents(texts)
+                # Shielded: a write that has started finishes even if the
+                # pipeline is cancelled, so the clean-up below sees it
+                write = asyncio.ensure_future(
+                    asyncio.to_thread(self._write_chunks, texts, metadatas, ids, embeddings)
+                )
+                writes.append(write)
+                await asyncio.shield(write)
+                metrics.increment("chunks_indexed", len(texts))
+                stats['chunks_embedded'] += len(texts)
+        
+        stages = [asyncio.ensure_future(fetch_stage()), asyncio.ensure_future(split_stage())]
+        stages.extend(asyncio.ensure_future(embed_stage()) for _ in range(PIPELINE_EMBED_WORKERS))
+        try:
+            await asyncio.gather(*stages)
+        except BaseException:
+            for stage in stages:
+                stage.cancel()
+            await asyncio.gather(*stages, *writes, return_exceptions=True)
+            await asyncio.to_thread(self._settle_replacements, replacements, True)
+            raise
+        await asyncio.to_thread(self._settle_replacements, replacements)
+        
+        def finish():
+            with self._lock:
+                if not self._stored_documents():
+                    raise ValueError("No text content found in selected documents")
+                self._build_chain()
+        
+        await asyncio.to_thread(finish)
+        return stats
+    
+    def _delete_chunks(self, ids):
+        """Delete chunks by ID from the vector store and keyword index"""
+        with self._lock:
+            self.vector_store.delete(ids=ids)
+            self.keyword_index.remove(ids)
+    
+    def _write_chunks(self, texts, metadatas, ids, embeddings):
+        """Write pre-embedded chunks to the vector store"""
+        with self._lock, metrics.span("write_chunks"):
+            # langchain's Chroma wrapper has no add-with-embeddings API, so
+            # write through the collection it manages
+            store = self.vector_store if self.vector_store_backend == "numpy" \
+                else self.vector_store._collection
+            store.upsert(
+                ids=ids,
+                embeddings=embeddings,
+                metadatas=metadatas,
+                documents=texts
+            )
+            self.keyword_index.add(ids, texts, metadatas)
+    
+    async def aquery(self, question):
+        """
+        Asynchronously query the RAG system
         
         Args:
             question: User's question
             
         Returns:
-            Answer string
+            Tuple of (answer, source_documents, found_in_docs)
+        """
+        if not self.qa_chain:
+            raise ValueError("Knowledge base not initialized. Please add documents first.")
+        
+        started = time.perf_counter()
+        self._query_local.context_stats = None
+        embedding = None
+        cached = self.answer_cache.get_exact(self.version, question)
+        if cached is not None:
+            return cached['answer'], cached['source_docs'], cached['found_in_docs']
+        
+        scored_docs = self.keyword_fast_path(question)
+        if scored_docs is not None:
+            self.answer_cache.record_miss()
+        else:
+            embedding_started = time.perf_counter()
+            embedding = await self.embeddings.aembed_query(question)
+            metrics.observe("embed_query", time.perf_counter() - embedding_started)
+            cached = self.answer_cache.get_similar(self.version, embedding)
+            if cached is not None:
+                return cached['answer'], cached['source_docs'], cached['found_in_docs']
+            scored_docs = await asyncio.to_thread(self.retrieve_context, question, embedding)
+        
+        source_docs, relevant, chain, inputs = self._plan_generation(question, scored_docs)
+        
+        metrics.increment("llm_calls", chain="grounded" if relevant else "general")
+        generation_started = time.perf_counter()
+        answer, marker_found = self._split_marker(await chain.ainvoke(inputs))
+        metrics.observe("generate", time.perf_counter() - generation_started)
+        found_in_docs = relevant and not marker_found
+        self.answer_cache.put(self.version, question, embedding, answer, source_docs, found_in_docs)
+        
+        metrics.observe("query", time.perf_counter() - started)
+        return answer, source_docs, found_in_docs
+    
+    async def abatch_query(self, questions, max_concurrency=BATCH_MAX_CONCURRENCY):
+        """
+        Answer many questions, yielding each result as soon as it is ready
+        
+        Cached answers come back first. The remaining questions go through
+        the keyword fast path, then are embedded in one batched call and
+        retrieved with one vector search; at most max_concurrency LLM calls
+        are in flight. New answers go into the in-process answer cache, so
+        later queries on this RAGSystem can reuse them; other processes,
+        such as the Streamlit app, do not see them.
+        
+        Args:
+            questions: List of questions
+            max_concurrency: Maximum concurrent LLM calls
+            
+        Yields:
+            Dicts with 'index' (position in questions), 'question',
+            'answer', 'found_in_docs', 'sources' (chunk metadata),
+            'cached' and, if generation failed, 'error' instead of an answer
+        """
+        if not self.qa_chain:
+            raise ValueError("Knowledge base not initialized. Please add documents first.")
+        
+        version = self.version
+        
+        def result(index, answer, source_docs, found_in_docs, cached):
+            return {
+                'index': index,
+                'question': questions[index],
+                'answer': answer,
+                'found_in_docs': found_in_docs,
+                'sources': [dict(doc.metadata) for doc in source_docs],
+                'cached': cached
+            }
+        
+        pending = {}
+        for index, question in enumerate(questions):
+            entry = self.answer_cache.get_exact(version, question)
+            if entry is not None:
+                yield result(index, entry['answer'], entry['source_docs'], entry['found_in_docs'], True)
+                continue
+            scored_docs = self.keyword_fast_path(question)
+            if scored_docs is not None:
+                self.answer_cache.record_miss()
+            pending[index] = (None, scored_docs)
+        
+        to_embed = [index for index, (_, scored_docs) in pending.items() if scored_docs is None]
+        if to_embed:
+            # Timed by hand: a span must not stay open across an await
+            embedding_started = time.perf_counter()
+            # Questions are queries: keep them out of the chunk embedding cache
+            query_embeddings = self.embeddings.embeddings \
+                if isinstance(self.embeddings, CachedEmbeddings) else self.embeddings
+            embeddings = await query_embeddings.aembed_documents([questions[i] for i in to_embed])
+            metrics.observe("embed_query_batch", time.perf_counter() - embedding_started)
+            
+            to_retrieve = []
+            for index, embedding in zip(to_embed, embeddings):
+                entry = self.answer_cache.get_similar(version, embedding)
+                if entry is not None:
+                    del pending[index]
+                    yield result(index, entry['answer'], entry['source_docs'], entry['found_in_docs'], True)
+                else:
+                    pending[index] = (embedding, None)
+                    to_retrieve.append(index)
+            
+            if to_retrieve:
+                retrieved = await asyncio.to_thread(
+                    self.retrieve_context_batch,
+                    [questions[i] for i in to_retrieve],
+                    [pending[i][0] for i in to_retrieve]
+                )
+                for index, scored_docs in zip(to_retrieve, retrieved):
+                    pending[index] = (pending[index][0], scored_docs)
+        
+        semaphore = asyncio.Semaphore(max_concurrency)
+        
+        async def generate(index, embedding, scored_docs):
+            question = questions[index]
+            source_docs, relevant, chain, inputs = self._plan_generation(question, scored_docs)
+            async with semaphore:
+                metrics.increment("llm_calls", chain="grounded" if relevant else "general")
+                started = time.perf_counter()
+                try:
+                    answer, marker_found = self._split_marker(await chain.ainvoke(inputs))
+                except Exception as e:
+                    # One failed question must not end a nightly run
+                    metrics.increment("batch_query_errors")
+                    return dict(result(index, None, source_docs, False, False), error=str(e))
+                finally:
+                    metrics.observe("generate", time.perf_counter() - started)
+            found_in_docs = relevant and not marker_found
+            self.answer_cache.put(version, question, embedding, answer, source_docs, found_in_docs)
+            return result(index, answer, source_docs, found_in_docs, False)
+        
+        tasks = [
+            asyncio.ensure_future(generate(index, embedding, scored_docs))
+            for index, (embedding, scored_docs) in pending.items()
+        ]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+    
+    def batch_query(self, questions, max_concurrency=BATCH_MAX_CONCURRENCY):
+        """
+        Answer many questions; see abatch_query
+        
+        Args:
+            questions: List of questions
+            max_concurrency: Maximum concurrent LLM calls
+            
+        Returns:
+            List of result dicts in the order of questions
         """
-        # Use LLM directly without retrieval
-        from langchain_core.messages import HumanMessage
+        async def collect():
+            return [item async for item in self.abatch_query(questions, max_concurrency)]
+        
+        return sorted(asyncio.run(collect()), key=lambda item: item['index'])
+
+
+def _read_questions(path):
+    """
+    Read a questions file: one JSON object with a "question" key, or one
+    JSON string, per line
+    
+    Returns:
+        List of dicts, each with at least a 'question' key
+    """
+    records = []
+    with open(path, encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if isinstance(record, str):
+                record = {'question': record}
+            if not isinstance(record, dict) or not isinstance(record.get('question'), str):
+                raise ValueError(f"{path}:{line_number}: expected a \"question\" string")
+            records.append(record)
+    return records
+
+
+def _list_knowledge_bases(output):
+    """
+    Write one JSON line per persisted knowledge base: its collection name,
+    when it was last used and the documents it holds
+    
+    Args:
+        output: Text stream to write to
+    """
+    client = chromadb.PersistentClient(path=VECTOR_STORE_PATH)
+    for collection in client.list_collections():
+        # Newer Chroma versions return names, older ones Collection objects
+        name = getattr(collection, 'name', collection)
+        if not name.startswith("kb_"):
+            continue
         
-        messages = [HumanMessage(content=question)]
-        response = self.llm.invoke(messages)
+        # Every knowledge base has a Chroma collection carrying its
+        # last_used metadata; with the numpy backend the chunks live on disk
+        chroma_collection = client.get_collection(name)
+        if VECTOR_STORE_BACKEND == "numpy":
+            store = NumpyVectorStore(None, path=os.path.join(NUMPY_VECTOR_STORE_PATH, name))
+        else:
+            store = chroma_collection
+        metadatas = store.get(include=["metadatas"])['metadatas']
         
-        return response.content
+        documents = {}
+        for metadata in metadatas:
+            if metadata and metadata.get('document_id'):
+                documents[metadata['document_id']] = metadata.get('document_name')
+        output.write(json.dumps({
+            'collection': name,
+            'last_used': (chroma_collection.metadata or {}).get('last_used'),
+            'chunks': len(metadatas),
+            'documents': [{'id': doc_id, 'name': documents[doc_id]} for doc_id in sorted(documents)]
+        }) + "\n")
+
+
+def main(argv=None):
+    """
+    Command-line entry point:
+    python -m rag_system list
+    python -m rag_system answer --questions file.jsonl (--collection NAME | --user ID --documents ID...)
+    """
+    parser = argparse.ArgumentParser(prog="python -m rag_system", description="Headless RAG queries")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="List the persisted knowledge bases as JSONL")
+    
+    answer = commands.add_parser("answer", help="Answer a JSONL file of questions")
+    answer.add_argument("--questions", required=True,
+                        help='JSONL file with one {"question": ...} object per line; '
+                             'other keys are copied to the output')
+    answer.add_argument("--collection",
+                        help="Persisted knowledge base (collection) to query, as shown by 'list'")
+    answer.add_argument("--user", help="User ID (Drive permission ID) the knowledge base was built for")
+    answer.add_argument("--documents", nargs="+", metavar="DOCUMENT_ID",
+                        help="Google Doc IDs the knowledge base was built from; with --user")
+    answer.add_argument("--concurrency", type=int, default=BATCH_MAX_CONCURRENCY,
+                        help="Maximum concurrent LLM calls")
+    answer.add_argument("--output", help="Write JSONL here instead of stdout")
+    args = parser.parse_args(argv)
+    
+    if args.command == "list":
+        _list_knowledge_bases(sys.stdout)
+        return
+    
+    if args.collection:
+        if args.user or args.documents:
+            answer.error("--collection cannot be combined with --user/--documents")
+        collection_name = args.collection
+    elif args.user and args.documents:
+        # Imported here: the registry module imports this one
+        from knowledge_base_registry import KnowledgeBaseRegistry
+        collection_name = KnowledgeBaseRegistry.collection_name(args.user, args.documents)
+    else:
+        answer.error("needs --collection, or --user together with --documents")
+    
+    records = _read_questions(args.questions)
+    rag = RAGSystem(collection_name=collection_name)
+    try:
+        loaded = rag.load_knowledge_base()
+    except ValueError as e:
+        parser.exit(1, f"{e}\n")
+    if not loaded:
+        parser.exit(1, f"No knowledge base found in collection {collection_name!r}\n")
+    
+    output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    
+    async def run():
+        async for item in rag.abatch_query([record['question'] for record in records], args.concurrency):
+            # Input fields such as an ID or expected answer are kept for joining
+            line = dict(records[item['index']], **item)
+            output.write(json.dumps(line, default=str) + "\n")
+            output.flush()
+    
+    try:
+        asyncio.run(run())
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
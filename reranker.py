@@ -0,0 +1,228 @@
+"""
+Reranker
+CPU-only reranking of retrieval candidates and token-budgeted selection
+"""
+
+import math
+
+import tiktoken
+
+from keyword_index import tokenize
+
+# Words that carry no signal when matching a question against a chunk
+STOPWORDS = frozenset("""
+a an and are as at be by can do does for from has have how i in is it its
+me my of on or our that the their there this to was what when where which
+who why will with you your
+""".split())
+
+
+class LexicalReranker:
+    """
+    Reranks candidates by how well they cover the question's terms
+    
+    Each query term is weighted by its IDF over the candidate set, so terms
+    every candidate shares count for little. Matching query bigrams reward
+    phrase matches. The lexical score is blended with the vector relevance
+    so paraphrased questions still rank by meaning.
+    """
+    
+    def __init__(self, semantic_weight=0.5):
+        """
+        Initialize the reranker
+        
+        Args:
+            semantic_weight: Weight of the vector relevance in the final
+                score; the lexical score gets the rest
+        """
+        self.semantic_weight = semantic_weight
+    
+    def score(self, question, scored_docs):
+        """
+        Score candidates against a question
+        
+        Args:
+            question: User's question
+            scored_docs: List of (Document, relevance) tuples
+            
+        Returns:
+            List of scores, one per candidate (higher is better)
+        """
+        query_tokens = [token for token in tokenize(question) if token not in STOPWORDS]
+        query_terms = set(query_tokens)
+        if not query_terms:
+            return [relevance for _, relevance in scored_docs]
+        query_bigrams = set(zip(query_tokens, query_tokens[1:]))
+        
+        doc_tokens = [tokenize(doc.page_content) for doc, _ in scored_docs]
+        doc_terms = [set(tokens) for tokens in doc_tokens]
+        count = len(doc_terms)
+        idf = {}
+        for term in query_terms:
+            frequency = sum(term in terms for terms in doc_terms)
+            idf[term] = math.log(1 + (count - frequency + 0.5) / (frequency + 0.5))
+        total_idf = sum(idf.values())
+        
+        scores = []
+        for (_, relevance), tokens, terms in zip(scored_docs, doc_tokens, doc_terms):
+            coverage = sum(idf[term] for term in query_terms if term in terms) / total_idf
+            phrase = 0.0
+            if query_bigrams:
+                phrase = len(query_bigrams & set(zip(tokens, tokens[1:]))) / len(query_bigrams)
+            lexical = 0.7 * coverage + 0.3 * phrase
+            scores.append(self.semantic_weight * relevance + (1 - self.semantic_weight) * lexical)
+        return scores
+
+
+class CrossEncoderReranker:
+    """
+    Reranks candidates with a locally stored cross-encoder model on CPU
+    
+    Requires the sentence-transformers package. The model is loaded from
+    local files only, so reranking never touches the network.
+    """
+    
+    def __init__(self, model_path):
+        """
+        Load the model
+        
+        Args:
+            model_path: Path or cached name of a cross-encoder model
+        """
+        try:
+            from sentence_transformers import CrossEncoder
+        except ImportError as e:
+            raise ValueError(
+                "A cross-encoder reranker needs the sentence-transformers package; "
+                "set RERANKER_MODEL to 'lexical' to rerank without it"
+            ) from e
+        self.model = CrossEncoder(model_path, device="cpu", local_files_only=True)
+    
+    def score(self, question, scored_docs):
+        """
+        Score candidates against a question
+        
+        Args:
+            question: User's question
+            scored_docs: List of (Document, relevance) tuples
+            
+        Returns:
+            List of scores, one per candidate (higher is better)
+        """
+        if not scored_docs:
+            return []
+        pairs = [(question, doc.page_content) for doc, _ in scored_docs]
+        return [float(score) for score in self.model.predict(pairs)]
+
+
+def create_reranker(model, semantic_weight=0.5):
+    """
+    Build the reranker named in the config
+    
+    Args:
+        model: "lexical", or a path to a local cross-encoder model
+        semantic_weight: Vector relevance weight for the lexical reranker
+    """
+    if model == "lexical":
+        return LexicalReranker(semantic_weight=semantic_weight)
+    return CrossEncoderReranker(model)
+
+
+class RerankStage:
+    """
+    Turns a wide candidate set into the context for one prompt
+    
+    Candidates are reranked, chunks that overlap a better-ranked chunk of
+    the same document are dropped, and the rest are taken in rank order
+    while they fit the token budget. Chunks and separators are counted as
+    ContextBuilder counts them with the same budget, so whatever is
+    selected also fits the prompt.
+    """
+    
+    def __init__(self, reranker, token_budget, dedup_overlap=0.5, encoding_name="cl100k_base",
+                 separator="\n\n"):
+        """
+        Initialize the stage
+        
+        Args:
+            reranker: Object with a score(question, scored_docs) method
+            token_budget: Maximum context tokens across selected chunks
+            dedup_overlap: Fraction of the shorter chunk two chunks of the
+                same document must share to count as duplicates
+            encoding_name: tiktoken encoding used for counting
+            separator: Text the context builder places between passages
+        """
+        self.reranker = reranker
+        self.token_budget = token_budget
+        self.dedup_overlap = dedup_overlap
+        self.encoding = tiktoken.get_encoding(encoding_name)
+        self.separator_tokens = self.count_tokens(separator)
+    
+    def count_tokens(self, text):
+        """Count tokens in a text"""
+        return len(self.encoding.encode(text, disallowed_special=()))
+    
+    @staticmethod
+    def _shingles(text, size=5):
+        """Word n-grams used to measure text overlap"""
+        words = text.lower().split()
+        return {tuple(words[i:i + size]) for i in range(max(len(words) - size + 1, 1))}
+    
+    def _overlap(self, first, second):
+        """
+        Fraction of the shorter of two chunks that the other also covers
+        
+        Uses document offsets when both chunks have them, otherwise shared
+        word n-grams (e.g. the overlap the character splitter adds). Equal
+        ranges fall back to n-grams too: chunks indexed before long
+        paragraphs got per-piece offsets carry their paragraph's range.
+        """
+        a, b = first.metadata, second.metadata
+        keys = ('start_index', 'end_index')
+        if (all(key in meta for meta in (a, b) for key in keys)
+                and (a['start_index'], a['end_index']) != (b['start_index'], b['end_index'])):
+            shared = min(a['end_index'], b['end_index']) - max(a['start_index'], b['start_index'])
+            shorter = min(a['end_index'] - a['start_index'], b['end_index'] - b['start_index'])
+            return max(shared, 0) / shorter if shorter > 0 else 0.0
+        
+        first_shingles = self._shingles(first.page_content)
+        second_shingles = self._shingles(second.page_content)
+        shorter = min(len(first_shingles), len(second_shingles))
+        return len(first_shingles & second_shingles) / shorter if shorter else 0.0
+    
+    def select(self, question, scored_docs):
+        """
+        Rerank, deduplicate and pack candidates
+        
+        Args:
+            question: User's question
+            scored_docs: List of (Document, relevance) tuples
+            
+        Returns:
+            List of (Document, relevance) tuples in rerank order; the best
+            candidate is always kept, even if it alone exceeds the budget
+        """
+        scores = self.reranker.score(question, scored_docs)
+        ranked = [
+            item for _, item in sorted(
+                zip(scores, scored_docs), key=lambda pair: pair[0], reverse=True
+            )
+        ]
+        
+        selected = []
+        used_tokens = 0
+        for doc, relevance in ranked:
+            document_id = doc.metadata.get('document_id')
+            if any(
+                kept.metadata.get('document_id') == document_id
+                and self._overlap(doc, kept) >= self.dedup_overlap
+                for kept, _ in selected
+            ):
+                continue
+            
+            tokens = self.count_tokens(doc.page_content) + (self.separator_tokens if selected else 0)
+            if selected and used_tokens + tokens > self.token_budget:
+                continue
+            selected.append((doc, relevance))
+            used_tokens += tokens
+        return selected
@@ -0,0 +1,92 @@
+"""
+Retry, failure and backpressure tests for document fetching
+"""
+
+import asyncio
+import time
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from config import GOOGLE_API_MAX_RETRY_DELAY
+from google_docs_manager import GoogleDocsManager
+
+
+def test_async_fetch_waits_for_a_slow_consumer():
+    manager = object.__new__(GoogleDocsManager)
+    fetched = []
+    
+    def get_cached_segments(document_id, version):
+        time.sleep(0.005)
+        fetched.append(document_id)
+        return []
+    
+    manager._get_cached_segments = get_cached_segments
+    
+    async def consume():
+        consumed = 0
+        ahead = 0
+        async for _ in manager.aiter_documents_segments([f"doc{i}" for i in range(20)], max_concurrency=2):
+            consumed += 1
+            ahead = max(ahead, len(fetched) - consumed)
+            await asyncio.sleep(0.02)
+        return consumed, ahead
+    
+    consumed, ahead = asyncio.run(consume())
+    
+    assert consumed == 20
+    # Two results waiting in the queue plus two workers each holding one
+    assert ahead <= 4
+
+
+class FlakyRequest:
+    """Request whose first executions fail with the given errors"""
+    
+    def __init__(self, errors, result):
+        self.errors = list(errors)
+        self.result = result
+        self.calls = 0
+    
+    def execute(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return self.result
+
+
+def test_transport_errors_are_retried(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr("google_docs_manager.time.sleep", sleeps.append)
+    request = FlakyRequest([ConnectionResetError(), TimeoutError()], {'ok': True})
+    
+    assert GoogleDocsManager._execute_with_retry(request, max_retries=2) == {'ok': True}
+    assert request.calls == 3
+    assert len(sleeps) == 2
+
+
+def test_retry_after_is_capped(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr("google_docs_manager.time.sleep", sleeps.append)
+    response = httplib2.Response({'status': 429, 'retry-after': "86400"})
+    request = FlakyRequest([HttpError(response, b"")], {'ok': True})
+    
+    GoogleDocsManager._execute_with_retry(request, max_retries=1)
+    
+    assert sleeps == [GOOGLE_API_MAX_RETRY_DELAY]
+
+
+def test_documents_that_keep_failing_to_connect_are_reported_as_none():
+    manager = object.__new__(GoogleDocsManager)
+    
+    def get_cached_segments(document_id, version):
+        if document_id == "doc1":
+            raise ConnectionResetError("connection reset by peer")
+        return []
+    
+    manager._get_cached_segments = get_cached_segments
+    
+    async def consume():
+        return dict([item async for item in manager.aiter_documents_segments(["doc0", "doc1"])])
+    
+    assert dict(manager.iter_documents_segments(["doc0", "doc1"])) == {"doc0": [], "doc1": None}
+    assert asyncio.run(consume()) == {"doc0": [], "doc1": None}
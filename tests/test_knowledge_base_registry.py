@@ -0,0 +1,54 @@
+"""
+Garbage-collection tests for the knowledge base registry
+"""
+
+import chromadb
+import pytest
+from chromadb.config import Settings
+
+import knowledge_base_registry
+from benchmark import FakeChatModel, FakeEmbeddings
+from drive_sync import DriveChangeSync
+from knowledge_base_registry import KnowledgeBaseRegistry
+from rag_system import RAGSystem
+
+
+class IdleDocsManager:
+    """Changes feed with nothing to report"""
+    
+    def list_changes(self, page_token):
+        return [], page_token
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    """A registry with one knowledge base over an in-memory Chroma client"""
+    client = chromadb.EphemeralClient(settings=Settings(anonymized_telemetry=False))
+    for collection in client.list_collections():
+        client.delete_collection(getattr(collection, 'name', collection))
+    
+    def create_rag_system(collection_name="base", shared_with=None):
+        return RAGSystem(collection_name, shared_with=shared_with, embeddings=FakeEmbeddings(32),
+                         llm=FakeChatModel(), client=client, vector_store_backend="chroma")
+    
+    monkeypatch.setattr(knowledge_base_registry, "RAGSystem", create_rag_system)
+    registry = KnowledgeBaseRegistry()
+    rag = registry.get("user", ["doc0"])
+    rag.create_knowledge_base(iter([{'id': "doc0", 'name': "Doc", 'content': "alpha beta gamma"}]))
+    return registry
+
+
+def test_collections_held_by_a_running_drive_sync_are_not_collected(registry):
+    rag = registry.get("user", ["doc0"])
+    sync = DriveChangeSync(IdleDocsManager(), rag, {"doc0": "Doc"}, state_file=None, page_token="token",
+                           registry=registry)
+    sync.start(interval=3600)
+    registry.ttl = 0
+    
+    try:
+        assert registry.collect_garbage() == []
+        assert rag.query("alpha?")[0]
+    finally:
+        sync.stop()
+    
+    assert registry.collect_garbage() == [rag.collection_name]
@@ -0,0 +1,248 @@
+"""
+Call-count tests for RAGSystem queries
+
+Each query path must embed the question once and search the vector store
+once; a fake embedding backend and LLM keep the tests offline.
+"""
+
+import asyncio
+import re
+
+import chromadb
+import pytest
+from chromadb.config import Settings
+
+from benchmark import FakeChatModel, FakeEmbeddings, SyntheticCorpus
+from document_structure import extract_segments, render_segments
+from drive_sync import DriveChangeSync
+from rag_system import RAGSystem
+
+
+@pytest.fixture(params=["chroma", "numpy"])
+def rag(request, tmp_path):
+    """A small knowledge base with counting embeddings and vector searches"""
+    corpus = SyntheticCorpus(documents=4, sections=3, paragraphs=3, seed=1)
+    client = chromadb.EphemeralClient(settings=Settings(anonymized_telemetry=False))
+    system = RAGSystem(
+        f"test_{request.param}_{id(tmp_path)}",
+        embeddings=FakeEmbeddings(128),
+        llm=FakeChatModel(),
+        client=client,
+        vector_store_backend=request.param,
+        numpy_store_path=str(tmp_path)
+    )
+    
+    documents = []
+    for index in range(4):
+        segments = extract_segments(corpus.document(index))
+        documents.append({
+            'id': f"doc{index}",
+            'name': f"Document {index}",
+            'content': render_segments(segments),
+            'segments': segments,
+            'modified_time': "v1"
+        })
+    system.create_knowledge_base(iter(documents))
+    system.documents = documents
+    
+    store = system.vector_store
+    search = store.similarity_search_by_vector_with_relevance_scores
+    system.searches = 0
+    
+    def counting_search(*args, **kwargs):
+        system.searches += 1
+        return search(*args, **kwargs)
+    
+    store.similarity_search_by_vector_with_relevance_scores = counting_search
+    system.embeddings.query_calls = 0
+    system.embeddings.document_calls = 0
+    return system
+
+
+def test_query_embeds_and_searches_once(rag):
+    answer, sources, _ = rag.query("What is said about the first section paragraphs?")
+    
+    assert answer
+    assert sources
+    assert rag.embeddings.query_calls == 1
+    assert rag.embeddings.document_calls == 0
+    assert rag.searches == 1
+
+
+def test_stream_query_embeds_and_searches_once(rag):
+    sources, _, stream = rag.stream_query("Which topics does the second section cover?")
+    answer = "".join(stream)
+    
+    assert answer
+    assert sources
+    assert rag.embeddings.query_calls == 1
+    assert rag.embeddings.document_calls == 0
+    assert rag.searches == 1
+
+
+def test_aquery_embeds_and_searches_once(rag):
+    answer, sources, _ = asyncio.run(rag.aquery("Summarize the third section please"))
+    
+    assert answer
+    assert sources
+    assert rag.embeddings.query_calls == 1
+    assert rag.embeddings.document_calls == 0
+    assert rag.searches == 1
+
+
+def test_repeated_question_is_served_from_the_answer_cache(rag):
+    question = "What is said about the first section paragraphs?"
+    first = rag.query(question)
+    second = rag.query(question)
+    
+    assert second[0] == first[0]
+    assert rag.embeddings.query_calls == 1
+    assert rag.searches == 1
+
+
+def test_failed_fetch_keeps_indexed_chunks_on_sync(rag):
+    before = rag._stored_documents()
+    edited = [dict(doc) for doc in rag.documents]
+    edited[1]['content'] = None
+    edited[1]['segments'] = None
+    
+    stats = rag.sync_knowledge_base(edited)
+    
+    assert stats['failed'] == 1
+    assert stats['removed'] == 0
+    assert rag._stored_documents()['doc1']['ids'] == before['doc1']['ids']
+
+
+def test_failed_fetch_keeps_indexed_chunks_on_upsert(rag):
+    before = rag._stored_documents()
+    
+    stats = rag.upsert_documents([{'id': 'doc2', 'name': 'Document 2', 'content': None}])
+    
+    assert stats == dict(stats, failed=1, removed=0)
+    assert rag._stored_documents()['doc2']['ids'] == before['doc2']['ids']
+
+
+def test_failed_fetch_keeps_indexed_chunks_on_async_build(rag):
+    before = rag._stored_documents()
+    documents = [dict(doc) for doc in rag.documents]
+    documents[3]['content'] = None
+    
+    stats = asyncio.run(rag.acreate_knowledge_base(documents))
+    
+    assert stats['failed'] == 1
+    assert stats['removed'] == 0
+    assert rag._stored_documents()['doc3']['ids'] == before['doc3']['ids']
+
+
+
+@pytest.mark.parametrize("fail_after_batches", [0, 1])
+def test_failed_embedding_keeps_the_old_chunks_of_an_edited_document(rag, monkeypatch, fail_after_batches):
+    before = rag._stored_documents()
+    edited = dict(rag.documents[1], content=rag.documents[1]['content'] + "\nA new closing line.",
+                  segments=None, modified_time="v2")
+    embed_documents = rag.embeddings.embed_documents
+    batches = []
+    
+    def failing_embed_documents(texts):
+        if len(batches) == fail_after_batches:
+            raise RuntimeError("rate limited")
+        batches.append(texts)
+        return embed_documents(texts)
+    
+    monkeypatch.setattr("rag_system.PIPELINE_EMBED_BATCH_SIZE", 2)
+    monkeypatch.setattr(rag.embeddings, "embed_documents", failing_embed_documents)
+    
+    with pytest.raises(RuntimeError):
+        rag.upsert_documents([edited])
+    
+    after = rag._stored_documents()
+    assert {doc_id: entry['ids'] for doc_id, entry in after.items()} == \
+        {doc_id: entry['ids'] for doc_id, entry in before.items()}
+
+
+
+def test_failed_async_embedding_keeps_the_old_chunks_of_an_edited_document(rag, monkeypatch):
+    before = rag._stored_documents()
+    documents = [dict(doc) for doc in rag.documents]
+    documents[2] = dict(documents[2], content=documents[2]['content'] + "\nA new closing line.",
+                        segments=None, modified_time="v2")
+    
+    async def failing_aembed_documents(texts):
+        raise RuntimeError("rate limited")
+    
+    monkeypatch.setattr(rag.embeddings, "aembed_documents", failing_aembed_documents)
+    
+    with pytest.raises(RuntimeError):
+        asyncio.run(rag.acreate_knowledge_base(documents))
+    
+    assert rag._stored_documents()['doc2']['ids'] == before['doc2']['ids']
+
+
+def test_edited_document_replaces_its_chunks(rag):
+    before = rag._stored_documents()
+    edited = dict(rag.documents[1], content=rag.documents[1]['content'] + "\nA new closing line.",
+                  segments=None, modified_time="v2")
+    
+    stats = rag.upsert_documents([edited])
+    
+    after = rag._stored_documents()
+    assert stats['updated'] == 1
+    assert not set(after['doc1']['ids']) & set(before['doc1']['ids'])
+    assert after['doc1']['versions'] == {"v2"}
+
+
+
+def test_keyword_hits_removed_during_a_query_are_skipped(rag, monkeypatch):
+    index = rag.keyword_index
+    search = index.search
+    
+    def search_then_remove(query, k):
+        # A background sync deletes the hits between search and lookup
+        results = search(query, k)
+        index.remove([chunk_id for chunk_id, _ in results])
+        return results
+    
+    monkeypatch.setattr(index, "search", search_then_remove)
+    # Only keyword hits, so every result is looked up in the keyword index
+    monkeypatch.setattr(rag.vector_store, "similarity_search_by_vector_with_relevance_scores",
+                        lambda *args, **kwargs: [])
+    code = re.search(r"ERR-[0-9-]+", rag.documents[0]['content']).group()
+    
+    assert rag.keyword_fast_path(f"Where is {code} described?") is None
+    assert rag.retrieve_with_scores(f"Where is {code} described?") == []
+
+
+class FakeDocsManager:
+    """Changes feed reporting every document as edited; doc1 fails to fetch"""
+    
+    def __init__(self, documents):
+        self.documents = documents
+    
+    def list_changes(self, page_token):
+        changes = [
+            {'id': doc['id'], 'name': doc['name'], 'removed': False, 'trashed': False,
+             'modified_time': "v2"}
+            for doc in self.documents
+        ]
+        return changes, "token2"
+    
+    def iter_documents_segments(self, document_ids, versions=None):
+        for doc in self.documents:
+            if doc['id'] in document_ids:
+                yield doc['id'], None if doc['id'] == 'doc1' else doc['segments']
+
+
+def test_failed_fetch_keeps_chunks_and_page_token_on_drive_sync(rag):
+    before = rag._stored_documents()
+    sync = DriveChangeSync(
+        FakeDocsManager(rag.documents), rag,
+        {doc['id']: doc['name'] for doc in rag.documents},
+        state_file=None, page_token="token1"
+    )
+    
+    stats = sync.poll()
+    
+    assert stats['failed'] == 1
+    assert stats['removed'] == 0
+    assert sync.page_token == "token1"
+    assert rag._stored_documents()['doc1']['ids'] == before['doc1']['ids']
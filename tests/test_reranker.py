@@ -0,0 +1,82 @@
+"""
+Chunk splitting and deduplication tests for the rerank stage
+"""
+
+import tiktoken
+from langchain_core.documents import Document
+
+from context_builder import ContextBuilder
+from document_structure import SectionChunker
+from reranker import LexicalReranker, RerankStage
+
+
+def test_pieces_of_a_long_paragraph_are_not_deduplicated():
+    words = [f"word{index}" for index in range(50)]
+    text = ' '.join(words)
+    segment = {
+        'type': 'paragraph',
+        'text': text,
+        'heading_path': [],
+        'start_index': 1,
+        'end_index': 1 + len(text)
+    }
+    chunks = list(SectionChunker(max_tokens=20).chunk([segment]))
+    scored_docs = [
+        (Document(page_content=chunk['text'], metadata=dict(chunk, document_id="doc")), 0.5)
+        for chunk in chunks
+    ]
+    
+    selected = RerankStage(LexicalReranker(), token_budget=1000).select("word1", scored_docs)
+    
+    assert len(chunks) > 1
+    assert len({(chunk['start_index'], chunk['end_index']) for chunk in chunks}) == len(chunks)
+    assert len(selected) == len(chunks)
+
+
+def test_chunks_with_equal_ranges_fall_back_to_text_overlap():
+    metadata = {'document_id': "doc", 'start_index': 1, 'end_index': 200}
+    scored_docs = [
+        (Document(page_content="alpha beta gamma delta epsilon zeta", metadata=metadata), 0.5),
+        (Document(page_content="one two three four five six seven", metadata=metadata), 0.5)
+    ]
+    
+    selected = RerankStage(LexicalReranker(), token_budget=1000).select("alpha", scored_docs)
+    
+    assert len(selected) == 2
+
+
+def test_every_selected_chunk_fits_the_context_budget():
+    scored_docs = [
+        (Document(
+            page_content=' '.join(f"topic{index} word{word}" for word in range(10)),
+            metadata={'document_id': f"doc{index}"}
+        ), 0.5)
+        for index in range(10)
+    ]
+    budget = 90
+    
+    selected = RerankStage(LexicalReranker(), token_budget=budget).select("topic1", scored_docs)
+    _, stats = ContextBuilder(token_budget=budget).build([doc for doc, _ in selected])
+    
+    assert 1 < len(selected) < len(scored_docs)
+    assert stats['passages'] == len(selected)
+    assert stats['tokens'] <= budget
+
+
+def test_long_paragraphs_are_cut_between_characters(monkeypatch):
+    # One token per byte, so every multi-byte character spans several tokens
+    byte_encoding = tiktoken.Encoding(
+        "bytes", pat_str=r"\S+|\s+", mergeable_ranks={bytes([i]): i for i in range(256)},
+        special_tokens={}
+    )
+    monkeypatch.setattr("document_structure.tiktoken.get_encoding", lambda name: byte_encoding)
+    text = "日本語のテキスト、café と 🙂 を含む長い段落です。" * 3
+    segment = {'type': 'paragraph', 'text': text, 'heading_path': [],
+               'start_index': 1, 'end_index': 1 + len(text)}
+    
+    chunks = list(SectionChunker(max_tokens=10).chunk([segment]))
+    
+    assert len(chunks) > 1
+    assert all("�" not in chunk['text'] for chunk in chunks)
+    assert "".join(chunk['text'] for chunk in chunks) == text
+    assert [chunk['start_index'] for chunk in chunks[1:]] == [chunk['end_index'] for chunk in chunks[:-1]]